@@ -1,6 +1,7 @@
 import streamlit as st
 from logo import add_logo
-from pages import ISO_Document_Intelligence, ISO_Failure_Code_Intelligence  # Import other page modules as needed
+# The pages in pages/ are found by Streamlit itself; importing them here would run
+# them (and load langchain, FAISS and the rest) before the home page renders
 
 # Add your logo
 add_logo()
@@ -0,0 +1,99 @@
+import functools
+
+context_token_budget = 1500
+tokenizer_model = "gpt-4"
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding(model):
+    try:
+        import tiktoken
+
+        return tiktoken.encoding_for_model(model)
+    except Exception:
+        # No tokenizer files available (e.g. offline); fall back to an estimate
+        return None
+
+
+# Function to count prompt tokens the way the OpenAI models do
+def count_tokens(text, model=tokenizer_model):
+    encoding = _encoding(model)
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text))
+
+
+def _fit_lines(lines, budget, omitted_label):
+    kept = []
+    used = 0
+    for line in lines:
+        cost = count_tokens(line) + 1
+        if used + cost > budget:
+            kept.append(f"... {len(lines) - len(kept)} more {omitted_label} omitted")
+            break
+        kept.append(line)
+        used += cost
+    return kept
+
+
+# Codes and classes of a matrix sheet that a question refers to. With no
+# reference in one dimension, the whole dimension is kept.
+def relevant_rows_and_columns(sheet, question, engine=None):
+    rows = list(range(len(sheet.codes)))
+    columns = list(range(len(sheet.class_codes)))
+    if engine is None:
+        return rows, columns
+
+    codes, classes = engine.extract(question)
+    named_codes = [i for i, code in enumerate(sheet.codes) if code in codes]
+    class_codes = {engine.class_codes[c] for c in classes}
+    named_columns = [i for i, code in enumerate(sheet.class_codes) if code in class_codes]
+    if named_columns:
+        columns = named_columns
+    if named_codes:
+        rows = named_codes
+    return rows, columns
+
+
+# Function to build a compact, token-budgeted description of a sheet for the
+# agent prompt: one line per equipment class listing its failure codes, then
+# a legend of those codes. Returns the text and the pruned frame for the agent.
+def build_context(sheet, question, engine=None, token_budget=context_token_budget):
+    if not sheet.is_matrix:
+        frame = sheet.to_frame()
+        lines = [" | ".join(map(str, frame.columns))]
+        lines += [" | ".join(map(str, row)) for row in frame.itertuples(index=False)]
+        return "\n".join(_fit_lines(lines, token_budget, "rows")), frame
+
+    rows, columns = relevant_rows_and_columns(sheet, question, engine)
+    class_lines = []
+    for c in columns:
+        present = [sheet.codes[i] for i in rows if sheet.incidence[i, c]]
+        class_lines.append(f"{sheet.class_codes[c]} ({sheet.class_names[c]}): {', '.join(present) or 'none'}")
+    legend_lines = []
+    seen = set()
+    for i in rows:
+        if sheet.codes[i] in seen:
+            continue
+        seen.add(sheet.codes[i])
+        example = f" - e.g. {sheet.examples[i]}" if sheet.examples[i] else ""
+        legend_lines.append(f"{sheet.codes[i]}: {sheet.descriptions[i]}{example}")
+
+    # Class lines carry the answer; the legend gets whatever budget is left
+    header = "Failure modes per equipment class (code (name): failure codes):"
+    class_lines = _fit_lines(class_lines, token_budget // 2, "classes")
+    used = count_tokens(header) + sum(count_tokens(line) + 1 for line in class_lines)
+    legend_lines = _fit_lines(legend_lines, max(0, token_budget - used), "failure codes")
+    context = "\n".join([header] + class_lines + ["", "Failure codes:"] + legend_lines)
+
+    frame = sheet.to_frame()
+    keep_columns = list(frame.columns[:3]) + [frame.columns[3 + c] for c in columns]
+    frame = frame.loc[[0] + [i + 1 for i in rows], keep_columns].reset_index(drop=True)
+    return context, frame
+
+
+# Token count of the whole frame written out as a dense grid, for comparison.
+# (Formatting the frame with f"{df}" costs less only because pandas truncates it.)
+def dense_context_tokens(df):
+    return count_tokens(df.to_string())
+
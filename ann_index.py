@@ -0,0 +1,283 @@
+import json
+import logging
+import math
+import os
+import time
+
+import faiss
+import numpy as np
+
+ann_settings_name = "ann.json"
+logger = logging.getLogger(__name__)
+
+# Index type for the document index: "flat" (exact), "ivfpq" or "hnsw"
+index_type = os.environ.get("ISO_INDEX_TYPE", "flat")
+ivf_nlist = 1024
+pq_m = 64
+pq_nbits = 8
+hnsw_m = 32
+hnsw_ef_construction = 200
+# Search-time knobs, overridable per process without rebuilding the index
+nprobe = int(os.environ.get("ISO_NPROBE", 16))
+ef_search = int(os.environ.get("ISO_EF_SEARCH", 64))
+max_training_points = 100_000
+add_batch_size = 65_536
+
+# Approximate nearest-neighbour indexes for the document store. Small corpora
+# stay on the exact flat index; once there is enough data to train on, the
+# index can be converted to IVF-PQ or HNSW, and loaded memory-mapped.
+
+
+def index_type_of(index):
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if faiss.try_extract_index_ivf(index) is not None:
+        return "ivfpq"
+    return "flat"
+
+
+def _nlist_for(vector_count):
+    return max(1, min(ivf_nlist, int(4 * math.sqrt(vector_count))))
+
+
+def _pq_m_for(dim):
+    # PQ sub-quantizers have to split the dimension evenly
+    m = min(pq_m, dim)
+    while dim % m:
+        m -= 1
+    return m
+
+
+# Fewest vectors worth training an IVF-PQ index on (faiss wants ~39 points per centroid)
+def min_training_points(vector_count):
+    return 39 * max(_nlist_for(vector_count), 2 ** pq_nbits)
+
+
+def can_build(kind, vector_count):
+    return kind != "ivfpq" or vector_count >= min_training_points(vector_count)
+
+
+def new_index(kind, dim, vector_count):
+    if kind == "flat":
+        return faiss.IndexFlatL2(dim)
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m)
+        index.hnsw.efConstruction = hnsw_ef_construction
+        return index
+    if kind == "ivfpq":
+        nbits = min(pq_nbits, max(1, int(math.log2(max(vector_count, 2)))))
+        quantizer = faiss.IndexFlatL2(dim)
+        return faiss.IndexIVFPQ(quantizer, dim, _nlist_for(vector_count), _pq_m_for(dim), nbits)
+    raise ValueError(f"Unknown index type {kind!r}, expected flat, ivfpq or hnsw")
+
+
+def set_search_params(index, nprobe=nprobe, ef_search=ef_search):
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+    return index
+
+
+# IVF indexes need a direct map before vectors can be read back by position
+def _enable_reconstruct(index):
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+
+
+def _reconstruct(index, start, count):
+    _enable_reconstruct(index)
+    return index.reconstruct_n(start, count)
+
+
+# Function to copy the vectors of an index into a new index of another type.
+# Training uses a random sample; vectors are then added in batches, so the
+# source never has to be decoded into memory at once.
+def convert_index(source, kind, seed=0):
+    total = source.ntotal
+    target = new_index(kind, source.d, total)
+    if not target.is_trained:
+        sample_size = min(total, max_training_points)
+        sample = np.sort(np.random.default_rng(seed).choice(total, sample_size, replace=False))
+        if sample_size < total:
+            _enable_reconstruct(source)
+            training = source.reconstruct_batch(sample)
+        else:
+            training = _reconstruct(source, 0, total)
+        target.train(training)
+    for start in range(0, total, add_batch_size):
+        target.add(_reconstruct(source, start, min(add_batch_size, total - start)))
+    return set_search_params(target)
+
+
+# Function to drop vectors by position, keeping the rest in order. Flat indexes
+# compact in place; the others are refilled from a trained, emptied copy since
+# IVF ids would otherwise keep their gaps and HNSW cannot remove at all.
+def remove_vectors(index, positions):
+    positions = np.asarray(sorted(positions), dtype=np.int64)
+    if index_type_of(index) == "flat":
+        index.remove_ids(faiss.IDSelectorBatch(positions))
+        return index
+    keep = np.setdiff1d(np.arange(index.ntotal, dtype=np.int64), positions)
+    _enable_reconstruct(index)
+    target = faiss.clone_index(index)
+    target.reset()
+    for start in range(0, len(keep), add_batch_size):
+        target.add(index.reconstruct_batch(keep[start:start + add_batch_size]))
+    return set_search_params(target)
+
+
+# Function to bring a store's index to the given type when possible.
+# Returns the (possibly new) index; positions, and so docstore ids, are kept.
+def ensure_index_type(index, kind=index_type):
+    if index_type_of(index) == kind or not can_build(kind, index.ntotal):
+        return index
+    logger.info("Converting %s index of %d vectors to %s", index_type_of(index), index.ntotal, kind)
+    return convert_index(index, kind)
+
+
+# Index type a stored index should have: the target saved with it (set by the
+# convert command, and kept while too few vectors to train it), else the type of
+# `index`, and only for a new index the ISO_INDEX_TYPE default
+def target_index_type(index_save_path, index=None):
+    settings = load_settings(index_save_path)
+    if settings is not None:
+        return settings.get("target", settings["type"])
+    if index is not None:
+        return index_type_of(index)
+    return index_type
+
+
+def load_settings(index_save_path):
+    path = os.path.join(index_save_path, ann_settings_name)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as settings_file:
+        return json.load(settings_file)
+
+
+def save_settings(index, index_save_path, target=None):
+    target = target or target_index_type(index_save_path, index)
+    settings = {"type": index_type_of(index), "target": target, "dim": index.d, "vectors": index.ntotal}
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        settings.update(nlist=ivf.nlist, nprobe=ivf.nprobe)
+    if isinstance(index, faiss.IndexHNSW):
+        settings.update(m=hnsw_m, ef_search=index.hnsw.efSearch)
+    path = os.path.join(index_save_path, ann_settings_name)
+    with open(path + ".tmp", "w", encoding="utf-8") as settings_file:
+        json.dump(settings, settings_file, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+# Function to read index.faiss. Memory-mapped indexes are read-only in practice
+# (IVF lists cannot grow), so only the query path should ask for mmap.
+# IO_FLAG_MMAP only maps IVF inverted lists; flat and HNSW indexes keep their
+# vectors in flat codes, which need IO_FLAG_MMAP_IFC (the two do not combine).
+def read_index(index_save_path, mmap=False):
+    path = os.path.join(index_save_path, "index.faiss")
+    flags = 0
+    if mmap:
+        settings = load_settings(index_save_path)
+        kind = settings["type"] if settings else "flat"
+        flags = (faiss.IO_FLAG_MMAP if kind == "ivfpq" else faiss.IO_FLAG_MMAP_IFC) | faiss.IO_FLAG_READ_ONLY
+    return set_search_params(faiss.read_index(path, flags))
+
+
+def _search_latency(index, queries, k):
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query[None, :], k)
+        timings.append(time.perf_counter() - start)
+    _, found = index.search(queries, k)
+    return found, timings
+
+
+def _recall(found, truth, k):
+    hits = sum(len(set(row[:k]) & set(expected[:k]) - {-1}) for row, expected in zip(found, truth))
+    return hits / (len(truth) * k)
+
+
+# Function to measure recall@k and per-query latency of the ANN index types
+# against the exact flat baseline. Queries are stored vectors plus noise,
+# which stands in for real questions without any embedding calls.
+def evaluate_recall(vectors, k=10, query_count=200, noise=0.05, nprobes=(1, 4, 16, 64), ef_searches=(16, 64, 256), seed=0):
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(vectors), min(query_count, len(vectors)), replace=False)
+    queries = vectors[picks] + rng.normal(0, noise, (len(picks), vectors.shape[1])).astype(np.float32)
+    k = min(k, len(vectors))
+
+    flat = faiss.IndexFlatL2(vectors.shape[1])
+    flat.add(vectors)
+    truth, timings = _search_latency(flat, queries, k)
+    report = [{"type": "flat", "param": None, "recall": 1.0, **_latency_stats(timings)}]
+
+    for kind, params in (("ivfpq", nprobes), ("hnsw", ef_searches)):
+        start = time.perf_counter()
+        index = new_index(kind, vectors.shape[1], len(vectors))
+        if not index.is_trained:
+            index.train(vectors[rng.choice(len(vectors), min(len(vectors), max_training_points), replace=False)])
+        index.add(vectors)
+        build_s = time.perf_counter() - start
+        for param in params:
+            if kind == "ivfpq":
+                set_search_params(index, nprobe=param)
+            else:
+                set_search_params(index, ef_search=param)
+            found, timings = _search_latency(index, queries, k)
+            report.append({
+                "type": kind,
+                "param": {"nprobe": faiss.extract_index_ivf(index).nprobe} if kind == "ivfpq" else {"ef_search": param},
+                "recall": round(_recall(found, truth, k), 4),
+                "build_s": round(build_s, 3),
+                **_latency_stats(timings),
+            })
+    return {"vectors": len(vectors), "dim": vectors.shape[1], "k": k, "queries": len(picks), "results": report}
+
+
+def _latency_stats(timings):
+    timings = np.asarray(timings)
+    return {
+        "p50_ms": round(float(np.percentile(timings, 50)) * 1000, 4),
+        "p99_ms": round(float(np.percentile(timings, 99)) * 1000, 4),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from index_registry import index_save_path
+
+    parser = argparse.ArgumentParser(description="Convert the document index to an ANN type, or report ANN recall")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert_parser = subparsers.add_parser("convert", help="rebuild index.faiss as another index type")
+    convert_parser.add_argument("type", choices=["flat", "ivfpq", "hnsw"])
+    convert_parser.add_argument("--index", default=index_save_path)
+    convert_parser.add_argument("--force", action="store_true", help="train IVF-PQ even on too few vectors")
+    evaluate_parser = subparsers.add_parser("evaluate", help="recall@k and latency against the flat baseline")
+    evaluate_parser.add_argument("--index", default=index_save_path)
+    evaluate_parser.add_argument("--k", type=int, default=10)
+    evaluate_parser.add_argument("--queries", type=int, default=200)
+    evaluate_parser.add_argument("--output", default=None, help="also write the report to this JSON file")
+    args = parser.parse_args()
+
+    index = read_index(args.index)
+    if args.command == "convert":
+        if not args.force and not can_build(args.type, index.ntotal):
+            parser.error(f"{index.ntotal} vectors are too few to train {args.type} (need {min_training_points(index.ntotal)}), use --force")
+        converted = convert_index(index, args.type)
+        faiss.write_index(converted, os.path.join(args.index, "index.faiss"))
+        save_settings(converted, args.index, target=args.type)
+        print(f"{args.index} is now a {args.type} index of {converted.ntotal} vectors")
+    else:
+        report = evaluate_recall(_reconstruct(index, 0, index.ntotal), args.k, args.queries)
+        for row in report["results"]:
+            print(f"{row['type']:6} {json.dumps(row['param']):22} recall@{report['k']} {row['recall']:.3f}  "
+                  f"p50 {row['p50_ms']:.3f} ms  p99 {row['p99_ms']:.3f} ms")
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as output_file:
+                json.dump(report, output_file, indent=2)
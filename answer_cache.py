@@ -0,0 +1,106 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from lexical_index import identifier_tokens
+
+similarity_threshold = 0.95
+ttl_seconds = 24 * 60 * 60
+max_entries = 1000
+
+
+def normalize_question(question):
+    question = re.sub(r"[^\w\s]", " ", question.lower())
+    return " ".join(question.split())
+
+
+def question_key(question, index_version):
+    return hashlib.sha256(f"{index_version}\n{normalize_question(question)}".encode("utf-8")).hexdigest()
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+# Cache of answers from the retrieval chain. Exact repeats are found by the hash
+# of the normalized question; near repeats by cosine similarity of the query
+# embedding, among earlier questions naming the same codes and clauses: "ELP in
+# pumps" and "ELF in pumps" embed almost alike. Every entry belongs to one
+# index version, so re-indexing makes older answers unreachable.
+class AnswerCache:
+    def __init__(self, similarity_threshold=similarity_threshold, ttl_seconds=ttl_seconds, max_entries=max_entries):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _expire(self, now):
+        expired = [key for key, entry in self._entries.items() if now - entry["created"] > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+
+    def _hit(self, key):
+        self._entries.move_to_end(key)
+        self.hits += 1
+        entry = self._entries[key]
+        return {"answer": entry["answer"], "source": entry["source"], "page": entry["page"]}
+
+    # Function to look up an exact repeat of a question; no embedding needed
+    def get_exact(self, question, index_version):
+        key = question_key(question, index_version)
+        with self._lock:
+            self._expire(time.time())
+            if key in self._entries:
+                return self._hit(key)
+        return None
+
+    # Function to look up the most similar earlier question above the threshold
+    def get_similar(self, question, query_vector, index_version):
+        query = _unit(query_vector)
+        identifiers = frozenset(identifier_tokens(question))
+        with self._lock:
+            self._expire(time.time())
+            candidates = [
+                (key, entry["vector"]) for key, entry in self._entries.items()
+                if entry["index_version"] == index_version and entry["vector"] is not None
+                and entry["identifiers"] == identifiers
+            ]
+            if candidates:
+                scores = np.stack([vector for _, vector in candidates]) @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity_threshold:
+                    return self._hit(candidates[best][0])
+            self.misses += 1
+        return None
+
+    def put(self, question, index_version, answer, source, page, query_vector=None):
+        key = question_key(question, index_version)
+        with self._lock:
+            self._entries[key] = {
+                "index_version": index_version,
+                "vector": _unit(query_vector) if query_vector is not None else None,
+                "identifiers": frozenset(identifier_tokens(question)),
+                "answer": answer,
+                "source": source,
+                "page": page,
+                "created": time.time(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+# Shared by every session of the Streamlit server
+answer_cache = AnswerCache()
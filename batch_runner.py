@@ -0,0 +1,154 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import find_dotenv, load_dotenv
+from langchain_community.callbacks.manager import get_openai_callback
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+from answer_cache import AnswerCache
+from document_qa import answer_question, build_retrieval_chain
+from embedding_cache import CachedEmbeddings
+from failure_code_qa import response_generator
+from failure_matrix import load_failure_matrix, workbook_path
+from failure_query import FailureQueryEngine
+from index_registry import index_save_path, index_version, load_faiss_index
+from lexical_index import load_lexical_index
+from openai_pool import http_client
+
+default_sheet = "Table B.6"
+
+# Headless runner for both chat engines. Reads questions from a JSONL file,
+# one {"id", "question", "engine": "document" | "failure_codes", "sheet"} per
+# line, and writes one JSONL result per question in the same order.
+
+
+class BatchRunner:
+    def __init__(self, api_key, base_url=None, offline=False, index_path=index_save_path, workbook=workbook_path):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.index_path = index_path
+        self.workbook = workbook
+        # The agent streams its steps internally; stream_usage keeps its token counts
+        self.doc_llm = ChatOpenAI(model='gpt-4o', temperature=0.2, api_key=api_key, base_url=base_url, http_client=http_client())
+        self.agent_llm = ChatOpenAI(
+            model='gpt-4', temperature=0.2, api_key=api_key, base_url=base_url, stream_usage=True, http_client=http_client()
+        )
+        # The stand-in server gets raw strings, and its vectors must not
+        # end up in the on-disk cache of real embeddings
+        embeddings = OpenAIEmbeddings(
+            api_key=api_key, base_url=base_url, check_embedding_ctx_length=not offline, http_client=http_client()
+        )
+        self.embeddings = embeddings if offline else CachedEmbeddings(embeddings)
+        self.answer_cache = AnswerCache()
+        self._retrieval_chain = None
+        self._matrix = None
+        self._engine = None
+
+    def _document_resources(self):
+        if self._retrieval_chain is None:
+            vector_store = load_faiss_index(self.index_path, self.embeddings, mmap=True)
+            lexical_index = load_lexical_index(self.index_path, vector_store, index_version(self.index_path))
+            self._retrieval_chain = build_retrieval_chain(vector_store, self.doc_llm, lexical_index)
+        return self._retrieval_chain
+
+    def _failure_resources(self):
+        if self._engine is None:
+            self._matrix = load_failure_matrix(self.workbook)
+            self._engine = FailureQueryEngine(self._matrix)
+        return self._matrix, self._engine
+
+    # Shared resources are built before the workers start
+    def prepare(self, items):
+        if any(item.get("engine", "document") == "document" for item in items):
+            self._document_resources()
+        if any(item.get("engine") == "failure_codes" for item in items):
+            self._failure_resources()
+
+    def run_one(self, item):
+        engine = item.get("engine", "document")
+        result = {"id": item.get("id"), "question": item["question"], "engine": engine}
+        start = time.perf_counter()
+        try:
+            with get_openai_callback() as usage:
+                if engine == "document":
+                    answer = answer_question(
+                        item["question"], self._document_resources(), self.embeddings,
+                        index_version(self.index_path), self.answer_cache,
+                    )
+                    result.update(answer)
+                elif engine == "failure_codes":
+                    matrix, query_engine = self._failure_resources()
+                    sheet = matrix[item.get("sheet", default_sheet)]
+                    result["sheet"] = sheet.name
+                    result["answer"] = response_generator(
+                        sheet.to_frame(), item["question"], self.api_key, query_engine, sheet, llm=self.agent_llm,
+                    )
+                else:
+                    raise ValueError(f"Unknown engine {engine!r}")
+            result.update({
+                "prompt_tokens": usage.prompt_tokens,
+                "completion_tokens": usage.completion_tokens,
+                "total_tokens": usage.total_tokens,
+            })
+        except Exception as error:
+            result["error"] = f"{type(error).__name__}: {error}"
+        result["latency_s"] = round(time.perf_counter() - start, 4)
+        return result
+
+    def run(self, items, workers=4):
+        self.prepare(items)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            yield from pool.map(self.run_one, items)
+
+
+def read_questions(path):
+    with open(path, "r", encoding="utf-8") as questions_file:
+        return [json.loads(line) for line in questions_file if line.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a JSONL file of questions through the ISO chatbot engines")
+    parser.add_argument("questions", help="input JSONL, one question object per line")
+    parser.add_argument("output", help="output JSONL with answers, sources, pages, latencies and token counts")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--api-key", default=None, help="defaults to OPENAI_API_KEY")
+    parser.add_argument("--base-url", default=None, help="OpenAI-compatible endpoint to use instead of api.openai.com")
+    parser.add_argument("--offline", action="store_true", help="answer with a local stand-in server, no network")
+    parser.add_argument("--index", default=index_save_path)
+    parser.add_argument("--workbook", default=workbook_path)
+    args = parser.parse_args(argv)
+
+    _ = load_dotenv(find_dotenv())
+    api_key = args.api_key or os.environ.get("OPENAI_API_KEY")
+    base_url = args.base_url
+    server = None
+    if args.offline:
+        from fake_openai import start_server
+
+        server, base_url = start_server()
+        api_key = api_key or "offline"
+    if not api_key:
+        parser.error("an OpenAI API key is required (--api-key or OPENAI_API_KEY) unless --offline is given")
+
+    items = read_questions(args.questions)
+    runner = BatchRunner(api_key, base_url, args.offline, args.index, args.workbook)
+    failures = 0
+    try:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            for result in runner.run(items, args.workers):
+                failures += "error" in result
+                output_file.write(json.dumps(result, default=str) + "\n")
+                output_file.flush()
+    finally:
+        if server is not None:
+            server.shutdown()
+    print(f"{len(items)} questions answered, {failures} failed, results in {args.output}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
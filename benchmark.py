@@ -0,0 +1,445 @@
+import argparse
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import fitz
+import numpy as np
+import pandas as pd
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+from document_qa import build_retrieval_chain
+from failure_code_qa import response_generator
+from failure_matrix import build_artifact, load_failure_matrix, workbook_path
+from failure_query import FailureQueryEngine
+from fake_openai import start_server
+from index_registry import close_faiss_index, index_save_path, load_faiss_index
+from agent_context import dense_context_tokens
+from ann_index import evaluate_recall
+from ingestion import ingest_pdf, iter_chunks, iter_pages
+from iso_chunker import ISOTextSplitter
+from lexical_index import HybridRetriever, LexicalIndex
+from openai_pool import http_client
+from streaming import TimingCallbackHandler, TurnTimer, stream_retrieval_answer
+from table_extraction import extract_iso_tables
+from tracing import trace_turn
+
+golden_path = "golden_qa.jsonl"
+results_path = "benchmark_results.json"
+default_pdf = "ISO_2016.pdf"
+
+document_questions = [
+    "What is the definition of failure mode?",
+    "What is the difference between a failure cause and a failure mechanism?",
+    "Which data should be recorded for a maintenance event?",
+    "What is meant by equipment boundary?",
+    "What does ELP mean?",
+    "clause 9.6",
+]
+
+# Questions the matrix cannot answer on its own, so they go through the agent
+agent_questions = [
+    "Summarize what this table is about",
+    "Explain the columns of this table",
+]
+
+# Offline benchmark of the ingestion, retrieval, table and chat paths. Chat and
+# embedding calls go to the local stand-in server, so numbers measure our own
+# code (plus the configured fake latency), not the OpenAI API.
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+# Private (anonymous) memory of the process, which unlike RSS leaves out
+# memory-mapped files. Linux only.
+def anon_rss_mb():
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as status_file:
+            for line in status_file:
+                if line.startswith("RssAnon:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def latency_summary(samples):
+    samples = np.asarray(samples, dtype=float)
+    if samples.size == 0:
+        return {"n": 0}
+    return {
+        "n": int(samples.size),
+        "mean_s": round(float(samples.mean()), 5),
+        "p50_s": round(float(np.percentile(samples, 50)), 5),
+        "p99_s": round(float(np.percentile(samples, 99)), 5),
+        "max_s": round(float(samples.max()), 5),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Function to build a PDF of plain text pages, used when the ISO PDF is not around
+def synthetic_pdf(page_count=40):
+    doc = fitz.open()
+    for number in range(page_count):
+        page = doc.new_page()
+        lines = [
+            f"Clause {number}.{line} Equipment class {line % 7} shall record failure mode, failure cause and "
+            f"maintenance activity data for every event reported in period {number}."
+            for line in range(45)
+        ]
+        page.insert_textbox(page.rect + (36, 36, -36, -36), "\n".join(lines), fontsize=8)
+    pdf_bytes = doc.tobytes()
+    doc.close()
+    return pdf_bytes
+
+
+def bench_ingestion(pdf_bytes, source, embeddings):
+    # What the plain recursive splitter would have sent to the embeddings API
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    total_pages = doc.page_count
+    recursive_chunks = list(iter_chunks(iter_pages(doc, source), RecursiveCharacterTextSplitter()))
+    doc.close()
+
+    text_splitter = ISOTextSplitter()
+    start = time.perf_counter()
+    vector_store, ids = ingest_pdf(pdf_bytes, source, "benchmark", text_splitter, embeddings)
+    elapsed = time.perf_counter() - start
+    return {
+        "source": source,
+        "pages": total_pages,
+        "chunks": len(ids),
+        "chunk_chars": sum(len(vector_store.docstore.search(chunk_id).page_content) for chunk_id in ids),
+        "recursive_chunks": len(recursive_chunks),
+        "recursive_chunk_chars": sum(len(chunk.page_content) for chunk in recursive_chunks),
+        "boilerplate_lines": text_splitter.last_stats["boilerplate_lines"],
+        "duplicates_skipped": text_splitter.last_stats["duplicates"],
+        "seconds": round(elapsed, 4),
+        "pages_per_s": round(total_pages / elapsed, 2),
+        "chunks_per_s": round(len(ids) / elapsed, 2),
+        "peak_rss_mb": peak_rss_mb(),
+    }, vector_store
+
+
+def bench_faiss(index_path, embeddings, questions, repeats):
+    # Memory each load adds, the mmap one after a search has touched the vectors
+    anon_before = anon_rss_mb()
+    start = time.perf_counter()
+    mmap_store = load_faiss_index(index_path, embeddings, mmap=True)
+    mmap_load_s = time.perf_counter() - start
+    mmap_store.index.search(np.zeros((1, mmap_store.index.d), dtype=np.float32), 1)
+    anon_mmap = anon_rss_mb()
+    close_faiss_index(mmap_store)
+    start = time.perf_counter()
+    vector_store = load_faiss_index(index_path, embeddings)
+    load_s = time.perf_counter() - start
+    anon_loaded = anon_rss_mb()
+
+    # Built in memory, so the benchmark leaves the index directory untouched
+    start = time.perf_counter()
+    lexical_index = LexicalIndex.from_vector_store(vector_store)
+    lexical_build_s = time.perf_counter() - start
+    hybrid_retriever = HybridRetriever(vector_store=vector_store, lexical_index=lexical_index, k=1)
+
+    # End to end retrieval (query embedding included), the search on its own,
+    # the lexical search and the fused retriever
+    retrieval, search, lexical, hybrid = [], [], [], []
+    query_vectors = [embeddings.embed_query(question) for question in questions]
+    for _ in range(repeats):
+        for question, vector in zip(questions, query_vectors):
+            start = time.perf_counter()
+            vector_store.similarity_search(question, k=1)
+            retrieval.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            vector_store.similarity_search_by_vector(vector, k=1)
+            search.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            lexical_index.search(question)
+            lexical.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            hybrid_retriever.invoke(question)
+            hybrid.append(time.perf_counter() - start)
+    return {
+        "vectors": vector_store.index.ntotal,
+        "load_s": round(load_s, 4),
+        "mmap_load_s": round(mmap_load_s, 4),
+        "load_anon_mb": round(anon_loaded - anon_mmap, 1) if anon_before is not None else None,
+        "mmap_load_anon_mb": round(anon_mmap - anon_before, 1) if anon_before is not None else None,
+        "lexical_build_s": round(lexical_build_s, 4),
+        "retrieval": latency_summary(retrieval),
+        "search_only": latency_summary(search),
+        "lexical_search": latency_summary(lexical),
+        "hybrid_retrieval": latency_summary(hybrid),
+        # Recall@10 and latency of IVF-PQ and HNSW against the flat baseline
+        "ann": evaluate_recall(vector_store.index.reconstruct_n(0, vector_store.index.ntotal), k=10, query_count=100),
+        "peak_rss_mb": peak_rss_mb(),
+    }, vector_store
+
+
+def bench_annex_b(workbook):
+    start = time.perf_counter()
+    sheets = pd.read_excel(workbook, sheet_name=None)
+    read_excel_s = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as artifact_dir:
+        start = time.perf_counter()
+        build_artifact(workbook, artifact_dir)
+        compile_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        matrix = load_failure_matrix(workbook, artifact_dir)
+        load_s = time.perf_counter() - start
+
+        sheet_loads = []
+        for name in matrix.sheet_names:
+            start = time.perf_counter()
+            matrix[name].to_frame()
+            sheet_loads.append(time.perf_counter() - start)
+    return {
+        "sheets": len(sheets),
+        "read_excel_s": round(read_excel_s, 4),
+        "compile_s": round(compile_s, 4),
+        "artifact_load_s": round(load_s, 4),
+        "sheet_to_frame": latency_summary(sheet_loads),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def bench_pdf_tables(pdf_path):
+    if pdf_path is None:
+        return {"skipped": "no ISO 14224 PDF given (--pdf)"}
+    # Cold run fills an empty table cache, warm run reads it back
+    with tempfile.TemporaryDirectory() as cache_dir:
+        try:
+            start = time.perf_counter()
+            extracted = extract_iso_tables(pdf_path, cache_dir)
+            cold_s = time.perf_counter() - start
+            start = time.perf_counter()
+            extract_iso_tables(pdf_path, cache_dir)
+            warm_s = time.perf_counter() - start
+        except Exception as error:
+            return {"error": f"{type(error).__name__}: {error}", "peak_rss_mb": peak_rss_mb()}
+    return {
+        "tables": {name: list(df.shape) for name, df in extracted.items()},
+        "cold_s": round(cold_s, 4),
+        "warm_s": round(warm_s, 4),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def bench_document_turns(vector_store, llm, questions):
+    retrieval_chain = build_retrieval_chain(vector_store, llm)
+    ttft, total = [], []
+    for question in questions:
+        timer = TurnTimer("document")
+        result = {}
+        "".join(stream_retrieval_answer(retrieval_chain, {"input": question}, timer, result))
+        timing = timer.as_dict()
+        ttft.append(timing["ttft_s"])
+        total.append(timing["total_s"])
+    return {"ttft": latency_summary(ttft), "total": latency_summary(total), "peak_rss_mb": peak_rss_mb()}
+
+
+def _normalize(text):
+    return re.sub(r"[^a-z0-9]+", " ", str(text).lower().replace("-", "")).strip()
+
+
+# Whether an answer names a term; codes are matched as upper-case words, so
+# "AIR" is not found in "air"
+def _mentions(answer, term):
+    if re.fullmatch(r"[A-Z]{2,4}", term):
+        return re.search(rf"\b{term}\b", str(answer)) is not None
+    return f" {_normalize(term)} " in f" {_normalize(answer)} "
+
+
+# Codes and class names of a sheet, the terms an answer can list from it
+def sheet_terms(sheet):
+    if not sheet.is_matrix:
+        return []
+    return [list(sheet.codes), list(sheet.class_names)]
+
+
+# Recall, precision and F1 of an answer against the expected terms. Recall is
+# the share of expected terms found; precision the share of listed sheet terms
+# that were expected, counting only the kinds (codes, class names) the expected
+# list holds, so naming the code asked about is no error in a list of classes.
+def score_answer(answer, expected, terms=()):
+    if not expected:
+        return None
+    found = [term for term in expected if _mentions(answer, term)]
+    wanted = {_normalize(term) for term in expected}
+    returned = {
+        _normalize(term)
+        for group in terms if any(_normalize(term) in wanted for term in group)
+        for term in group if _mentions(answer, term)
+    }
+    recall = len(found) / len(expected)
+    precision = len(returned & wanted) / len(returned) if returned else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"recall": recall, "precision": precision, "f1": f1}
+
+
+def read_golden(path=golden_path):
+    with open(path, "r", encoding="utf-8") as golden_file:
+        return [json.loads(line) for line in golden_file if line.strip()]
+
+
+def bench_failure_turns(workbook, llm, golden, extra_questions, default_sheet="Table B.6"):
+    matrix = load_failure_matrix(workbook)
+    engine = FailureQueryEngine(matrix)
+    ttft, total, scores, answers = [], [], [], []
+    context_tokens, dense_tokens, dense_by_sheet = [], [], {}
+    items = golden + [{"question": question, "sheet": default_sheet} for question in extra_questions]
+    for item in items:
+        sheet = matrix[item.get("sheet", default_sheet)]
+        timer = TurnTimer("failure_codes")
+        with trace_turn("failure_codes", kind="benchmark") as trace:
+            answer = response_generator(sheet.to_frame(), item["question"], "offline", engine, sheet,
+                                        [TimingCallbackHandler(timer)], llm=llm)
+        timer.finish()
+        # Agent context against the whole sheet written out, which the agent used to get
+        for recorded in trace.spans:
+            if recorded["name"] == "prompt_build":
+                if sheet.name not in dense_by_sheet:
+                    dense_by_sheet[sheet.name] = dense_context_tokens(sheet.to_frame())
+                context_tokens.append(recorded["attributes"]["context_tokens"])
+                dense_tokens.append(dense_by_sheet[sheet.name])
+        timing = timer.as_dict()
+        ttft.append(timing["ttft_s"])
+        total.append(timing["total_s"])
+        if "expected" in item:
+            score = score_answer(answer, item["expected"], sheet_terms(sheet))
+            scores.append(score)
+            answers.append({"id": item.get("id"), "question": item["question"],
+                            **{name: round(value, 3) for name, value in score.items()}})
+    return {
+        "ttft": latency_summary(ttft),
+        "total": latency_summary(total),
+        "golden": {
+            "questions": len(scores),
+            "recall": round(float(np.mean([score["recall"] for score in scores])), 4) if scores else None,
+            "precision": round(float(np.mean([score["precision"] for score in scores])), 4) if scores else None,
+            "f1": round(float(np.mean([score["f1"] for score in scores])), 4) if scores else None,
+            "exact": sum(score["f1"] == 1.0 for score in scores),
+            "answers": answers,
+        },
+        "agent_turns": len(context_tokens),
+        "agent_context_tokens": round(float(np.mean(context_tokens)), 1) if context_tokens else None,
+        "dense_context_tokens": round(float(np.mean(dense_tokens)), 1) if dense_tokens else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def _flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+# Function to print the metrics that changed between two result files
+def compare_results(previous, current):
+    before = _flatten(previous.get("metrics", {}))
+    after = _flatten(current.get("metrics", {}))
+    print(f"Comparing {previous.get('commit')} -> {current.get('commit')}")
+    for name in sorted(before.keys() & after.keys()):
+        old, new = before[name], after[name]
+        if old == new:
+            continue
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        print(f"  {name}: {old} -> {new} ({change})")
+
+
+def run_benchmarks(args):
+    server, base_url = start_server(latency=args.latency)
+    try:
+        embeddings = OpenAIEmbeddings(api_key="offline", base_url=base_url, check_embedding_ctx_length=False, http_client=http_client())
+        llm = ChatOpenAI(model="gpt-4o", temperature=0.2, api_key="offline", base_url=base_url, streaming=True, http_client=http_client())
+
+        pdf_path = args.pdf if args.pdf and os.path.exists(args.pdf) else None
+        if pdf_path is not None:
+            with open(pdf_path, "rb") as pdf_file:
+                pdf_bytes = pdf_file.read()
+            source = os.path.basename(pdf_path)
+        else:
+            pdf_bytes, source = synthetic_pdf(args.synthetic_pages), "synthetic.pdf"
+
+        metrics = {}
+        print("Benchmarking ingestion...")
+        metrics["ingestion"], ingested_store = bench_ingestion(pdf_bytes, source, embeddings)
+        print("Benchmarking FAISS load and retrieval...")
+        if os.path.exists(os.path.join(args.index, "index.faiss")):
+            metrics["faiss"], vector_store = bench_faiss(args.index, embeddings, document_questions, args.repeats)
+        else:
+            metrics["faiss"], vector_store = {"skipped": f"no index at {args.index}"}, ingested_store
+        print("Benchmarking Annex B workbook...")
+        metrics["annex_b"] = bench_annex_b(args.workbook)
+        print("Benchmarking PDF table extraction...")
+        metrics["pdf_tables"] = bench_pdf_tables(pdf_path)
+        print("Benchmarking chat turns...")
+        metrics["document_turns"] = bench_document_turns(vector_store, llm, document_questions)
+        metrics["failure_code_turns"] = bench_failure_turns(args.workbook, llm, read_golden(args.golden), agent_questions)
+        metrics["peak_rss_mb"] = peak_rss_mb()
+    finally:
+        server.shutdown()
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {"pdf": source, "fake_latency_s": args.latency, "repeats": args.repeats},
+        "metrics": metrics,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the ISO chatbot")
+    parser.add_argument("--output", default=results_path, help="JSON file to write the results to")
+    parser.add_argument("--compare", default=None, help="earlier results file to compare against")
+    parser.add_argument("--pdf", default=default_pdf, help="ISO 14224 PDF; a synthetic PDF is used if it is missing")
+    parser.add_argument("--synthetic-pages", type=int, default=40)
+    parser.add_argument("--index", default=index_save_path)
+    parser.add_argument("--workbook", default=workbook_path)
+    parser.add_argument("--golden", default=golden_path)
+    parser.add_argument("--repeats", type=int, default=25, help="passes over the retrieval questions")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the fake server waits per request")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args)
+    with open(args.output, "w", encoding="utf-8") as output_file:
+        json.dump(results, output_file, indent=2)
+
+    golden = results["metrics"]["failure_code_turns"]["golden"]
+    print(f"Golden F1 {golden['f1']} (recall {golden['recall']}, precision {golden['precision']}, "
+          f"{golden['exact']}/{golden['questions']} exact), "
+          f"peak RSS {results['metrics']['peak_rss_mb']} MB, results in {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as previous_file:
+            compare_results(json.load(previous_file), results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+from langchain.chains import create_retrieval_chain
+from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain_core.prompts import ChatPromptTemplate
+
+from intent_router import route_question
+from lexical_index import HybridRetriever, is_identifier_query
+from openai_pool import in_flight
+from tracing import count, span
+
+# Retrieval question answering over the document index, kept free of
+# Streamlit widgets so the page and the batch runner can share it.
+
+
+# Retrieval chain over FAISS, fused with the lexical index when one is given
+def build_retrieval_chain(vector_store, llm, lexical_index=None, k=1):
+    prompt = ChatPromptTemplate.from_template("""Answer the following question based only on the provided context:
+
+        <context>
+        {context}
+        </context>
+
+        Question: {input}""")
+
+    if lexical_index is not None:
+        retriever = HybridRetriever(vector_store=vector_store, lexical_index=lexical_index, k=k)
+    else:
+        retriever = vector_store.as_retriever(search_kwargs={"k": k})
+
+    document_chain = create_stuff_documents_chain(llm, prompt)
+    return create_retrieval_chain(retriever, document_chain)
+
+
+# Function to look a question up in the answer cache. Returns the cached entry
+# (or None) and the query vector computed for the similarity lookup, if any.
+# Similar-question matching is skipped for code lookups, and otherwise only
+# accepts questions naming the same codes: "ELP" and "ELF" questions embed
+# close together but must not share answers.
+def lookup_cached_answer(question, embeddings, index_version, answer_cache, semantic=True):
+    with span("answer_cache_lookup"):
+        cached = answer_cache.get_exact(question, index_version)
+        query_vector = None
+        if cached is None and semantic:
+            query_vector = embeddings.embed_query(question)
+            cached = answer_cache.get_similar(question, query_vector, index_version)
+    count("answer_cache_hit" if cached is not None else "answer_cache_miss")
+    return cached, query_vector
+
+
+# Key under which concurrent sessions share an answer (see openai_pool.in_flight)
+def answer_key(question, index_version):
+    return ("document", index_version, " ".join(question.lower().split()))
+
+
+def source_and_page(context):
+    return context[0].metadata['source'], context[0].metadata['page']
+
+
+# Function to answer one question without streaming
+def answer_question(question, retrieval_chain, embeddings, index_version, answer_cache=None):
+    # Small talk needs neither retrieval nor the LLM; code lookups are left to
+    # retrieval since the document need not be ISO 14224
+    route, reply = route_question(question, codes=None)
+    if route == "small_talk":
+        count("llm_avoided")
+        return {"answer": reply, "source": None, "page": None, "cached": False}
+
+    query_vector = None
+    if answer_cache is not None:
+        semantic = not is_identifier_query(question)
+        cached, query_vector = lookup_cached_answer(question, embeddings, index_version, answer_cache, semantic)
+        if cached is not None:
+            return dict(cached, cached=True)
+
+    def run_chain():
+        response = retrieval_chain.invoke({"input": question})
+        source, page = source_and_page(response['context'])
+        if answer_cache is not None:
+            answer_cache.put(question, index_version, response['answer'], source, page, query_vector)
+        return response['answer'], source, page
+
+    # Concurrent identical questions share one retrieval and LLM call
+    (answer, source, page), _ = in_flight.do(answer_key(question, index_version), run_chain)
+    return {"answer": answer, "source": source, "page": page, "cached": False}
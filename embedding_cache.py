@@ -0,0 +1,220 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from index_registry import embedding_model_name
+from tracing import count, span
+
+embedding_cache_path = "embedding_cache"
+max_cache_bytes = 512 * 1024 * 1024
+initial_capacity = 1024
+
+
+def normalize_text(text):
+    return " ".join(text.split())
+
+
+# Cache key of a text: its normalized form plus the model and the kind of call
+def embedding_key(text, model, kind="document"):
+    digest = hashlib.sha256()
+    digest.update(f"{model}\n{kind}\n".encode("utf-8"))
+    digest.update(normalize_text(text).encode("utf-8"))
+    return digest.hexdigest()
+
+
+# On-disk vector store: float32 rows in a memory-mapped file, with a SQLite
+# table mapping each key to its row and last use. Least recently used rows are
+# reused once the file reaches `max_bytes`. Several processes (the app and the
+# batch runner) may share one store: rows are handed out and read inside a
+# SQLite write transaction, with the next free row kept in the meta table.
+class EmbeddingStore:
+    def __init__(self, path=embedding_cache_path, max_bytes=max_cache_bytes):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(path, "index.sqlite"), timeout=30, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, slot INTEGER, last_used REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+        self._conn.commit()
+        self._vectors_path = os.path.join(path, "vectors.f32")
+        self.dim = self._get_meta("dim")
+        self._vectors = None
+        if self.dim:
+            self._map(max(self._capacity_on_disk(), min(initial_capacity, self.max_entries)))
+
+    def _get_meta(self, name):
+        row = self._conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, name, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, value))
+
+    # Function to hold SQLite's write lock across processes until commit,
+    # refreshing what another process may have changed in the meantime
+    @contextmanager
+    def _transaction(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not self.dim:
+                self.dim = self._get_meta("dim")
+            if self.dim and (self._vectors is None or self._vectors.shape[0] < self._capacity_on_disk()):
+                self._map(max(self._capacity_on_disk(), min(initial_capacity, self.max_entries)))
+            yield
+        except BaseException:
+            self._conn.rollback()
+            raise
+        self._conn.commit()
+
+    def _capacity_on_disk(self):
+        if not os.path.exists(self._vectors_path):
+            return 0
+        return os.path.getsize(self._vectors_path) // (self.dim * 4)
+
+    def _map(self, capacity):
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(self._vectors_path, "ab") as vectors_file:
+            vectors_file.truncate(capacity * self.dim * 4)
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+
+    @property
+    def max_entries(self):
+        return max(1, self.max_bytes // (self.dim * 4))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    # Function to fetch cached vectors; returns {key: vector} for the keys found
+    def get_many(self, keys):
+        found = {}
+        if not keys or not self.dim:
+            return found
+        now = time.time()
+        with self._lock, self._transaction():
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, slot FROM entries WHERE key IN ({placeholders})", part
+                ).fetchall()
+                for key, slot in rows:
+                    found[key] = np.array(self._vectors[slot])
+                self._conn.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, key) for key, _ in rows])
+        return found
+
+    def _existing_keys(self, keys):
+        existing = set()
+        for start in range(0, len(keys), 500):
+            part = keys[start:start + 500]
+            placeholders = ",".join("?" * len(part))
+            existing.update(
+                row[0] for row in self._conn.execute(f"SELECT key FROM entries WHERE key IN ({placeholders})", part)
+            )
+        return existing
+
+    # Function to hand out n rows; runs inside _transaction, so next_slot is
+    # read and written under the same lock in every process
+    def _allocate(self, n):
+        slots = []
+        next_slot = self._get_meta("next_slot") or 0
+        free = self.max_entries - next_slot
+        if free > 0:
+            take = min(free, n)
+            slots.extend(range(next_slot, next_slot + take))
+            next_slot += take
+            self._set_meta("next_slot", next_slot)
+            capacity = self._vectors.shape[0]
+            if next_slot > capacity:
+                self._map(min(max(capacity * 2, next_slot), self.max_entries))
+        if len(slots) < n:
+            # Evict the least recently used entries and reuse their rows
+            evicted = self._conn.execute(
+                "SELECT key, slot FROM entries ORDER BY last_used LIMIT ?", (n - len(slots),)
+            ).fetchall()
+            self._conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+            slots.extend(slot for _, slot in evicted)
+        return slots
+
+    # Function to store vectors; keys that are already cached are skipped
+    def put_many(self, items):
+        if not items:
+            return
+        with self._lock, self._transaction():
+            if not self.dim:
+                self.dim = len(items[0][1])
+                self._set_meta("dim", self.dim)
+                self._map(min(initial_capacity, self.max_entries))
+            existing = self._existing_keys([key for key, _ in items])
+            items = [(key, vector) for key, vector in dict(items).items() if key not in existing]
+            # Never evict more than the cache can hold
+            items = items[-self.max_entries:]
+            slots = self._allocate(len(items))
+            now = time.time()
+            for (key, vector), slot in zip(items, slots):
+                self._vectors[slot] = np.asarray(vector, dtype=np.float32)
+            self._vectors.flush()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries (key, slot, last_used) VALUES (?, ?, ?)",
+                [(key, slot, now) for (key, _), slot in zip(items, slots)],
+            )
+
+
+# Embeddings wrapper that only calls the wrapped model for texts it has not
+# embedded before. Hit and miss counts are kept for the life of the object.
+class CachedEmbeddings(Embeddings):
+    def __init__(self, embeddings, store=None):
+        self.embeddings = embeddings
+        self.model = embedding_model_name(embeddings)
+        self.store = store if store is not None else EmbeddingStore()
+        self.hits = 0
+        self.misses = 0
+        self._counter_lock = threading.Lock()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self.store),
+        }
+
+    def _embed(self, texts, kind, embed_fn):
+        keys = [embedding_key(text, self.model, kind) for text in texts]
+        cached = self.store.get_many(list(dict.fromkeys(keys)))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        misses = sum(1 for key in keys if key in missing)
+        with self._counter_lock:
+            self.hits += len(texts) - misses
+            self.misses += misses
+        count("embedding_cache_hit", len(texts) - misses)
+        count("embedding_cache_miss", misses)
+
+        if missing:
+            with span("embedding_api", texts=len(missing)):
+                vectors = embed_fn(list(missing.values()))
+            new_items = list(zip(missing.keys(), vectors))
+            self.store.put_many(new_items)
+            cached.update((key, np.asarray(vector, dtype=np.float32)) for key, vector in new_items)
+
+        return [cached[key].tolist() for key in keys]
+
+    def embed_documents(self, texts):
+        return self._embed(texts, "document", self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        return self._embed([text], "query", lambda texts: [self.embeddings.embed_query(texts[0])])[0]
@@ -0,0 +1,136 @@
+import re
+
+from agent_context import build_context, count_tokens
+from intent_router import failure_dict, route_question, small_talk_reply
+from openai_pool import in_flight
+from resources import get_llm
+from tracing import count, span
+
+# Prompt building and answering for the ISO failure-code tables, kept free of
+# Streamlit widgets so the page and the batch runner can share it.
+
+
+def template_formation(context, input):
+    # Generic chat gets a canned reply (whole words only, so "which" is not "hi")
+    reply = small_talk_reply(input)
+    if reply is not None:
+        return reply
+    
+    # If input is not a generic chat, proceed with the custom template formation
+    # Only list the failure codes that appear in the context
+    available_codes = {code: desc for code, desc in failure_dict.items() if re.search(rf"\b{code}\b", str(context))} or failure_dict
+
+    PROMPT_SUFFIX = f"""Use only the following dataframe to process the query:
+    {context}
+   
+    The dataframe contains the failure codes and their descriptions.
+    In the dataframe, 1 represents a failure for a specific code, and 0 represents a non-failure code.
+     
+    Question: {input}"""
+ 
+    _DEFAULT_TEMPLATE = f"""Given an input question, first create a syntactically correct query to run on the dataframe, then
+    analyze the results of the query, and return the answer in a summarized tabular format.
+   
+    Make sure the query is compatible with the dataframe and returns relevant columns for the given question.
+    The response should consistently be displayed as a well-formatted table, using both the failure code abbreviation and full description.
+   
+    **Response Format:**
+   
+    | Failure Code | Description                    | Example                   |
+    |--------------|--------------------------------| --------------------------|
+    | FTS          | Failure to start on demand     | Doesn't start on demand   |
+    | STP          | Failure to stop on demand      | Doesn't stop on demand    |
+    | ...          | ...                            | ...                       |
+   
+    Ensure all output is consistent in this tabular format throughout the entire response.
+ 
+    If no relevant data is found based on the query, respond with a table indicating "No data available".
+   
+    Example:
+ 
+    | Failure Code | Description      | Example           |
+    |--------------|------------------|-------------------|          
+    | No data      | No data available| No data available |
+    |
+ 
+    Available Failure Codes:
+    {', '.join([f'{code} : {desc}' for code, desc in available_codes.items()])}
+    """
+   
+    return _DEFAULT_TEMPLATE + PROMPT_SUFFIX
+ 
+def maintenance_template(df, input):
+    # Greetings and thanks are answered without the template
+    reply = small_talk_reply(input)
+    if reply is not None:
+        return reply
+    
+    # If input is not a generic chat, proceed with the custom template formation
+    PROMPT_SUFFIX = f"""Use only the following dataframe to process the query:
+    {df}
+   
+    The dataframe contains maintenance activity codes and their descriptions.
+   
+    Return the answer as a pandas dataframe with appropriate column names for easy readability.
+     
+    Question: {input}"""
+ 
+    _DEFAULT_TEMPLATE = """Given an input question, analyze the dataframe and provide an answer based on the relevant information found in it.
+   
+    Return the response in a tabular format or as a pandas dataframe with clear column names.
+    """
+ 
+    return _DEFAULT_TEMPLATE + PROMPT_SUFFIX
+
+
+def response_generator(df, prompt, api_key, engine=None, sheet=None, callbacks=None, llm=None):
+    # Small talk and plain code lookups are answered locally; a lookup gets the
+    # definition only, not the classes the query engine would add
+    with span("route"):
+        route, reply = route_question(prompt)
+    if route in ("small_talk", "code_lookup"):
+        count("llm_avoided")
+        return reply
+
+    # Questions the matrix can answer directly never reach the agent
+    if engine is not None:
+        with span("matrix_answer"):
+            answer = engine.answer(prompt, sheet.name if sheet is not None else None)
+        if answer is not None:
+            count("matrix_answered")
+            count("llm_avoided")
+            return answer
+    count("agent_fallback")
+
+    # The agent stack (langchain_experimental, langchain) is imported on the first fallback only
+    from langchain.memory import ConversationBufferMemory
+    from langchain_experimental.agents import create_pandas_dataframe_agent
+
+    memory = ConversationBufferMemory()
+    if llm is None:
+        llm = get_llm('gpt-4', api_key, streaming=True)
+
+    def run_agent():
+        # Only the rows and columns the question needs go into the prompt and to the agent
+        if sheet is not None:
+            with span("context_build"):
+                context, agent_df = build_context(sheet, prompt, engine)
+        else:
+            context, agent_df = df, df
+        # Prompt sizes go on the trace (the benchmark compares them to the full frame)
+        with span("prompt_build") as attributes:
+            prompt_template = template_formation(context, prompt)
+            attributes["prompt_tokens"] = count_tokens(prompt_template)
+            attributes["context_tokens"] = count_tokens(str(context))
+        # The agent runs its own pandas code, so it gets a copy of the sheet's shared frame
+        agent = create_pandas_dataframe_agent(llm, agent_df.copy(), prefix=prompt_template, allow_dangerous_code=True, verbose=True)
+        response = agent.invoke({"input": prompt, "history": memory.buffer}, {"callbacks": callbacks}, handle_parsing_errors=True)
+        return response['output']
+
+    # Sessions asking the same question of the same table at the same time share one agent run
+    key = ("agent", getattr(llm, "model_name", None), sheet.name if sheet is not None else id(df), " ".join(prompt.lower().split()))
+    with span("agent"):
+        output, shared = in_flight.do(key, run_agent)
+    if shared:
+        count("agent_answer_shared")
+    return output
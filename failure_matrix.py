@@ -0,0 +1,225 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+
+workbook_path = "Annex B Failure modes matrix ISO 14224.xlsx"
+artifact_path = "annex_b_matrix"
+manifest_name = "manifest.json"
+artifact_format = 2
+
+# Layout of the Annex B matrix sheets: a header row of equipment class codes,
+# a row of class names, then one row per failure mode with X where it applies.
+CLASS_CODE_HEADER = "Equipment class code"
+FAILURE_MODE_HEADER = "Failure mode code"
+
+
+# Same conversion the page applied cell by cell: blank -> 0, X -> 1
+def _transform_column(column):
+    column = column.astype(object)
+    blank = column.isna()
+    marked = column == "X"
+    column = column.where(~blank, 0)
+    return column.where(~marked, 1)
+
+
+def _json_value(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+# One compiled sheet of the workbook. Matrix sheets keep failure-mode x class
+# incidence as a packed bit array; other sheets are kept as a plain table.
+class MatrixSheet:
+    def __init__(self, name, meta, packed=None):
+        self.name = name
+        self.kind = meta["kind"]
+        self.columns = meta["columns"]
+        self._meta = meta
+        self._packed = packed
+        self._incidence = None
+        self._frame = None
+        if self.kind == "matrix":
+            self.codes = meta["codes"]
+            self.descriptions = meta["descriptions"]
+            self.examples = meta["examples"]
+            self.class_codes = meta["class_codes"]
+            self.class_names = meta["class_names"]
+
+    @property
+    def is_matrix(self):
+        return self.kind == "matrix"
+
+    # Boolean array of shape (failure modes, equipment classes)
+    @property
+    def incidence(self):
+        if self._incidence is None:
+            bits = np.unpackbits(self._packed, axis=1, count=len(self.class_codes))
+            self._incidence = bits.astype(bool)
+        return self._incidence
+
+    # DataFrame in the layout the page used to build from the xlsx. Built once
+    # per sheet and shared, so callers must not modify it.
+    def to_frame(self):
+        if self._frame is None:
+            self._frame = self._build_frame()
+        return self._frame
+
+    def _build_frame(self):
+        if self.kind != "matrix":
+            df = pd.DataFrame(self._meta["rows"], columns=self.columns, dtype=object)
+            return df.astype(dict(zip(self.columns, self._meta["dtypes"])))
+
+        first_row = self._meta["first_row"] + self.class_names
+        data = {}
+        for i, column in enumerate(self.columns):
+            if i == 0:
+                values = self.codes
+            elif i == 1:
+                values = self.descriptions
+            elif i == 2:
+                values = self.examples
+            else:
+                values = self.incidence[:, i - 3].astype(int).tolist()
+            data[column] = [first_row[i]] + list(values)
+        return pd.DataFrame(data, dtype=object)
+
+
+class FailureMatrix:
+    def __init__(self, sheets):
+        self.sheets = sheets
+
+    @property
+    def sheet_names(self):
+        return list(self.sheets)
+
+    def __getitem__(self, sheet_name):
+        return self.sheets[sheet_name]
+
+    def matrix_sheets(self):
+        return [sheet for sheet in self.sheets.values() if sheet.is_matrix]
+
+
+def _is_matrix_sheet(df):
+    if df.shape[1] < 4 or df.shape[0] < 2:
+        return False
+    if df.columns[2] != CLASS_CODE_HEADER or df.iloc[0, 0] != FAILURE_MODE_HEADER:
+        return False
+    cells = df.iloc[1:, 3:]
+    return bool((cells.isna() | (cells == "X")).all().all())
+
+
+def _compile_sheet(df, bits_path):
+    columns = [str(column) for column in df.columns]
+    if not _is_matrix_sheet(df):
+        transformed = df.apply(_transform_column)
+        rows = [[_json_value(value) for value in row] for row in transformed.itertuples(index=False)]
+        # Column types as the page's cell-by-cell conversion left them (int64 codes stay int64)
+        dtypes = [str(dtype) for dtype in transformed.infer_objects().dtypes]
+        return {"kind": "table", "columns": columns, "rows": rows, "dtypes": dtypes}
+
+    body = df.iloc[1:]
+    examples = _transform_column(body.iloc[:, 2])
+    incidence = (body.iloc[:, 3:] == "X").to_numpy()
+    np.save(bits_path, np.packbits(incidence, axis=1))
+    return {
+        "kind": "matrix",
+        "columns": columns,
+        "first_row": [_json_value(value) for value in df.iloc[0, :3]],
+        "codes": [str(code) for code in body.iloc[:, 0]],
+        "descriptions": [_json_value(value) for value in _transform_column(body.iloc[:, 1])],
+        "examples": [_json_value(value) for value in examples],
+        "class_codes": columns[3:],
+        "class_names": [str(name) for name in df.iloc[0, 3:]],
+        "bits": os.path.basename(bits_path),
+    }
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for block in iter(lambda: source.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _source_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+# Function to compile every sheet of the workbook into the artifact directory
+def build_artifact(workbook_path=workbook_path, artifact_path=artifact_path):
+    tmp_path = artifact_path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    sheets = pd.read_excel(workbook_path, sheet_name=None)
+    manifest = {
+        "format": artifact_format,
+        "source_stamp": _source_stamp(workbook_path),
+        "source_sha256": _file_sha256(workbook_path),
+        "sheets": [],
+    }
+    for i, (name, df) in enumerate(sheets.items()):
+        meta = _compile_sheet(df, os.path.join(tmp_path, f"sheet{i}.npy"))
+        meta["name"] = name
+        manifest["sheets"].append(meta)
+
+    with open(os.path.join(tmp_path, manifest_name), "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file)
+
+    shutil.rmtree(artifact_path, ignore_errors=True)
+    os.replace(tmp_path, artifact_path)
+    print(f"Failure mode matrix compiled to {artifact_path}")
+    return manifest
+
+
+def _read_manifest(artifact_path):
+    path = os.path.join(artifact_path, manifest_name)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as manifest_file:
+        return json.load(manifest_file)
+
+
+# The artifact is current when it was built from this exact workbook. A touched
+# but unchanged file only gets its stamp refreshed.
+def _is_current(manifest, workbook_path, artifact_path):
+    if manifest is None or manifest.get("format") != artifact_format:
+        return False
+    if manifest["source_stamp"] == _source_stamp(workbook_path):
+        return True
+    if manifest["source_sha256"] != _file_sha256(workbook_path):
+        return False
+    manifest["source_stamp"] = _source_stamp(workbook_path)
+    with open(os.path.join(artifact_path, manifest_name), "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file)
+    return True
+
+
+# Function to open the compiled matrix, rebuilding it when the xlsx has changed.
+# Bit arrays are memory-mapped, so opening does not read them.
+def load_failure_matrix(workbook_path=workbook_path, artifact_path=artifact_path):
+    manifest = _read_manifest(artifact_path)
+    if not _is_current(manifest, workbook_path, artifact_path):
+        manifest = build_artifact(workbook_path, artifact_path)
+
+    sheets = {}
+    for meta in manifest["sheets"]:
+        packed = None
+        if meta["kind"] == "matrix":
+            packed = np.load(os.path.join(artifact_path, meta["bits"]), mmap_mode="r")
+        sheets[meta["name"]] = MatrixSheet(meta["name"], meta, packed)
+    return FailureMatrix(sheets)
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else workbook_path
+    target = sys.argv[2] if len(sys.argv) > 2 else artifact_path
+    build_artifact(source, target)
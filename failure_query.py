@@ -0,0 +1,249 @@
+import re
+
+import numpy as np
+
+equipment_sheet_name = "Table A.4 and EquipSubD"
+
+NEGATION = re.compile(r"\b(not|except|excluding|without|other than|never)\b", re.IGNORECASE)
+ALL_CLASSES = re.compile(r"\b(all|every|each|common|both)\b", re.IGNORECASE)
+MOST = re.compile(r"\b(most|maximum|max|highest|greatest|largest)\b", re.IGNORECASE)
+LEAST = re.compile(r"\b(least|fewest|minimum|min|lowest|smallest)\b", re.IGNORECASE)
+MODE_WORDS = re.compile(r"\b(failure modes?|modes?|failure codes?|codes?)\b", re.IGNORECASE)
+SINGLE_MODE = re.compile(r"\b(the|which|one) (failure )?(mode|code)\b", re.IGNORECASE)
+CLASS_WORDS = re.compile(r"\b(equipments?|class|classes|types?)\b", re.IGNORECASE)
+UPPER_TOKEN = re.compile(r"\b[A-Z][A-Z0-9]{1,3}\b")
+WORD = re.compile(r"[a-z0-9]+")
+
+# Single-word descriptions too common to identify a failure mode on their own
+VAGUE_DESCRIPTIONS = {"other", "unknown"}
+
+
+def _stem(word):
+    if len(word) > 3 and word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+def _words(text):
+    return [_stem(word) for word in WORD.findall(text.lower())]
+
+
+def _find_phrase(words, phrase):
+    n = len(phrase)
+    for start in range(len(words) - n + 1):
+        if words[start:start + n] == phrase:
+            return start
+    return None
+
+
+# Longest phrases win; a shorter phrase inside an accepted one is ignored
+def _match_phrases(words, phrases):
+    found = []
+    taken = set()
+    for key, phrase in sorted(phrases, key=lambda item: -len(item[1])):
+        start = _find_phrase(words, phrase)
+        if start is None:
+            continue
+        span = set(range(start, start + len(phrase)))
+        if span & taken:
+            continue
+        taken |= span
+        found.append(key)
+    return found, taken
+
+
+def _first_position(pattern, text):
+    match = pattern.search(text)
+    return match.start() if match else None
+
+
+def _markdown_table(rows):
+    lines = [
+        "| Failure Code | Description | Example |",
+        "|--------------|-------------|---------|",
+    ]
+    if not rows:
+        rows = [("No data", "No data available", "No data available")]
+    for code, description, example in rows:
+        lines.append(f"| {code} | {description} | {example} |")
+    return "\n".join(lines)
+
+
+# Deterministic answers to failure-mode questions over the Annex B matrix.
+# All sheets are merged into one incidence array of failure codes x equipment
+# classes, so each question becomes a few boolean reductions over columns.
+class FailureQueryEngine:
+    def __init__(self, matrix):
+        sheets = matrix.matrix_sheets()
+        self.codes = sorted({code for sheet in sheets for code in sheet.codes})
+        code_index = {code: i for i, code in enumerate(self.codes)}
+
+        self.class_codes = []
+        self.class_names = []
+        self.class_sheet = []
+        self.sheet_names = [sheet.name for sheet in sheets]
+        self.sheet_codes = np.zeros((len(self.codes), len(sheets)), dtype=bool)
+        self.details = {}
+        blocks = []
+        for s, sheet in enumerate(sheets):
+            rows = [code_index[code] for code in sheet.codes]
+            self.sheet_codes[rows, s] = True
+            block = np.zeros((len(self.codes), len(sheet.class_codes)), dtype=bool)
+            block[rows] = sheet.incidence
+            blocks.append(block)
+            self.class_codes.extend(sheet.class_codes)
+            self.class_names.extend(sheet.class_names)
+            self.class_sheet.extend([s] * len(sheet.class_codes))
+            for code, description, example in zip(sheet.codes, sheet.descriptions, sheet.examples):
+                self.details[(sheet.name, code)] = (description, example if example else "")
+        self.incidence = np.concatenate(blocks, axis=1)
+        self.class_sheet = np.array(self.class_sheet)
+
+        self.class_phrases = []
+        for i, name in enumerate(self.class_names):
+            self.class_phrases.append((i, _words(re.sub(r"\(.*?\)", "", name))))
+
+        self.description_phrases = []
+        for (_, code), (description, _) in self.details.items():
+            words = _words(str(description))
+            if len(words) == 1 and words[0] in VAGUE_DESCRIPTIONS:
+                continue
+            self.description_phrases.append((code, words))
+
+        # Equipment categories (Rotating, Mechanical, ...) from Table A.4
+        self.categories = {}
+        if equipment_sheet_name in matrix.sheet_names:
+            equipment = matrix[equipment_sheet_name].to_frame()
+            known = {code: i for i, code in enumerate(self.class_codes)}
+            for category, code in zip(equipment["Equipment category"], equipment["Equipment class code"]):
+                if code in known:
+                    self.categories.setdefault(str(category), set()).add(known[code])
+
+    def _describe(self, code, sheets):
+        for s in sheets:
+            key = (self.sheet_names[s], code)
+            if key in self.details:
+                return self.details[key]
+        for (sheet_name, other), detail in self.details.items():
+            if other == code:
+                return detail
+        return ("", "")
+
+    def _code_table(self, code_rows, sheets):
+        rows = []
+        for i in code_rows:
+            description, example = self._describe(self.codes[i], sheets)
+            rows.append((self.codes[i], description, example))
+        return _markdown_table(rows)
+
+    def _class_list(self, class_columns):
+        return ", ".join(self.class_names[c] for c in class_columns)
+
+    # Function to find the failure codes and equipment class columns a question names
+    def extract(self, question):
+        words = _words(question)
+        codes = []
+        classes = []
+        for token in UPPER_TOKEN.findall(question):
+            if token in self.codes and token not in codes:
+                codes.append(token)
+            elif token in self.class_codes:
+                classes.extend(c for c, code in enumerate(self.class_codes) if code == token and c not in classes)
+
+        found, taken = _match_phrases(words, self.class_phrases)
+        classes.extend(c for c in found if c not in classes)
+
+        remaining = [word if i not in taken else "" for i, word in enumerate(words)]
+        for category, members in self.categories.items():
+            stems = [word[:5] for word in _words(category)]
+            if all(any(word.startswith(stem) for word in remaining) for stem in stems):
+                classes.extend(c for c in sorted(members) if c not in classes)
+
+        described, _ = _match_phrases(words, self.description_phrases)
+        codes.extend(code for code in described if code not in codes)
+        return codes, classes
+
+    # Function to answer a question, or return None when it needs the LLM agent
+    def answer(self, question, sheet_name=None):
+        codes, classes = self.extract(question)
+        if not codes and not classes:
+            return None
+
+        mode_position = _first_position(MODE_WORDS, question)
+        class_position = _first_position(CLASS_WORDS, question)
+        if mode_position is None and class_position is None:
+            # "What does FTS mean?" asks for the definition, not where it applies
+            wants_classes = False
+        elif mode_position is None or class_position is None:
+            wants_classes = class_position is not None
+        else:
+            wants_classes = class_position < mode_position
+        negated = NEGATION.search(question) is not None
+        superlative = "max" if MOST.search(question) else "min" if LEAST.search(question) else None
+
+        # Scope: the sheets holding the named classes, else one sheet holding the
+        # codes (the selected one if it does), so a code shared by several
+        # tables is not answered with the classes of all of them
+        if classes:
+            sheets = sorted(set(self.class_sheet[classes].tolist()))
+        elif codes:
+            rows = [self.codes.index(code) for code in codes]
+            holding = np.flatnonzero(self.sheet_codes[rows].all(axis=0)).tolist()
+            if sheet_name in self.sheet_names and self.sheet_names.index(sheet_name) in holding:
+                sheets = [self.sheet_names.index(sheet_name)]
+            elif holding:
+                sheets = holding[:1]
+            else:
+                sheets = np.flatnonzero(self.sheet_codes[rows].any(axis=0)).tolist()
+        else:
+            sheets = list(range(len(self.sheet_names)))
+        scope_classes = np.flatnonzero(np.isin(self.class_sheet, sheets))
+        scope_codes = self.sheet_codes[:, sheets].any(axis=1)
+
+        if codes:
+            rows = [self.codes.index(code) for code in codes]
+            table = self._code_table(rows, sheets)
+            if not wants_classes and class_position is None:
+                return table
+            has_codes = self.incidence[np.ix_(rows, scope_classes)].all(axis=0)
+            matching = scope_classes[~has_codes if negated else has_codes]
+            if classes:
+                matching = [c for c in matching if c in classes]
+            if not len(matching):
+                return table + "\n\nNo equipment class in this table has " + ", ".join(codes) + "."
+            return table + "\n\n**Equipment classes:** " + self._class_list(matching)
+
+        group = self.incidence[:, classes]
+        if wants_classes:
+            columns = np.array(classes)
+            counts = group[scope_codes].sum(axis=0)
+            if superlative is None:
+                return None
+            target = counts.max() if superlative == "max" else counts.min()
+            best = columns[counts == target]
+            word = "most" if superlative == "max" else "fewest"
+            return f"**Equipment classes with the {word} failure modes ({int(target)}):** " + self._class_list(best)
+
+        if superlative is not None:
+            counts = group.sum(axis=1)
+            candidates = scope_codes & (counts > 0)
+            if not candidates.any():
+                return _markdown_table([])
+            values = np.where(candidates, counts, -1 if superlative == "max" else len(classes) + 1)
+            target = values.max() if superlative == "max" else values.min()
+            rows = np.flatnonzero(candidates & (counts == target))
+        elif negated:
+            rows = np.flatnonzero(scope_codes & ~group.any(axis=1))
+        elif ALL_CLASSES.search(question) or len(classes) > 1 and not re.search(r"\b(or|any)\b", question, re.IGNORECASE):
+            rows = np.flatnonzero(scope_codes & group.all(axis=1))
+        else:
+            rows = np.flatnonzero(scope_codes & group.any(axis=1))
+        # "What is the failure mode that ..." asks for one: the first in table
+        # order, with a count of the others rather than all of them
+        if len(rows) > 1 and SINGLE_MODE.search(question) and not MODE_WORDS.search(question).group().lower().endswith("s"):
+            others = len(rows) - 1
+            return self._code_table(rows[:1], sheets) + (
+                f"\n\n{others} other failure mode{'s' if others > 1 else ''} also "
+                f"appl{'y' if others > 1 else 'ies'}; ask for all failure modes to list them."
+            )
+        return self._code_table(rows, sheets)
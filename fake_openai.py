@@ -0,0 +1,192 @@
+import argparse
+import hashlib
+import json
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+embedding_dim = 1536
+
+# Local stand-in for the OpenAI chat and embedding endpoints. Answers are
+# deterministic functions of the request, so offline runs are reproducible.
+
+
+def fake_embedding(text, dim=embedding_dim):
+    seed = int.from_bytes(hashlib.sha256(str(text).encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def _estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def fake_completion(messages):
+    prompt = "\n".join(str(message.get("content", "")) for message in messages)
+    digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+    text = f"Offline answer {digest}."
+    # Agent prompts ask for the ReAct format; end the run in one step
+    if "Final Answer:" in prompt:
+        text = "Final Answer: " + text
+    return prompt, text
+
+
+# Requests and connections seen by a server, for the load test
+class ServerStats:
+    def __init__(self):
+        self.counts = Counter()
+        self.recent = deque()
+        self._lock = threading.Lock()
+
+    def add(self, key, value=1):
+        with self._lock:
+            self.counts[key] += value
+
+    # Function to record a request and tell whether it is within `rpm` over the last minute
+    def admit(self, rpm):
+        now = time.monotonic()
+        with self._lock:
+            while self.recent and self.recent[0] <= now - 60:
+                self.recent.popleft()
+            if rpm and len(self.recent) >= rpm:
+                return False
+            self.recent.append(now)
+            return True
+
+    def as_dict(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so clients that pool connections can reuse them
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    rpm = 0
+    stats = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.stats.add("connections")
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        self.stats.add(self.path)
+        if not self.stats.admit(self.rpm):
+            self.stats.add("rate_limited")
+            self._send_json({"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}, status=429)
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        if self.path.endswith("/embeddings"):
+            self._embeddings(request)
+        elif self.path.endswith("/chat/completions"):
+            self._chat(request)
+        else:
+            self._send_json({"error": {"message": f"Unknown path {self.path}"}}, status=404)
+
+    def _embeddings(self, request):
+        inputs = request.get("input", [])
+        if not isinstance(inputs, list) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        data = [{"object": "embedding", "index": i, "embedding": fake_embedding(text)} for i, text in enumerate(inputs)]
+        tokens = sum(_estimate_tokens(str(text)) for text in inputs)
+        self._send_json({
+            "object": "list",
+            "data": data,
+            "model": request.get("model", "fake-embedding"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def _chat(self, request):
+        prompt, text = fake_completion(request.get("messages", []))
+        model = request.get("model", "fake-chat")
+        usage = {
+            "prompt_tokens": _estimate_tokens(prompt),
+            "completion_tokens": _estimate_tokens(text),
+            "total_tokens": _estimate_tokens(prompt) + _estimate_tokens(text),
+        }
+        if not request.get("stream"):
+            self._send_json({
+                "id": "chatcmpl-offline",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        # Streams have no length, so the connection ends with the stream
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for i, word in enumerate(text.split(" ")):
+            delta = {"role": "assistant", "content": word if i == 0 else " " + word}
+            chunk = {
+                "id": "chatcmpl-offline",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        done = {
+            "id": "chatcmpl-offline",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }
+        self.wfile.write(f"data: {json.dumps(done)}\n\n".encode("utf-8"))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            final = dict(done, choices=[], usage=usage)
+            self.wfile.write(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+# Function to start the stand-in server on a background thread; returns the
+# server and the base URL to give the OpenAI clients. With `rpm` set, requests
+# over that many per minute get a 429 like the real API. Counts of requests
+# and connections are kept on `server.stats`.
+def start_server(host="127.0.0.1", port=0, latency=0.0, rpm=0):
+    stats = ServerStats()
+    handler = type("Handler", (FakeOpenAIHandler,), {"latency": latency, "rpm": rpm, "stats": stats})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.stats = stats
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI chat and embedding endpoints")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8999)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before every response")
+    parser.add_argument("--rpm", type=int, default=0, help="answer 429 above this many requests per minute (0: no limit)")
+    args = parser.parse_args()
+    server, base_url = start_server(args.host, args.port, args.latency, args.rpm)
+    print(f"Fake OpenAI server listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,298 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import faiss
+from langchain_community.vectorstores import FAISS
+
+from ann_index import ensure_index_type, read_index, remove_vectors, save_settings, target_index_type
+from lexical_index import LexicalIndex
+from sqlite_docstore import PositionMap, SQLiteDocstore, copy_docstore, docstore_path, open_docstore
+from tracing import span
+
+index_save_path = "faiss_index.bin"
+registry_file_name = "registry.json"
+
+# One lock per process: Streamlit sessions run as threads of the same server
+_registry_lock = threading.Lock()
+
+
+# Settings of a text splitter that change the produced chunks
+def splitter_settings(text_splitter):
+    settings = {
+        "type": type(text_splitter).__name__,
+        "chunk_size": getattr(text_splitter, "_chunk_size", None),
+        "chunk_overlap": getattr(text_splitter, "_chunk_overlap", None),
+    }
+    # Splitters with extra knobs (e.g. the ISO chunker) report them too
+    if hasattr(text_splitter, "settings"):
+        settings.update(text_splitter.settings())
+    return settings
+
+
+# Name of the embedding model behind an embeddings object
+def embedding_model_name(embeddings):
+    return getattr(embeddings, "model", None) or type(embeddings).__name__
+
+
+# Content address of a PDF: its bytes plus everything that shapes its vectors
+def document_key(pdf_bytes, text_splitter_settings, embedding_model):
+    digest = hashlib.sha256()
+    digest.update(pdf_bytes)
+    settings = {"splitter": text_splitter_settings, "embedding_model": embedding_model}
+    digest.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _registry_path(index_save_path):
+    return os.path.join(index_save_path, registry_file_name)
+
+
+def _empty_registry(embedding_model):
+    return {"embedding_model": embedding_model, "version": 0, "documents": {}}
+
+
+# Function to load the registry of documents stored in the shared index
+def load_registry(index_save_path):
+    path = _registry_path(index_save_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as registry_file:
+        return json.load(registry_file)
+
+
+# Function to save the registry next to the FAISS files (atomic replace)
+def save_registry(registry, index_save_path):
+    os.makedirs(index_save_path, exist_ok=True)
+    path = _registry_path(index_save_path)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as registry_file:
+        json.dump(registry, registry_file, indent=2)
+    os.replace(tmp_path, path)
+
+
+# Version of the shared index; changes every time a document is added
+def index_version(index_save_path):
+    registry = load_registry(index_save_path)
+    if registry is None:
+        return 0
+    return registry["version"]
+
+
+# Function to check whether a document is already in the shared index
+def is_indexed(doc_key, index_save_path=index_save_path):
+    registry = load_registry(index_save_path)
+    return registry is not None and doc_key in registry["documents"]
+
+
+# Hash of a document's chunk texts, in order
+def chunks_hash(texts):
+    digest = hashlib.sha256()
+    for text in texts:
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+# An index saved before the registry existed: group its chunks by source file
+# and keep a hash of their texts, the only record of which PDF they came from
+def _legacy_registry(vector_store, embedding_model):
+    registry = _empty_registry(embedding_model)
+    texts = {}
+    for docstore_id in vector_store.index_to_docstore_id.values():
+        document = vector_store.docstore.search(docstore_id)
+        source = document.metadata.get("source", "unknown")
+        entry = registry["documents"].setdefault(
+            "legacy:" + source, {"source": source, "chunks": 0, "ids": [], "added": None}
+        )
+        entry["ids"].append(docstore_id)
+        entry["chunks"] += 1
+        texts.setdefault(source, []).append(document.page_content)
+    for source, source_texts in texts.items():
+        registry["documents"]["legacy:" + source]["content_hash"] = chunks_hash(source_texts)
+    return registry
+
+
+# Function to write the registry of an index saved before the registry existed.
+# Runs once; returns the registry, or None when there is no index yet.
+def migrate_legacy_index(embeddings, index_save_path=index_save_path):
+    with _registry_lock:
+        registry = load_registry(index_save_path)
+        if registry is not None or not os.path.exists(os.path.join(index_save_path, "index.faiss")):
+            return registry
+        vector_store = load_faiss_index(index_save_path, embeddings, mmap=True)
+        try:
+            registry = _legacy_registry(vector_store, embedding_model_name(embeddings))
+        finally:
+            close_faiss_index(vector_store)
+        save_registry(registry, index_save_path)
+        print(f"Registry written for legacy index at {index_save_path} ({len(registry['documents'])} documents)")
+        return registry
+
+
+# Chunk texts of a PDF as pre-registry indexes were built: every page split on
+# its own with the default RecursiveCharacterTextSplitter
+def _legacy_chunk_texts(pdf_bytes, source):
+    import fitz
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    from ingestion import iter_chunks, iter_pages
+
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        return [chunk.page_content for chunk in iter_chunks(iter_pages(doc, source), RecursiveCharacterTextSplitter())]
+    finally:
+        doc.close()
+
+
+# Function to hand a legacy entry to an uploaded document, before anything is
+# embedded. The file name alone proves nothing (a revised edition may keep it),
+# so the entry is only taken when the PDF chunks to exactly the stored texts.
+# Returns True when the document is now in the index.
+def adopt_legacy_document(doc_key, source, pdf_bytes, embeddings, index_save_path=index_save_path):
+    registry = migrate_legacy_index(embeddings, index_save_path)
+    legacy_key = "legacy:" + source
+    if registry is None or legacy_key not in registry["documents"]:
+        return False
+    if registry["embedding_model"] != embedding_model_name(embeddings):
+        return False
+    if chunks_hash(_legacy_chunk_texts(pdf_bytes, source)) != registry["documents"][legacy_key].get("content_hash"):
+        print(f"{source} differs from the legacy document of the same name, indexing it anew")
+        return False
+
+    with _registry_lock:
+        registry = load_registry(index_save_path)
+        entry = registry["documents"].pop(legacy_key, None)
+        if entry is None:
+            return doc_key in registry["documents"]
+        entry["added"] = time.time()
+        registry["documents"][doc_key] = entry
+        save_registry(registry, index_save_path)
+    print(f"{source} found in legacy index, reusing stored vectors")
+    return True
+
+
+# Function to load the shared FAISS index from disk. With mmap the vectors stay
+# in the page cache instead of being read into memory; such a store is for
+# querying only.
+def load_faiss_index(index_save_path, embeddings, mmap=False):
+    with span("faiss_load"):
+        index = read_index(index_save_path, mmap)
+        docstore = open_docstore(index_save_path)
+        vector_store = FAISS(embeddings, index, docstore, PositionMap(docstore))
+    print(f"FAISS index loaded from {index_save_path}{' (mmap)' if mmap else ''}")
+    return vector_store
+
+
+# Function to release a loaded store's docstore connection once the store is
+# replaced or no longer needed
+def close_faiss_index(vector_store):
+    if vector_store is not None and isinstance(vector_store.docstore, SQLiteDocstore):
+        vector_store.docstore.close()
+
+
+# Function to write a store to disk: the docstore is committed first and the
+# new index.faiss swapped in after, so a reader never gets positions the
+# docstore cannot resolve. A store built in memory gets its SQLite docstore here.
+# `target` is the ANN type to record for the index (see ann_index.target_index_type).
+def save_faiss_index(vector_store, index_save_path, target=None):
+    os.makedirs(index_save_path, exist_ok=True)
+    if not isinstance(vector_store.docstore, SQLiteDocstore):
+        docstore = SQLiteDocstore(docstore_path(index_save_path))
+        copy_docstore(vector_store.docstore, vector_store.index_to_docstore_id, docstore)
+        vector_store.docstore = docstore
+        vector_store.index_to_docstore_id = PositionMap(docstore)
+    index_path = os.path.join(index_save_path, "index.faiss")
+    faiss.write_index(vector_store.index, index_path + ".tmp")
+    vector_store.docstore.commit()
+    os.replace(index_path + ".tmp", index_path)
+    save_settings(vector_store.index, index_save_path, target)
+
+
+# Function to make sure a document is in the shared index and return that index.
+# `ingest(vector_store)` is only called when the document has not been indexed
+# yet; it adds the document's chunks and returns the store and the new chunk ids.
+def index_document(doc_key, source, ingest, embeddings, index_save_path=index_save_path):
+    embedding_model = embedding_model_name(embeddings)
+    with _registry_lock:
+        index_exists = os.path.exists(os.path.join(index_save_path, "index.faiss"))
+        vector_store = load_faiss_index(index_save_path, embeddings) if index_exists else None
+
+        registry = load_registry(index_save_path)
+        if registry is None:
+            if vector_store is not None:
+                registry = _legacy_registry(vector_store, embedding_model)
+            else:
+                registry = _empty_registry(embedding_model)
+
+        if registry["embedding_model"] != embedding_model:
+            raise ValueError(
+                f"Index at {index_save_path} holds {registry['embedding_model']} vectors, "
+                f"cannot add {embedding_model} vectors to it"
+            )
+
+        if doc_key in registry["documents"]:
+            print(f"{source} already indexed, reusing stored vectors")
+            return vector_store
+
+        # The type the index was converted to (or the default for a new one)
+        kind = target_index_type(index_save_path, vector_store.index if vector_store is not None else None)
+        try:
+            vector_store, ids = ingest(vector_store)
+            # An image-only or empty PDF gives no chunks (and, on a new index, no store)
+            if not ids:
+                raise ValueError(f"No extractable text in {source}")
+            # New stores start flat; they move to the target ANN type once there is enough to train on
+            vector_store.index = ensure_index_type(vector_store.index, kind)
+            with span("index_save"):
+                save_faiss_index(vector_store, index_save_path, kind)
+        except BaseException:
+            # Chunks of a failed run must not stay in the docstore's open transaction
+            if vector_store is not None and isinstance(vector_store.docstore, SQLiteDocstore):
+                vector_store.docstore.rollback()
+                vector_store.docstore.close()
+            raise
+
+        registry["documents"][doc_key] = {
+            "source": source,
+            "chunks": len(ids),
+            "ids": ids,
+            "added": time.time(),
+        }
+        registry["version"] += 1
+        # The lexical index covers the same chunks, so it is rebuilt with the store
+        with span("lexical_index_build"):
+            LexicalIndex.from_vector_store(vector_store, registry["version"]).save(index_save_path)
+        save_registry(registry, index_save_path)
+        print(f"{source} added to FAISS index at {index_save_path} ({len(ids)} chunks)")
+        return vector_store
+
+
+# Function to take a document back out of the shared index: its vectors,
+# docstore rows and registry entry go, and the lexical index is rebuilt
+def remove_document(doc_key, embeddings, index_save_path=index_save_path):
+    with _registry_lock:
+        registry = load_registry(index_save_path)
+        if registry is None or doc_key not in registry["documents"]:
+            raise KeyError(f"{doc_key} is not in the index at {index_save_path}")
+        entry = registry["documents"][doc_key]
+
+        vector_store = load_faiss_index(index_save_path, embeddings)
+        try:
+            positions = vector_store.docstore.positions(entry["ids"])
+            vector_store.index = remove_vectors(vector_store.index, positions)
+            vector_store.docstore.remove(entry["ids"])
+            save_faiss_index(vector_store, index_save_path)
+        except BaseException:
+            vector_store.docstore.rollback()
+            vector_store.docstore.close()
+            raise
+
+        del registry["documents"][doc_key]
+        registry["version"] += 1
+        LexicalIndex.from_vector_store(vector_store, registry["version"]).save(index_save_path)
+        save_registry(registry, index_save_path)
+        print(f"{entry['source']} removed from FAISS index at {index_save_path} ({len(positions)} chunks)")
+        return vector_store
@@ -0,0 +1,136 @@
+import contextvars
+import itertools
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import fitz
+import openai
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from tracing import span
+
+batch_size = 64
+max_workers = 4
+max_retries = 6
+initial_backoff = 1.0
+
+
+# Deterministic id of the n-th chunk of a document
+def chunk_id(doc_key, chunk_number):
+    return f"{doc_key[:16]}-{chunk_number}"
+
+
+# Generator over the pages of a PDF held in memory, one Document per page
+def iter_pages(doc, source):
+    total_pages = doc.page_count
+    for page in doc:
+        metadata = {"source": source, "file_path": source, "page": page.number, "total_pages": total_pages}
+        with span("pdf_parse"):
+            text = page.get_text()
+        yield Document(page_content=text, metadata=metadata)
+
+
+# Generator over the chunks of a stream of pages. Splitters that need to see
+# across page boundaries (the ISO chunker) take the whole stream.
+def iter_chunks(pages, text_splitter):
+    if hasattr(text_splitter, "iter_split"):
+        yield from text_splitter.iter_split(pages)
+        return
+    for page in pages:
+        with span("split"):
+            chunks = text_splitter.split_documents([page])
+        yield from chunks
+
+
+def batched(iterable, n):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, n))
+        if not batch:
+            return
+        yield batch
+
+
+# Function to embed one batch, backing off exponentially on 429 responses
+def embed_with_backoff(embeddings, texts):
+    delay = initial_backoff
+    for attempt in range(max_retries + 1):
+        try:
+            with span("embed_batch", texts=len(texts), attempt=attempt):
+                return embeddings.embed_documents(texts)
+        except openai.RateLimitError:
+            if attempt == max_retries:
+                raise
+            time.sleep(delay + random.uniform(0, delay))
+            delay *= 2
+
+
+def add_batch(vector_store, embeddings, batch, vectors, ids):
+    text_embeddings = [(document.page_content, vector) for document, vector in zip(batch, vectors)]
+    metadatas = [document.metadata for document in batch]
+    if vector_store is None:
+        return FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=ids)
+    vector_store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+    return vector_store
+
+
+# Generator over the embedded batches of a PDF: pages are parsed lazily, chunked
+# as they arrive and embedded in bounded batches on a thread pool, with at most
+# `max_workers` batches in flight. Yields (batch_number, documents, ids, vectors,
+# total_pages) as batches finish. Batches numbered in `skip_batches` (already
+# embedded by an earlier run) are chunked but not embedded again.
+def embed_pdf(pdf_bytes, source, doc_key, text_splitter, embeddings, skip_batches=()):
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    total_pages = doc.page_count
+    skip_batches = set(skip_batches)
+    try:
+        chunks = iter_chunks(iter_pages(doc, source), text_splitter)
+        batches = enumerate(batched(chunks, batch_size))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pending = {}
+
+            def submit_next():
+                for batch_number, batch in batches:
+                    if batch_number in skip_batches:
+                        continue
+                    for document in batch:
+                        document.metadata["doc_key"] = doc_key
+                    texts = [document.page_content for document in batch]
+                    # Workers run in a copy of the caller's context so their spans land in its trace
+                    context = contextvars.copy_context()
+                    pending[pool.submit(context.run, embed_with_backoff, embeddings, texts)] = (batch_number, batch)
+                    return True
+                return False
+
+            for _ in range(max_workers):
+                if not submit_next():
+                    break
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch_number, batch = pending.pop(future)
+                    vectors = future.result()
+                    submit_next()
+                    first = batch_number * batch_size
+                    batch_ids = [chunk_id(doc_key, first + i) for i in range(len(batch))]
+                    yield batch_number, batch, batch_ids, vectors, total_pages
+    finally:
+        doc.close()
+
+
+# Function to stream a PDF into a vector store, one embedded batch at a time
+def ingest_pdf(pdf_bytes, source, doc_key, text_splitter, embeddings, vector_store=None, on_progress=None):
+    ids = []
+    pages_done = 0
+    for _, batch, batch_ids, vectors, total_pages in embed_pdf(pdf_bytes, source, doc_key, text_splitter, embeddings):
+        with span("index_add"):
+            vector_store = add_batch(vector_store, embeddings, batch, vectors, batch_ids)
+        ids.extend(batch_ids)
+        pages_done = max(pages_done, batch[-1].metadata["page"] + 1)
+        if on_progress is not None:
+            on_progress(len(ids), pages_done, total_pages)
+    return vector_store, ids
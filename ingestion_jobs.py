@@ -0,0 +1,348 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+import numpy as np
+
+from index_registry import adopt_legacy_document, close_faiss_index, index_document, index_save_path, is_indexed
+from tracing import count, span, trace_turn
+
+ingestion_jobs_path = "ingestion_jobs"
+worker_count = int(os.environ.get("ISO_INGEST_WORKERS", 2))
+poll_interval = 1.0
+
+# Background ingestion. An upload is written to disk and queued in SQLite; a
+# pool of worker threads embeds it batch by batch, saving every embedded batch
+# as a checkpoint, and finally adds the document to the shared index. A job cut
+# off by a crash or restart starts again from its last checkpoint, so only the
+# batches that never finished are embedded again.
+
+_schema = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    doc_key TEXT NOT NULL,
+    source TEXT NOT NULL,
+    splitter TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    total_pages INTEGER,
+    pages_done INTEGER NOT NULL DEFAULT 0,
+    chunks_done INTEGER NOT NULL DEFAULT 0,
+    chunks_indexed INTEGER NOT NULL DEFAULT 0,
+    batches_done INTEGER NOT NULL DEFAULT 0,
+    resumed INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    trace TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+CREATE INDEX IF NOT EXISTS jobs_doc_key ON jobs (doc_key);
+CREATE TABLE IF NOT EXISTS batches (
+    job_id TEXT NOT NULL,
+    batch_number INTEGER NOT NULL,
+    ids TEXT NOT NULL,
+    texts TEXT NOT NULL,
+    metadatas TEXT NOT NULL,
+    vectors BLOB NOT NULL,
+    dim INTEGER NOT NULL,
+    PRIMARY KEY (job_id, batch_number)
+);
+"""
+
+# status: queued -> running -> done | failed
+# stage:  queued -> embedding -> indexing -> done
+_job_columns = [
+    "id", "doc_key", "source", "splitter", "status", "stage", "total_pages", "pages_done", "chunks_done",
+    "chunks_indexed", "batches_done", "resumed", "error", "trace", "created", "updated",
+]
+
+
+# Text splitter rebuilt from the settings stored with a job
+def splitter_from_settings(settings):
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    if settings["type"] == "ISOTextSplitter":
+        from iso_chunker import ISOTextSplitter
+
+        return ISOTextSplitter.from_settings(settings)
+    if settings["type"] != "RecursiveCharacterTextSplitter":
+        raise ValueError(f"Cannot rebuild a {settings['type']} for a queued job")
+    return RecursiveCharacterTextSplitter(chunk_size=settings["chunk_size"], chunk_overlap=settings["chunk_overlap"])
+
+
+# The persisted queue: jobs, their uploaded PDFs and their embedded batches
+class IngestionQueue:
+    def __init__(self, path=ingestion_jobs_path):
+        self.path = path
+        os.makedirs(os.path.join(path, "pdfs"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(path, "jobs.sqlite"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_schema)
+        self._conn.commit()
+
+    def _pdf_path(self, job_id):
+        return os.path.join(self.path, "pdfs", f"{job_id}.pdf")
+
+    def _job(self, row):
+        if row is None:
+            return None
+        job = dict(zip(_job_columns, row))
+        job["splitter"] = json.loads(job["splitter"])
+        job["trace"] = json.loads(job["trace"]) if job["trace"] else None
+        return job
+
+    def _select(self, where, params=(), limit=None):
+        sql = f"SELECT {', '.join(_job_columns)} FROM jobs WHERE {where} ORDER BY created DESC"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [self._job(row) for row in rows]
+
+    def _write(self, sql, params=()):
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            self._conn.commit()
+            return cursor.rowcount
+
+    def create(self, pdf_bytes, source, doc_key, text_splitter_settings):
+        job_id = uuid.uuid4().hex
+        # The upload goes to disk before the job exists, so a queued job always has its PDF
+        pdf_path = self._pdf_path(job_id)
+        with open(pdf_path + ".tmp", "wb") as pdf_file:
+            pdf_file.write(pdf_bytes)
+        os.replace(pdf_path + ".tmp", pdf_path)
+        now = time.time()
+        self._write(
+            "INSERT INTO jobs (id, doc_key, source, splitter, status, stage, created, updated) "
+            "VALUES (?, ?, ?, ?, 'queued', 'queued', ?, ?)",
+            (job_id, doc_key, source, json.dumps(text_splitter_settings), now, now),
+        )
+        return self.get(job_id)
+
+    def get(self, job_id):
+        jobs = self._select("id = ?", (job_id,))
+        return jobs[0] if jobs else None
+
+    # Latest job for a document, if any
+    def latest(self, doc_key):
+        jobs = self._select("doc_key = ?", (doc_key,), limit=1)
+        return jobs[0] if jobs else None
+
+    def recent(self, limit=20):
+        return self._select("1 = 1", limit=limit)
+
+    def read_pdf(self, job_id):
+        with open(self._pdf_path(job_id), "rb") as pdf_file:
+            return pdf_file.read()
+
+    # Function to take the oldest queued job that `runnable(job)` accepts
+    def claim(self, runnable):
+        for job in reversed(self._select("status = 'queued'")):
+            if not runnable(job):
+                continue
+            if self._write("UPDATE jobs SET status = 'running', updated = ? WHERE id = ? AND status = 'queued'", (time.time(), job["id"])):
+                return self.get(job["id"])
+        return None
+
+    def update(self, job_id, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._write(f"UPDATE jobs SET {assignments}, updated = ? WHERE id = ?", (*fields.values(), time.time(), job_id))
+
+    # Function to checkpoint one embedded batch together with the job's progress
+    def save_batch(self, job_id, batch_number, ids, documents, vectors, pages_done, total_pages):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO batches (job_id, batch_number, ids, texts, metadatas, vectors, dim) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, batch_number, json.dumps(ids), json.dumps([document.page_content for document in documents]),
+                 json.dumps([document.metadata for document in documents], default=str), vectors.tobytes(), vectors.shape[1]),
+            )
+            self._conn.execute(
+                "UPDATE jobs SET stage = 'embedding', total_pages = ?, pages_done = MAX(pages_done, ?), "
+                "chunks_done = chunks_done + ?, batches_done = batches_done + 1, updated = ? WHERE id = ?",
+                (total_pages, pages_done, len(ids), time.time(), job_id),
+            )
+            self._conn.commit()
+
+    def done_batches(self, job_id):
+        with self._lock:
+            rows = self._conn.execute("SELECT batch_number FROM batches WHERE job_id = ?", (job_id,)).fetchall()
+        return {row[0] for row in rows}
+
+    # Generator over the checkpointed batches of a job in chunk order, as
+    # (ids, texts, metadatas, vectors)
+    def batches(self, job_id):
+        with self._lock:
+            numbers = [row[0] for row in self._conn.execute(
+                "SELECT batch_number FROM batches WHERE job_id = ? ORDER BY batch_number", (job_id,)
+            ).fetchall()]
+        for batch_number in numbers:
+            with self._lock:
+                ids, texts, metadatas, vectors, dim = self._conn.execute(
+                    "SELECT ids, texts, metadatas, vectors, dim FROM batches WHERE job_id = ? AND batch_number = ?", (job_id, batch_number)
+                ).fetchone()
+            yield json.loads(ids), json.loads(texts), json.loads(metadatas), np.frombuffer(vectors, dtype=np.float32).reshape(-1, dim)
+
+    # Function to close a finished job: its checkpoints and PDF are no longer needed
+    def finish(self, job_id, trace=None):
+        with self._lock:
+            self._conn.execute("DELETE FROM batches WHERE job_id = ?", (job_id,))
+            self._conn.execute(
+                "UPDATE jobs SET status = 'done', stage = 'done', error = NULL, trace = ?, updated = ? WHERE id = ?",
+                (json.dumps(trace, default=str) if trace else None, time.time(), job_id),
+            )
+            self._conn.commit()
+        if os.path.exists(self._pdf_path(job_id)):
+            os.remove(self._pdf_path(job_id))
+
+    # A failed job keeps its checkpoints and PDF, so a retry resumes from them
+    def fail(self, job_id, error, trace=None):
+        self.update(job_id, status="failed", error=error, trace=json.dumps(trace, default=str) if trace else None)
+
+    def requeue(self, job_id):
+        return self._write("UPDATE jobs SET status = 'queued', error = NULL, updated = ? WHERE id = ? AND status = 'failed'", (time.time(), job_id))
+
+    # Function to put jobs left running by a previous server process back in
+    # the queue. Like the index registry lock, this assumes one server process
+    # owns the queue directory.
+    def requeue_interrupted(self):
+        return self._write(
+            "UPDATE jobs SET status = 'queued', resumed = resumed + 1, updated = ? WHERE status = 'running'", (time.time(),)
+        )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Worker pool over the queue. Embeddings are kept in memory only, never stored
+# with a job: a job runs with the embeddings of the session that submitted it,
+# or `default_embeddings` when that session is gone (e.g. after a restart).
+class IngestionService:
+    def __init__(self, queue=None, workers=worker_count, default_embeddings=None, index_save_path=index_save_path):
+        self.queue = queue or IngestionQueue()
+        self.default_embeddings = default_embeddings
+        self.index_save_path = index_save_path
+        self._embeddings = {}
+        self._wakeup = threading.Condition()
+        self._stopped = False
+        interrupted = self.queue.requeue_interrupted()
+        if interrupted:
+            print(f"{interrupted} interrupted ingestion job(s) queued again")
+        self._threads = [threading.Thread(target=self._work, name=f"ingestion-{n}", daemon=True) for n in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def _notify(self):
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def _embeddings_for(self, job):
+        return self._embeddings.get(job["id"], self.default_embeddings)
+
+    # Function to queue a document for ingestion. A document that already has a
+    # queued, running or failed job is not queued twice; that job is returned and
+    # picks up the caller's embeddings.
+    def submit(self, pdf_bytes, source, doc_key, text_splitter_settings, embeddings):
+        job = self.queue.latest(doc_key)
+        if job is None or job["status"] == "done":
+            job = self.queue.create(pdf_bytes, source, doc_key, text_splitter_settings)
+            count("ingest_job_queued")
+        self._embeddings[job["id"]] = embeddings
+        self._notify()
+        return job
+
+    def retry(self, job_id, embeddings=None):
+        if embeddings is not None:
+            self._embeddings[job_id] = embeddings
+        self.queue.requeue(job_id)
+        self._notify()
+        return self.queue.get(job_id)
+
+    def job(self, job_id):
+        return self.queue.get(job_id)
+
+    def job_for(self, doc_key):
+        return self.queue.latest(doc_key)
+
+    def jobs(self, limit=20):
+        return self.queue.recent(limit)
+
+    def stop(self, timeout=None):
+        self._stopped = True
+        self._notify()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _work(self):
+        while not self._stopped:
+            job = self.queue.claim(lambda job: self._embeddings_for(job) is not None)
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(poll_interval)
+                continue
+            self._run(job, self._embeddings_for(job))
+
+    def _run(self, job, embeddings):
+        job_id = job["id"]
+        error = None
+        with trace_turn("document", kind="ingest") as trace:
+            try:
+                pdf_bytes = self.queue.read_pdf(job_id)
+                # Nothing is embedded for a document the index already holds
+                if is_indexed(job["doc_key"], self.index_save_path) or adopt_legacy_document(
+                    job["doc_key"], job["source"], pdf_bytes, embeddings, self.index_save_path
+                ):
+                    count("ingest_job_skipped")
+                else:
+                    self._embed_and_index(job, pdf_bytes, embeddings)
+            except Exception as exception:
+                traceback.print_exc()
+                count("ingest_job_failed")
+                error = f"{type(exception).__name__}: {exception}"
+        if error is not None:
+            self.queue.fail(job_id, error, trace.as_dict())
+        else:
+            self.queue.finish(job_id, trace.as_dict())
+            print(f"Ingestion job for {job['source']} done in {trace.as_dict()['total_s']:.2f} s")
+        self._embeddings.pop(job_id, None)
+
+    def _embed_and_index(self, job, pdf_bytes, embeddings):
+        from langchain_core.documents import Document
+
+        from ingestion import add_batch, embed_pdf
+
+        job_id = job["id"]
+        done_batches = self.queue.done_batches(job_id)
+        if done_batches:
+            count("ingest_job_resumed")
+            print(f"Resuming {job['source']} after {len(done_batches)} checkpointed batches")
+        self.queue.update(job_id, stage="embedding")
+        text_splitter = splitter_from_settings(job["splitter"])
+        for batch_number, batch, batch_ids, vectors, total_pages in embed_pdf(
+            pdf_bytes, job["source"], job["doc_key"], text_splitter, embeddings, done_batches
+        ):
+            with span("checkpoint"):
+                self.queue.save_batch(job_id, batch_number, batch_ids, batch, vectors, batch[-1].metadata["page"] + 1, total_pages)
+
+        self.queue.update(job_id, stage="indexing", chunks_indexed=0)
+
+        def ingest(vector_store):
+            ids = []
+            for batch_ids, texts, metadatas, vectors in self.queue.batches(job_id):
+                batch = [Document(page_content=text, metadata=metadata) for text, metadata in zip(texts, metadatas)]
+                with span("index_add"):
+                    vector_store = add_batch(vector_store, embeddings, batch, vectors, batch_ids)
+                ids.extend(batch_ids)
+                self.queue.update(job_id, chunks_indexed=len(ids))
+            return vector_store, ids
+
+        # The pages load their own copy of the new index; this one is done with
+        close_faiss_index(index_document(job["doc_key"], job["source"], ingest, embeddings, self.index_save_path))
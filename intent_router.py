@@ -0,0 +1,112 @@
+import re
+
+from tracing import count
+
+# Cheap local routing of chat questions in front of the LLM paths. Small talk
+# gets a canned reply and failure-code lookups are answered from the code table;
+# only open-ended questions go on to the retrieval chain or the pandas agent.
+# Matching is on whole words, so "which" or "this" is not taken for "hi".
+
+failure_dict = {
+    'FTS': 'Failure to start on demand',
+    'STP': 'Failure to stop on demand',
+    'UST': 'Spurious stop',
+    'BRD': 'Breakdown',
+    'HIO': 'High output',
+    'LOO': 'Low output',
+    'ERO': 'Erratic output',
+    'ELF': 'External leakage fuel',
+    'ELP': 'External leakage process medium',
+    'ELU': 'External leakage utility medium',
+    'INL': 'Internal leakage',
+    'VIB': 'Vibration',
+    'NOI': 'Noise',
+    'OHE': 'Overheating',
+    'PLU': 'Plugged/choked',
+    'PDE': 'Parameter deviation',
+    'AIR': 'Abnormal instrument reading',
+    'STD': 'Structural deficiency',
+    'SER': 'Minor in-service problems',
+    'OTH': 'Other',
+    'UNK': 'Unknown'
+}
+
+# Canned replies, first matching phrase wins
+generic_responses = {
+    "hi": "Hello! How can I assist you today?",
+    "hey": "Hello! How can I assist you today?",
+    "good morning": "Hello! How can I assist you today?",
+    "good afternoon": "Hello! How can I assist you today?",
+    "good evening": "Hello! How can I assist you today?",
+    "hello": "Hi there! What can I help you with?",
+    "thankyou": "You're very welcome! Let me know if you need anything else.",
+    "thank you": "You're very welcome! Let me know if you need anything else.",
+    "thanks": "You're very welcome! Let me know if you need anything else.",
+    "cheers": "You're very welcome! Let me know if you need anything else.",
+    "bye": "Goodbye! Have a great day!",
+    "goodbye": "Goodbye! Have a great day!",
+    "see you": "Goodbye! Have a great day!",
+}
+
+# Words that may pad out small talk ("thanks a lot", "hi there") without
+# turning it into a question
+small_talk_filler = {
+    "a", "again", "all", "and", "bot", "chatbot", "cool", "great", "help", "lot", "much", "nice", "now",
+    "ok", "okay", "so", "soon", "that", "the", "there", "very", "you", "your", "for", "later",
+}
+
+# Words that may surround codes in a plain lookup ("what does ELP mean?")
+lookup_words = {
+    "a", "abbreviation", "an", "and", "code", "codes", "define", "definition", "describe", "description",
+    "do", "does", "explain", "failure", "for", "is", "are", "me", "mean", "meaning", "means", "mode",
+    "modes", "of", "please", "stand", "stands", "tell", "the", "what", "whats",
+}
+
+_phrase_pattern = re.compile(
+    r"\b(?:" + "|".join(re.escape(phrase).replace(r"\ ", r"\s+") for phrase in sorted(generic_responses, key=len, reverse=True)) + r")\b"
+)
+_word_pattern = re.compile(r"[a-z0-9]+")
+_code_pattern = re.compile(r"\b[A-Z]{3}\b")
+
+
+# Function to return the canned reply for a message that is only small talk, else None
+def small_talk_reply(question):
+    text = question.lower()
+    phrases = list(_phrase_pattern.finditer(text))
+    if not phrases:
+        return None
+    rest = _phrase_pattern.sub(" ", text)
+    if any(word not in small_talk_filler for word in _word_pattern.findall(rest)):
+        return None
+    return generic_responses[re.sub(r"\s+", " ", phrases[0].group())]
+
+
+# Function to answer a question that only asks what some failure codes mean, else None
+def code_lookup_reply(question, codes=failure_dict):
+    found = [code for code in dict.fromkeys(_code_pattern.findall(question)) if code in codes]
+    if not found:
+        return None
+    rest = _code_pattern.sub(" ", question).lower()
+    if any(word not in lookup_words for word in _word_pattern.findall(rest)):
+        return None
+    lines = [
+        "| Failure Code | Description |",
+        "|--------------|-------------|",
+    ]
+    lines.extend(f"| {code} | {codes[code]} |" for code in found)
+    return "\n".join(lines)
+
+
+# Function to route a question: returns ("small_talk" | "code_lookup" | "open", reply).
+# The route is counted on the current trace, so the metrics show how many
+# questions never reached an LLM.
+def route_question(question, codes=failure_dict):
+    reply = small_talk_reply(question)
+    route = "small_talk"
+    if reply is None and codes is not None:
+        reply = code_lookup_reply(question, codes)
+        route = "code_lookup"
+    if reply is None:
+        route = "open"
+    count(f"route_{route}")
+    return route, reply
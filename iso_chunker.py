@@ -0,0 +1,454 @@
+import itertools
+import re
+import zlib
+from collections import Counter
+
+import numpy as np
+from langchain.text_splitter import TextSplitter
+from langchain_core.documents import Document
+
+from tracing import count, span
+
+# Bump when the chunking changes, so documents are keyed (and embedded) anew
+chunker_format = 2
+default_chunk_size = 2500
+default_chunk_overlap = 200
+# Tables stay whole up to this size; longer ones are cut between rows
+default_table_max_size = 6000
+# Estimated Jaccard similarity above which a chunk counts as a repeat
+default_duplicate_threshold = 0.9
+minhash_permutations = 64
+lsh_bands = 16
+shingle_words = 5
+# Repeated header/footer detection: a line found this close to the top or
+# bottom of at least this share of the pages (and of 3 pages) is boilerplate.
+# The first pages are read ahead so their headers are recognised too.
+edge_lines = 8
+boilerplate_page_share = 0.5
+lookahead_pages = 8
+max_heading_length = 90
+# A table ends at running text: this many prose lines in a row, or one at the
+# top of a page. Table cells are short; prose lines run most of the page width.
+prose_line_length = 60
+prose_line_words = 8
+prose_run_lines = 2
+
+# Structure-aware chunking for ISO standards. Chunks follow the clause
+# numbering (9.6, A.2.3.1, term entries 3.75), annexes and table captions; a
+# table is kept together as one chunk. Page banners, copyright and licence
+# footers are stripped, and near-duplicate chunks are dropped before they are
+# embedded. Every chunk carries the clause ids it covers.
+
+_boilerplate_patterns = [
+    re.compile(r"^ISO(?:/[A-Z]+)* \d+(?:-\d+)*:\d{4}(?:\([A-Z]\))?$"),
+    re.compile(r"^© ISO \d{4}"),
+    re.compile(r"All rights reserved$"),
+    re.compile(r"^[-`,]{10,}$"),
+    re.compile(r"^(?:Table|Figure) [A-Z]?\.?\d+(?:\.\d+)* \(continued\)$"),
+    # Table of contents entries ("Scope.......1"); the clauses themselves follow
+    re.compile(r"\.{6,} ?[ivxlc\d]*$"),
+]
+# The ISO banner and copyright lines, which every ISO standard prints
+_iso_patterns = _boilerplate_patterns[:2]
+_page_number_pattern = re.compile(r"^(?:\d{1,4}|[ivxlc]{1,6})$")
+_annex_pattern = re.compile(r"^Annex ([A-Z])$")
+_caption_pattern = re.compile(r"^Table ([A-Z]?\.?\d+(?:\.\d+)*) [—–-] \S")
+_heading_pattern = re.compile(r"^(\d{1,2}(?:\.\d{1,3})*|[A-Z](?:\.\d{1,3})+)(?:[\t ]+(.*))?$")
+_named_sections = {"Foreword", "Introduction", "Bibliography"}
+_space_pattern = re.compile(r"[^\S\t]+")
+_control_pattern = re.compile(r"[\x00-\x08\x0b-\x1f\x7f]")
+_prime = np.uint64(2 ** 31 - 1)
+
+
+# Line with the BOM and odd spaces (no-break, en, thin) normalised; tabs are
+# kept since ISO headings put one after the clause number
+def _normalize(line):
+    line = _control_pattern.sub("", line.replace("\ufeff", ""))
+    return _space_pattern.sub(" ", line).strip()
+
+
+def _collapse(line):
+    return " ".join(line.split())
+
+
+def _is_prose(text):
+    return len(text) >= prose_line_length and len(text.split()) >= prose_line_words
+
+
+# Function to tell whether a PDF is an ISO standard, from the banner or
+# copyright line on its first pages. Other PDFs are split the plain way.
+def is_iso_standard(pdf_bytes, pages=lookahead_pages):
+    import fitz
+
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        for page in itertools.islice(doc, pages):
+            for line in page.get_text().splitlines():
+                text = _collapse(_normalize(line))
+                if any(pattern.search(text) for pattern in _iso_patterns):
+                    return True
+        return False
+    finally:
+        doc.close()
+
+
+def _part_value(part):
+    # Annex letters sort after every numbered clause
+    return int(part) if part.isdigit() else 1000 + ord(part)
+
+
+# Function to tell whether a clause number can follow the current one: a first
+# child (9.6 -> 9.6.1), or the next number at some level (9.6 -> 9.7 or 10).
+# One missed heading is tolerated. This keeps numbers in tables and running
+# text ("50 Hz", "26 Feb 2016") from being taken for headings.
+def is_next_clause(current, parts):
+    values = [_part_value(part) for part in parts]
+    if current is None:
+        return all(value == 1 for value in values)
+    current_values = [_part_value(part) for part in current]
+    depth = len(current_values)
+    if len(values) > depth and values[:depth] == current_values and all(value == 1 for value in values[depth:]):
+        return True
+    for level in range(min(depth, len(values))):
+        if (values[:level] == current_values[:level] and values[level] - current_values[level] in (1, 2)
+                and all(value == 1 for value in values[level + 1:])):
+            return True
+    return False
+
+
+# MinHash signatures over word shingles, bucketed by LSH bands, so each chunk
+# is only compared against chunks that share a band with it
+class NearDuplicateFilter:
+    def __init__(self, threshold=default_duplicate_threshold, permutations=minhash_permutations, bands=lsh_bands):
+        rng = np.random.default_rng(1)
+        self._a = rng.integers(1, int(_prime), permutations, dtype=np.uint64)
+        self._b = rng.integers(0, int(_prime), permutations, dtype=np.uint64)
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = permutations // bands
+        self._buckets = {}
+
+    def signature(self, text):
+        words = re.findall(r"\w+", text.lower())
+        shingles = {" ".join(words[i:i + shingle_words]) for i in range(max(1, len(words) - shingle_words + 1))}
+        # crc32 rather than hash(): signatures must not change between processes
+        hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+        return ((self._a[:, None] * hashes[None, :] + self._b[:, None]) % _prime).min(axis=1)
+
+    # Function to check a chunk against the ones seen so far, remembering it if it is new
+    def is_duplicate(self, text):
+        signature = self.signature(text)
+        keys = [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+        for key in keys:
+            for other in self._buckets.get(key, ()):
+                if np.mean(other == signature) >= self.threshold:
+                    return True
+        for key in keys:
+            self._buckets.setdefault(key, []).append(signature)
+        return False
+
+
+class _Section:
+    def __init__(self, kind, ids, heading, metadata):
+        self.kind = kind
+        self.ids = list(ids)
+        self.heading = heading
+        self.metadata = metadata
+        self.lines = []
+        self.size = 0
+        self.continued = False
+
+    def append(self, text, page):
+        self.lines.append((text, page))
+        self.size += len(text) + 1
+
+    def extend(self, other):
+        for text, page in other.lines:
+            self.append(text, page)
+        self.ids.extend(clause_id for clause_id in other.ids if clause_id not in self.ids)
+
+
+def _top_level(section):
+    clause_ids = [clause_id for clause_id in section.ids if not clause_id.startswith("Table ")]
+    return clause_ids[0].split(".")[0] if clause_ids else None
+
+
+# Function to pack (text, page) lines into pieces of at most `limit` characters,
+# repeating up to `overlap` characters of lines at the start of the next piece
+def _pack(lines, limit, overlap):
+    pieces, current, size = [], [], 0
+    for text, page in lines:
+        for start in range(0, max(len(text), 1), limit):
+            segment = text[start:start + limit]
+            if current and size + len(segment) + 1 > limit:
+                pieces.append(current)
+                tail, tail_size = [], 0
+                for previous in reversed(current):
+                    if tail_size + len(previous[0]) + 1 > overlap:
+                        break
+                    tail.insert(0, previous)
+                    tail_size += len(previous[0]) + 1
+                current, size = tail, tail_size
+            current.append((segment, page))
+            size += len(segment) + 1
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+# Chunking state of one document
+class _DocumentChunker:
+    def __init__(self, splitter):
+        self.splitter = splitter
+        self.edge_counts = Counter()
+        self.pages_learned = 0
+        self.clause = None
+        self.section = None
+        self.pending = None
+        # Prose lines seen inside a table, until it is clear whether the table has ended
+        self.held = []
+        self.duplicates = NearDuplicateFilter(splitter.duplicate_threshold)
+        self.chunks = []
+        self.stats = Counter(pages=0, text_chunks=0, tables=0, boilerplate_lines=0, duplicates=0)
+
+    def learn(self, page):
+        lines = [_collapse(_normalize(line)) for line in page.page_content.splitlines()]
+        lines = [line for line in lines if line]
+        edges = set(lines[:edge_lines] + lines[-edge_lines:])
+        # Short lines ("X", "Yes", codes) repeat in tables, not just in headers
+        self.edge_counts.update(line for line in edges if len(line) >= 12 and any(char.isalpha() for char in line))
+        self.pages_learned += 1
+
+    def _is_boilerplate(self, text):
+        if any(pattern.search(text) for pattern in _boilerplate_patterns):
+            return True
+        return self.edge_counts[text] >= max(3, boilerplate_page_share * self.pages_learned)
+
+    def add_page(self, page):
+        lines = [_normalize(line) for line in page.page_content.splitlines()]
+        lines = [line for line in lines if line]
+        texts = [_collapse(line) for line in lines]
+        removed = [self._is_boilerplate(text) for text in texts]
+        kept = []
+        for i, (line, text) in enumerate(zip(lines, texts)):
+            # Page numbers sit next to the footer lines
+            next_to_footer = (i > 0 and removed[i - 1]) or (i + 1 < len(texts) and removed[i + 1])
+            if removed[i] or (next_to_footer and _page_number_pattern.match(text)):
+                self.stats["boilerplate_lines"] += 1
+                continue
+            kept.append(line)
+        for i, line in enumerate(kept):
+            self._add_line(line, kept[i + 1] if i + 1 < len(kept) else None, page, first_on_page=i == 0)
+        self.stats["pages"] += 1
+
+    def _heading_parts(self, line, next_line):
+        match = _heading_pattern.match(line)
+        if match is None:
+            return None
+        number, title = match.group(1), _collapse(match.group(2) or "")
+        if title:
+            if not title[0].isupper() or len(title) > max_heading_length or title.endswith((".", ",", ";", ":")) or "...." in title:
+                return None
+        else:
+            # A bare number opens a term entry (3.75) when a lowercase term follows
+            if "." not in number or next_line is None or (self.section is not None and self.section.kind == "table"):
+                return None
+            if not _collapse(next_line)[:1].islower():
+                return None
+        parts = number.split(".")
+        return parts if is_next_clause(self.clause, parts) else None
+
+    def _add_line(self, line, next_line, page, first_on_page=False):
+        text = _collapse(line)
+        page_number = page.metadata.get("page")
+
+        annex = _annex_pattern.match(text)
+        if annex is not None:
+            self.clause = [annex.group(1)]
+            self._start_section("text", [annex.group(1)], text, page)
+            return
+        caption = _caption_pattern.match(text)
+        if caption is not None:
+            ids = [f"Table {caption.group(1)}"] + ([".".join(self.clause)] if self.clause else [])
+            self._start_section("table", ids, text, page)
+            return
+        parts = self._heading_parts(line, next_line)
+        if parts is not None:
+            self.clause = parts
+            self._start_section("text", [".".join(parts)], text, page)
+            return
+        if text in _named_sections:
+            self._start_section("text", [text], text, page)
+            return
+
+        if self.section is not None and self.section.kind == "table":
+            if _is_prose(text):
+                self.held.append((text, page_number))
+                if not first_on_page and len(self.held) < prose_run_lines:
+                    return
+                # Running text: the table is over, the held lines open a text section
+                held, self.held = self.held, []
+                self._start_section("text", [".".join(self.clause)] if self.clause else [], None, page)
+                for held_text, held_page in held:
+                    self.section.append(held_text, held_page)
+                self._drain(final=False)
+                return
+            self._release_held()
+
+        if self.section is None:
+            self._start_section("text", [], None, page)
+        self.section.append(text, page_number)
+        self._drain(final=False)
+
+    # Held lines turned out to be table rows (or a note closing the table)
+    def _release_held(self):
+        for text, page_number in self.held:
+            self.section.append(text, page_number)
+        self.held = []
+
+    def _start_section(self, kind, ids, heading, page):
+        self._close_section()
+        self.section = _Section(kind, ids, heading, dict(page.metadata))
+        if heading is not None:
+            self.section.append(heading, page.metadata.get("page"))
+
+    def _limit(self, section):
+        return self.splitter.table_max_size if section.kind == "table" else self.splitter._chunk_size
+
+    # Function to cut a section into chunks. While the section is still growing
+    # only full pieces are emitted, and the last one stays open.
+    def _drain(self, final):
+        section = self.section
+        limit = self._limit(section)
+        if not final and section.size <= 2 * limit:
+            return
+        if final and not section.continued and section.size <= self.splitter._chunk_size:
+            self._merge(section)
+            return
+        self._absorb_pending(section)
+        prefix = len(section.heading) + 1 if section.heading else 0
+        overlap = self.splitter._chunk_overlap if section.kind == "text" else 0
+        pieces = _pack(section.lines, limit - prefix, overlap)
+        if not final:
+            section.lines = pieces.pop()
+            section.size = sum(len(text) + 1 for text, _ in section.lines)
+        for piece in pieces:
+            # Later pieces repeat the heading, so each chunk still says what it belongs to
+            first_piece = not section.continued and piece is pieces[0]
+            self._emit(section, piece, None if first_piece else section.heading)
+            section.continued = True
+
+    def _close_section(self):
+        if self.section is not None:
+            self._release_held()
+        if self.section is not None and self.section.lines:
+            self._drain(final=True)
+        self.section = None
+
+    # Small sections, small tables included, are joined with their neighbours
+    # under the same top-level clause
+    def _merge(self, section):
+        pending = self.pending
+        if pending is not None and _top_level(pending) == _top_level(section) and pending.size + section.size <= self.splitter._chunk_size:
+            if pending.kind != section.kind:
+                pending.kind = "mixed"
+            pending.extend(section)
+            return
+        self._flush_pending()
+        self.pending = section
+
+    # A short section waiting to be merged (often a bare heading like "7 Quality
+    # of data") goes at the start of the long section that follows it
+    def _absorb_pending(self, section):
+        pending = self.pending
+        if pending is None or section.continued or _top_level(pending) != _top_level(section) or pending.size > self.splitter._chunk_size // 4:
+            self._flush_pending()
+            return
+        section.lines = pending.lines + section.lines
+        section.size += pending.size
+        section.ids = pending.ids + [clause_id for clause_id in section.ids if clause_id not in pending.ids]
+        section.metadata = pending.metadata
+        self.pending = None
+
+    def _flush_pending(self):
+        if self.pending is not None:
+            self._emit(self.pending, self.pending.lines, None)
+            self.pending = None
+
+    def _emit(self, section, lines, prefix):
+        text = "\n".join(line for line, _ in lines)
+        if prefix:
+            text = prefix + "\n" + text
+        if not text.strip():
+            return
+        if self.duplicates.is_duplicate(text):
+            self.stats["duplicates"] += 1
+            count("chunk_duplicate_skipped")
+            return
+        metadata = dict(section.metadata)
+        metadata.update(
+            page=lines[0][1],
+            end_page=lines[-1][1],
+            clause=section.ids[0] if section.ids else None,
+            clause_ids=list(section.ids),
+            chunk_type=section.kind,
+        )
+        self.chunks.append(Document(page_content=text, metadata=metadata))
+        self.stats["tables" if section.kind == "table" else "text_chunks"] += 1
+
+    def finish(self):
+        self._close_section()
+        self._flush_pending()
+
+    def take(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+
+class ISOTextSplitter(TextSplitter):
+    def __init__(self, chunk_size=default_chunk_size, chunk_overlap=default_chunk_overlap,
+                 table_max_size=default_table_max_size, duplicate_threshold=default_duplicate_threshold, **kwargs):
+        super().__init__(chunk_size=chunk_size, chunk_overlap=chunk_overlap, **kwargs)
+        self.table_max_size = table_max_size
+        self.duplicate_threshold = duplicate_threshold
+        self.last_stats = None
+
+    # Options besides chunk size and overlap that change the chunks (see splitter_settings)
+    def settings(self):
+        return {"table_max_size": self.table_max_size, "duplicate_threshold": self.duplicate_threshold, "format": chunker_format}
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            chunk_size=settings["chunk_size"],
+            chunk_overlap=settings["chunk_overlap"],
+            table_max_size=settings.get("table_max_size", default_table_max_size),
+            duplicate_threshold=settings.get("duplicate_threshold", default_duplicate_threshold),
+        )
+
+    def split_text(self, text):
+        return [chunk.page_content for chunk in self.iter_split([Document(page_content=text, metadata={})])]
+
+    def split_documents(self, documents):
+        return list(self.iter_split(documents))
+
+    # Generator over the chunks of a stream of page Documents. Clauses and
+    # tables run across pages, so chunks come out as their sections close.
+    def iter_split(self, pages):
+        chunker = _DocumentChunker(self)
+        pages = iter(pages)
+        ahead = list(itertools.islice(pages, lookahead_pages))
+        for page in ahead:
+            chunker.learn(page)
+        for number, page in enumerate(itertools.chain(ahead, pages)):
+            if number >= len(ahead):
+                chunker.learn(page)
+            with span("split"):
+                chunker.add_page(page)
+            yield from chunker.take()
+        # The document's totals go on the last split span of the trace
+        with span("split") as attributes:
+            chunker.finish()
+            attributes.update(chunker.stats)
+        yield from chunker.take()
+        self.last_stats = dict(chunker.stats)
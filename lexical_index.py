@@ -0,0 +1,190 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+
+import faiss
+import numpy as np
+from langchain_core.retrievers import BaseRetriever
+
+from tracing import count, span
+
+lexical_index_name = "lexical_index.json"
+lexical_format = 1
+bm25_k1 = 1.5
+bm25_b = 0.75
+# Reciprocal-rank fusion constant and how many hits each side contributes
+rrf_k = 60
+fetch_k = 10
+# Share of the query's content words that must be codes or identifiers
+# before FAISS (and the query embedding) is skipped
+identifier_share = 0.5
+
+stopwords = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "code", "codes", "describe", "do", "does", "explain",
+    "for", "from", "give", "how", "in", "is", "it", "me", "mean", "means", "meaning", "of", "on", "or", "say",
+    "says", "show", "tell", "that", "the", "this", "to", "what", "whats", "which", "with", "about",
+}
+
+# Failure and activity codes (ELP, FTS), numbered clauses and tables (9.6,
+# B.15, "clause 9.6", "Table B.15")
+_reference_pattern = re.compile(
+    r"\b(?:clause|table|annex|figure|section)\s+[a-z]?\.?\d+(?:\.\d+)*\b|\b[a-z]?\d+(?:\.\d+)+\b|\b[a-z]\.\d+\b",
+    re.IGNORECASE,
+)
+_code_pattern = re.compile(r"\b[A-Z]{2,4}\b")
+_token_pattern = re.compile(r"[a-z0-9]+(?:\.[a-z0-9]+)*")
+
+
+def tokenize(text):
+    return _token_pattern.findall(text.lower())
+
+
+def content_tokens(text):
+    return [token for token in tokenize(text) if token not in stopwords]
+
+
+def identifier_tokens(text):
+    identifiers = []
+    for match in _reference_pattern.finditer(text):
+        identifiers.extend(tokenize(match.group()))
+    identifiers.extend(match.group().lower() for match in _code_pattern.finditer(text))
+    return identifiers
+
+
+# Function to tell whether a question is mostly codes or identifiers, the kind
+# exact lexical matching answers better than embeddings
+def is_identifier_query(question):
+    words = content_tokens(question)
+    if not words:
+        return False
+    identifiers = set(identifier_tokens(question))
+    return sum(1 for word in words if word in identifiers) / len(words) >= identifier_share
+
+
+class LexicalIndex:
+    def __init__(self, doc_ids, postings, doc_lengths, version=None):
+        self.doc_ids = doc_ids
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.version = version
+        self.average_length = sum(doc_lengths) / len(doc_lengths) if doc_lengths else 0.0
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    @classmethod
+    def build(cls, documents, version=None):
+        doc_ids, postings, doc_lengths = [], {}, []
+        for doc_number, (doc_id, text) in enumerate(documents):
+            terms = Counter(tokenize(text))
+            doc_ids.append(doc_id)
+            doc_lengths.append(sum(terms.values()))
+            for term, term_count in terms.items():
+                postings.setdefault(term, []).append([doc_number, term_count])
+        return cls(doc_ids, postings, doc_lengths, version)
+
+    # Function to build the index over every chunk in a FAISS vector store
+    @classmethod
+    def from_vector_store(cls, vector_store, version=None):
+        docstore = vector_store.docstore
+        if hasattr(docstore, "iter_texts"):
+            return cls.build(docstore.iter_texts(), version)
+        documents = []
+        for position in sorted(vector_store.index_to_docstore_id):
+            doc_id = vector_store.index_to_docstore_id[position]
+            documents.append((doc_id, docstore.search(doc_id).page_content))
+        return cls.build(documents, version)
+
+    # BM25 top-k as (docstore id, score), best first
+    def search(self, query, k=fetch_k):
+        scores = {}
+        total = len(self.doc_ids)
+        for term in set(tokenize(query)):
+            term_postings = self.postings.get(term)
+            if not term_postings:
+                continue
+            idf = math.log(1 + (total - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+            for doc_number, term_count in term_postings:
+                norm = bm25_k1 * (1 - bm25_b + bm25_b * self.doc_lengths[doc_number] / self.average_length)
+                scores[doc_number] = scores.get(doc_number, 0.0) + idf * term_count * (bm25_k1 + 1) / (term_count + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.doc_ids[doc_number], score) for doc_number, score in best]
+
+    def save(self, index_save_path):
+        path = os.path.join(index_save_path, lexical_index_name)
+        payload = {
+            "format": lexical_format,
+            "version": self.version,
+            "doc_ids": self.doc_ids,
+            "doc_lengths": self.doc_lengths,
+            "postings": self.postings,
+        }
+        with open(path + ".tmp", "w", encoding="utf-8") as index_file:
+            json.dump(payload, index_file)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, index_save_path):
+        path = os.path.join(index_save_path, lexical_index_name)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as index_file:
+            payload = json.load(index_file)
+        if payload.get("format") != lexical_format:
+            return None
+        return cls(payload["doc_ids"], payload["postings"], payload["doc_lengths"], payload.get("version"))
+
+
+# Function to load the lexical index stored next to a FAISS index, rebuilding
+# it when it is missing or was built for another version of the index
+def load_lexical_index(index_save_path, vector_store, version=None):
+    lexical_index = LexicalIndex.load(index_save_path)
+    if lexical_index is not None and lexical_index.version == version and len(lexical_index) == vector_store.index.ntotal:
+        return lexical_index
+    lexical_index = LexicalIndex.from_vector_store(vector_store, version)
+    lexical_index.save(index_save_path)
+    print(f"Lexical index built for {index_save_path} ({len(lexical_index)} chunks)")
+    return lexical_index
+
+
+def reciprocal_rank_fusion(rankings, k=rrf_k):
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+# Retriever over FAISS and the lexical index. Identifier questions are answered
+# from the lexical index alone; the rest fuse both rankings.
+class HybridRetriever(BaseRetriever):
+    vector_store: object
+    lexical_index: object
+    k: int = 1
+    fetch_k: int = fetch_k
+    rrf_k: int = rrf_k
+
+    def _documents(self, doc_ids):
+        docstore = self.vector_store.docstore
+        if hasattr(docstore, "mget"):
+            return docstore.mget(doc_ids)
+        return [docstore.search(doc_id) for doc_id in doc_ids]
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        with span("lexical_search"):
+            lexical_ids = [doc_id for doc_id, _ in self.lexical_index.search(query, self.fetch_k)]
+        if lexical_ids and is_identifier_query(query):
+            count("lexical_only_retrieval")
+            return self._documents(lexical_ids[:self.k])
+
+        # Searched on the raw index, as chunks in older stores do not carry their ids
+        vector = np.asarray([self.vector_store._embed_query(query)], dtype=np.float32)
+        with span("vector_search"):
+            if self.vector_store._normalize_L2:
+                faiss.normalize_L2(vector)
+            _, positions = self.vector_store.index.search(vector, self.fetch_k)
+        vector_ids = [self.vector_store.index_to_docstore_id[position] for position in positions[0] if position != -1]
+        count("hybrid_retrieval")
+        return self._documents(reciprocal_rank_fusion([vector_ids, lexical_ids], self.rrf_k)[:self.k])
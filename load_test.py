@@ -0,0 +1,150 @@
+import argparse
+import json
+import sys
+import threading
+import time
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+from document_qa import answer_question, build_retrieval_chain
+from fake_openai import start_server
+from intent_router import failure_dict
+from openai_pool import http_client, pool_stats, set_rate_limit
+
+chat_model = "gpt-4o"
+embedding_model = "text-embedding-ada-002"
+
+# Load test of the OpenAI client layer. N sessions start at once against the
+# local fake server, like engineers asking the same few questions after a
+# briefing, and the report shows what reached the server: requests, new
+# connections, 429s and the latency each session saw. --baseline runs the same
+# load the way the app used to, with new clients and no coalescing per turn.
+
+questions = [
+    "Which failure modes describe leakage?",
+    "What is the difference between high output and low output?",
+    "Which failure mode covers abnormal instrument readings?",
+    "What counts as a structural deficiency?",
+    "Which failure modes relate to starting and stopping on demand?",
+]
+
+
+def build_index(base_url):
+    embeddings = OpenAIEmbeddings(
+        model=embedding_model, api_key="offline", base_url=base_url, check_embedding_ctx_length=False, http_client=http_client()
+    )
+    texts = [f"{code}: {description}. Failure mode {code} is recorded when the equipment shows {description.lower()}."
+             for code, description in failure_dict.items()]
+    return FAISS.from_texts(texts, embeddings, metadatas=[{"source": "failure_dict", "page": 0} for _ in texts])
+
+
+def new_clients(base_url, pooled):
+    extra = {"http_client": http_client()} if pooled else {}
+    embeddings = OpenAIEmbeddings(model=embedding_model, api_key="offline", base_url=base_url, check_embedding_ctx_length=False, **extra)
+    llm = ChatOpenAI(model=chat_model, temperature=0.2, api_key="offline", base_url=base_url, **extra)
+    return embeddings, llm
+
+
+# Function to run one session: `turns` questions, one after another
+def run_session(number, turns, distinct, vector_store, base_url, baseline, barrier, latencies, errors):
+    if not baseline:
+        embeddings, llm = new_clients(base_url, pooled=True)
+        store = FAISS(embeddings, vector_store.index, vector_store.docstore, vector_store.index_to_docstore_id)
+        chain = build_retrieval_chain(store, llm)
+    barrier.wait()
+    for turn in range(turns):
+        question = questions[(number + turn) % distinct]
+        start = time.perf_counter()
+        try:
+            if baseline:
+                # Every turn used to build its own clients and call upstream itself
+                embeddings, llm = new_clients(base_url, pooled=False)
+                store = FAISS(embeddings, vector_store.index, vector_store.docstore, vector_store.index_to_docstore_id)
+                build_retrieval_chain(store, llm).invoke({"input": question})
+            else:
+                answer_question(question, chain, embeddings, index_version=1)
+            latencies.append(time.perf_counter() - start)
+        except Exception as error:
+            errors.append(f"{type(error).__name__}: {error}")
+
+
+def run_load_test(sessions, turns, distinct, latency, server_rpm=0, baseline=False):
+    server, base_url = start_server(latency=latency, rpm=server_rpm)
+    try:
+        vector_store = build_index(base_url)
+        before = server.stats.as_dict()
+        pool_before = pool_stats()
+        barrier = threading.Barrier(sessions)
+        latencies, errors = [], []
+        threads = [
+            threading.Thread(target=run_session, args=(n, turns, distinct, vector_store, base_url, baseline, barrier, latencies, errors))
+            for n in range(sessions)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_s = time.perf_counter() - start
+        after = server.stats.as_dict()
+    finally:
+        server.shutdown()
+
+    upstream = {key: after.get(key, 0) - before.get(key, 0) for key in after}
+    pool_after = pool_stats()
+    return {
+        "mode": "baseline" if baseline else "pooled",
+        "sessions": sessions,
+        "turns": turns,
+        "distinct_questions": distinct,
+        "server_latency_s": latency,
+        "server_rpm": server_rpm,
+        "wall_s": round(wall_s, 3),
+        "answered": len(latencies),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "p50_s": round(float(np.percentile(latencies, 50)), 4) if latencies else None,
+        "p95_s": round(float(np.percentile(latencies, 95)), 4) if latencies else None,
+        "max_s": round(max(latencies), 4) if latencies else None,
+        "upstream_requests": {key: value for key, value in upstream.items() if key.startswith("/")},
+        "connections": upstream.get("connections", 0),
+        "rate_limited": upstream.get("rate_limited", 0),
+        "coalesced": {key: pool_after[key] - pool_before[key] for key in pool_after},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate concurrent chat sessions against the fake OpenAI server")
+    parser.add_argument("--sessions", type=int, default=30)
+    parser.add_argument("--turns", type=int, default=2, help="questions per session")
+    parser.add_argument("--questions", type=int, default=3, help="distinct questions shared by the sessions")
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds the fake server waits per request")
+    parser.add_argument("--server-rpm", type=int, default=0, help="fake server answers 429 above this many requests per minute")
+    parser.add_argument("--rpm", type=int, default=None, help="client-side requests per minute for each model")
+    parser.add_argument("--tpm", type=int, default=None, help="client-side tokens per minute for each model")
+    parser.add_argument("--baseline", action="store_true", help="also run the load with new clients per turn and no coalescing")
+    parser.add_argument("--output", default=None, help="also write the report to this JSON file")
+    args = parser.parse_args(argv)
+
+    if args.rpm or args.tpm:
+        for model in (chat_model, embedding_model):
+            set_rate_limit(model, args.rpm or 10_000, args.tpm or 10_000_000)
+
+    distinct = max(1, min(args.questions, len(questions)))
+    runs = [False, True] if args.baseline else [False]
+    report = [run_load_test(args.sessions, args.turns, distinct, args.latency, args.server_rpm, baseline) for baseline in runs]
+    for entry in report:
+        print(f"{entry['mode']}: {entry['answered']}/{entry['sessions'] * entry['turns']} answered in {entry['wall_s']} s "
+              f"(p50 {entry['p50_s']} s, p95 {entry['p95_s']} s), {entry['errors']} errors")
+        print(f"    upstream {entry['upstream_requests']}, {entry['connections']} connections, "
+              f"{entry['rate_limited']} rate limited, coalesced {entry['coalesced']}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, indent=2)
+    return 0 if all(entry["errors"] == 0 for entry in report) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,15 @@
 import streamlit as st
 import base64
+import functools
  
+
+# Function to read and encode an image once per process, not on every rerun
+@functools.lru_cache(maxsize=None)
+def encode_image(image_path):
+    with open(image_path, "rb") as image_file:
+        return base64.b64encode(image_file.read()).decode()
+
+
 def add_logo():
     # Path to your logo image
     image_path = "oman_lng.png"  # Ensure this path is correct
@@ -8,8 +17,7 @@ def add_logo():
     catalytics_url = "https://www.linkedin.com/company/catalytics-datum/posts/?feedView=all"  # Replace with the desired URL for Catalytics Datum
  
     # Load the image and convert to base64
-    with open(image_path, "rb") as image_file:
-        encoded_image = base64.b64encode(image_file.read()).decode()
+    encoded_image = encode_image(image_path)
  
     with st.sidebar:
         # Leave space for other sidebar content above the logo
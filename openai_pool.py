@@ -0,0 +1,215 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import httpx
+
+from tracing import count, span
+
+# Process-wide layer under every OpenAI client of the app. All chat and
+# embedding clients share one pooled HTTP client, so connections are reused
+# across sessions, models and API keys. Requests pass a token bucket per model
+# (requests and tokens per minute) before going out, and identical requests
+# already in flight wait on the one upstream call instead of making their own.
+
+max_connections = 50
+max_keepalive_connections = 20
+
+# Requests and tokens per minute, per model. Models not listed are not limited.
+# ISO_RATE_LIMITS overrides or adds models for another usage tier, as JSON:
+# '{"gpt-4": {"rpm": 10000, "tpm": 300000}}'
+rate_limits = {
+    "gpt-4": {"rpm": 500, "tpm": 10_000},
+    "gpt-4o": {"rpm": 500, "tpm": 30_000},
+    "text-embedding-ada-002": {"rpm": 3_000, "tpm": 1_000_000},
+}
+rate_limits.update(json.loads(os.environ.get("ISO_RATE_LIMITS", "{}")))
+
+
+class TokenBucket:
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Function to take `amount` from the bucket, returning how long the caller
+    # must wait for it. The balance may go negative, so waiters queue in order.
+    def reserve(self, amount):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= min(amount, self.capacity)
+            return max(0.0, -self.tokens / self.rate)
+
+
+class ModelLimiter:
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+
+    def acquire(self, tokens):
+        wait = max(self.requests.reserve(1), self.tokens.reserve(tokens))
+        if wait:
+            count("rate_limit_wait")
+            with span("rate_limit_wait", seconds=round(wait, 3)):
+                time.sleep(wait)
+        return wait
+
+
+# Marks a call whose leader was interrupted rather than finished
+_interrupted = object()
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.shared = 0
+
+    # Function to run fn() once per key at a time: callers arriving while it
+    # runs wait for the same result (or exception). Returns (result, shared).
+    def do(self, key, fn):
+        while True:
+            with self._lock:
+                future = self._calls.get(key)
+                leader = future is None
+                if leader:
+                    future = self._calls[key] = Future()
+            if leader:
+                break
+            result = future.result()
+            if result is not _interrupted:
+                with self._lock:
+                    self.shared += 1
+                count("coalesced")
+                return result, True
+
+        try:
+            result = fn()
+        except Exception as error:
+            self._finish(key, future, error=error)
+            raise
+        except BaseException:
+            # Streamlit stops or reruns a script by raising in its thread. That
+            # is no answer for other sessions: their callers run fn themselves.
+            self._finish(key, future, result=_interrupted)
+            raise
+        self._finish(key, future, result=result)
+        return result, False
+
+    def _finish(self, key, future, result=None, error=None):
+        with self._lock:
+            del self._calls[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+
+# Whole answers (agent runs, retrieval turns) shared between sessions
+in_flight = SingleFlight()
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter_for(model):
+    with _limiters_lock:
+        if model not in _limiters and model in rate_limits:
+            _limiters[model] = ModelLimiter(rate_limits[model]["rpm"], rate_limits[model]["tpm"])
+        return _limiters.get(model)
+
+
+# Function to change the limits of a model, e.g. for a higher usage tier
+def set_rate_limit(model, rpm, tpm):
+    with _limiters_lock:
+        rate_limits[model] = {"rpm": rpm, "tpm": tpm}
+        _limiters.pop(model, None)
+
+
+# Rough token count of a request, the way the API counts it against the
+# limit: the prompt plus the completion it may produce
+def estimate_tokens(payload):
+    if "messages" in payload:
+        prompt = "".join(str(message.get("content", "")) for message in payload["messages"])
+        completion = payload.get("max_tokens") or payload.get("max_completion_tokens") or 0
+        return len(prompt) // 4 + completion
+    inputs = payload.get("input", "")
+    if isinstance(inputs, list) and inputs and isinstance(inputs[0], list):
+        return sum(len(tokens) for tokens in inputs)
+    if isinstance(inputs, list) and inputs and isinstance(inputs[0], int):
+        return len(inputs)
+    return len(json.dumps(inputs)) // 4
+
+
+class PooledTransport(httpx.BaseTransport):
+    def __init__(self, limits):
+        self._transport = httpx.HTTPTransport(limits=limits)
+        self.requests = SingleFlight()
+
+    def handle_request(self, request):
+        body = request.read()
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError:
+            payload = {}
+        if not isinstance(payload, dict):
+            payload = {}
+
+        # Streams go straight out; they cannot be replayed to a second caller
+        if request.method != "POST" or payload.get("stream"):
+            self._acquire(payload)
+            return self._transport.handle_request(request)
+
+        auth = hashlib.sha256(request.headers.get("authorization", "").encode("utf-8")).hexdigest()
+        key = (str(request.url), auth, body)
+        (status, headers, content), _ = self.requests.do(key, lambda: self._send(request, payload))
+        return httpx.Response(status, headers=headers, content=content, request=request)
+
+    def _acquire(self, payload):
+        limiter = limiter_for(payload.get("model"))
+        if limiter is not None:
+            limiter.acquire(estimate_tokens(payload))
+
+    # Function to make the upstream call and read it whole, so waiting callers get a copy
+    def _send(self, request, payload):
+        self._acquire(payload)
+        response = self._transport.handle_request(request)
+        try:
+            content = b"".join(response.iter_raw())
+        finally:
+            response.close()
+        return response.status_code, response.headers.multi_items(), content
+
+    def close(self):
+        self._transport.close()
+
+
+_http_client = None
+_transport = None
+_http_client_lock = threading.Lock()
+
+
+# The shared HTTP client to hand to ChatOpenAI / OpenAIEmbeddings (http_client=...)
+def http_client():
+    global _http_client, _transport
+    with _http_client_lock:
+        if _http_client is None:
+            limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections)
+            _transport = PooledTransport(limits)
+            _http_client = httpx.Client(transport=_transport, timeout=httpx.Timeout(600.0, connect=5.0))
+        return _http_client
+
+
+# Counters of the shared layer, for the load test
+def pool_stats():
+    return {
+        "requests_coalesced": _transport.requests.shared if _transport is not None else 0,
+        "answers_coalesced": in_flight.shared,
+    }
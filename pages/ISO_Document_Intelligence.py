@@ -1,64 +1,96 @@
-from langchain_community.document_loaders import PyMuPDFLoader
-from langchain_openai import ChatOpenAI
-from langchain.embeddings import OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_core.prompts import ChatPromptTemplate
-from langchain.chains import create_retrieval_chain
 import streamlit as st
-import os
 from logo import add_logo
-import openai
+from resources import get_embeddings, get_ingestion_service, get_metrics_server, get_retrieval_chain, index_stamp
+from tracing import TracingCallbackHandler, count, show_trace_panel, trace_turn
 from dotenv import load_dotenv, find_dotenv
 
 # Load .env file if exists
 _ = load_dotenv(find_dotenv())
 
-index_save_path = "faiss_index.bin"
-index_metadata_path = "faiss_index.pkl"
-
-# Function to create and save FAISS index
-def create_and_save_faiss_index(documents, embeddings, index_save_path):
-    vector_store = FAISS.from_documents(documents, embeddings)
-    vector_store.save_local(index_save_path)
-    print(f"FAISS index saved to {index_save_path}")
-    return vector_store
-
-# Function to load the FAISS index from disk
-def load_faiss_index(index_save_path, embeddings):
-    vector_store = FAISS.load_local(index_save_path, embeddings, allow_dangerous_deserialization=True)
-    print(f"FAISS index loaded from {index_save_path}")
-    return vector_store
-
 st.markdown("<p style='font-size:32px; font-weight:bold;'>ISO Chatbot</p>", unsafe_allow_html=True)
 st.write("<p style='font-size:32px; font-weight:bold;'>Document Intelligence</p>", unsafe_allow_html=True)
 
 # API key input
 api_key_input = st.text_input("Enter your OpenAI API key", type="password")
 if api_key_input:
+    import openai
     openai.api_key = api_key_input
 
 pdf_file = st.file_uploader("Upload PDF file", type="pdf")
 add_logo()
+get_metrics_server()
+
+
+# Function to show the stages of an ingestion job, polled every second until it ends
+@st.fragment(run_every=1.0)
+def show_job_progress(job_id, embeddings):
+    job = get_ingestion_service().job(job_id)
+    if job["status"] == "done":
+        st.rerun()
+    if job["status"] == "failed":
+        st.error(f"Indexing {job['source']} failed: {job['error']}")
+        if st.button("Retry", key=f"retry_{job_id}"):
+            get_ingestion_service().retry(job_id, embeddings)
+            st.rerun()
+        return
+
+    resumed = f" (resumed from {job['batches_done']} saved batches)" if job["resumed"] and job["batches_done"] else ""
+    if job["stage"] == "queued":
+        st.info(f"{job['source']} is queued for indexing{resumed}")
+    elif job["stage"] == "embedding":
+        total_pages = job["total_pages"] or 0
+        progress = job["pages_done"] / total_pages if total_pages else 0.0
+        st.progress(progress, text=f"Embedding {job['source']}: {job['pages_done']}/{total_pages} pages ({job['chunks_done']} chunks){resumed}")
+    elif job["stage"] == "indexing":
+        progress = job["chunks_indexed"] / job["chunks_done"] if job["chunks_done"] else 0.0
+        st.progress(progress, text=f"Adding {job['source']} to the index: {job['chunks_indexed']}/{job['chunks_done']} chunks")
+    st.caption("Indexing continues in the background if you leave this page.")
+
 
 if api_key_input and pdf_file:
+    # The ingestion and retrieval stack is only imported once there is a document to work on
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from iso_chunker import ISOTextSplitter, is_iso_standard
+    from index_registry import document_key, embedding_model_name, index_save_path, is_indexed, splitter_settings
+    from answer_cache import answer_cache
+    from document_qa import answer_key, lookup_cached_answer, source_and_page
+    from intent_router import route_question
+    from openai_pool import in_flight
+    from lexical_index import is_identifier_query
+    from streaming import TurnTimer, stream_retrieval_answer
+
     st.success(f"Your {pdf_file.name} is uploaded")
     if "file" not in st.session_state:
         st.session_state.file = pdf_file
 
-    loader = PyMuPDFLoader(pdf_file.name)
-    docs = loader.load()
-
-    text_splitter = RecursiveCharacterTextSplitter()
-    documents = text_splitter.split_documents(docs)
-
-    embeddings = OpenAIEmbeddings(api_key=api_key_input)
-
-    if not os.path.exists(index_save_path):
-        vector_store = create_and_save_faiss_index(documents, embeddings, index_save_path)
-    else:
-        vector_store = load_faiss_index(index_save_path, embeddings)
+    # Chunks embedded before (e.g. clauses shared with an earlier edition) come from disk
+    embeddings = get_embeddings(api_key_input)
+
+    # Documents are stored by content, so a re-upload reuses its vectors.
+    # The key is hashed once per upload, not on every rerun.
+    pdf_bytes = pdf_file.getvalue()
+    new_upload = st.session_state.get("doc_key_file_id") != pdf_file.file_id
+    if new_upload:
+        st.session_state.iso_standard = is_iso_standard(pdf_bytes)
+    # Chunks of an ISO standard follow its clauses and tables, with page furniture
+    # dropped; any other PDF is split page by page the plain way
+    text_splitter = ISOTextSplitter() if st.session_state.iso_standard else RecursiveCharacterTextSplitter()
+    if new_upload:
+        st.session_state.doc_key = document_key(pdf_bytes, splitter_settings(text_splitter), embedding_model_name(embeddings))
+        st.session_state.doc_key_file_id = pdf_file.file_id
+    doc_key = st.session_state.doc_key
+
+    # Indexing runs on the background workers, so leaving the page or losing the
+    # connection does not stop it; the page only polls the job
+    if not is_indexed(doc_key, index_save_path):
+        job = get_ingestion_service().submit(pdf_bytes, pdf_file.name, doc_key, splitter_settings(text_splitter), embeddings)
+        show_job_progress(job["id"], embeddings)
+        st.stop()
+    job = get_ingestion_service().job_for(doc_key)
+    if job is not None and job["trace"] and st.session_state.get("traced_job") != job["id"]:
+        st.session_state.last_trace = job["trace"]
+        st.session_state.traced_job = job["id"]
+    stamp = index_stamp(index_save_path)
 
     input = st.chat_input("Enter Your Queries...")
 
@@ -69,7 +101,8 @@ if api_key_input and pdf_file:
         with st.chat_message(message["role"]):
             if message["role"] == 'assistant':
                 st.write(message["content"][0])
-                st.write(f"<i>Source: {message['content'][1]}, Page No: {message['content'][2]}</i>", unsafe_allow_html=True)
+                if message["content"][1] is not None:
+                    st.write(f"<i>Source: {message['content'][1]}, Page No: {message['content'][2]}</i>", unsafe_allow_html=True)
             else:
                 st.write(message["content"])
 
@@ -78,26 +111,52 @@ if api_key_input and pdf_file:
             st.write(input)
         st.session_state.messages.append({"role": "user", "content": input})
 
-        llm = ChatOpenAI(model='gpt-4o', temperature=0.2, api_key=api_key_input)
-        prompt = ChatPromptTemplate.from_template("""Answer the following question based only on the provided context:
+        timer = TurnTimer("document")
 
-            <context>
-            {context}
-            </context>
-
-            Question: {input}""")
-        
-        retriever = vector_store.as_retriever(search_kwargs={"k": 1})
-
-        document_chain = create_stuff_documents_chain(llm, prompt)
-        retrieval_chain = create_retrieval_chain(retriever, document_chain)
-
-        response = retrieval_chain.invoke({"input": input})
-
-        with st.chat_message("assistant"):
-            st.write(response['answer'])
-            st.write(f"<i>Source: {response['context'][0].metadata['source']}, Page No: {response['context'][0].metadata['page']}</i>", unsafe_allow_html=True)
-
-        st.session_state.messages.append({"role": "assistant", "content": [response['answer'], response['context'][0].metadata['source'], response['context'][0].metadata['page']]})
+        with trace_turn("document") as trace:
+            # Greetings and thanks get a canned reply without touching the index
+            route, reply = route_question(input, codes=None)
+            # Repeated questions are answered from the cache, tied to the current index version.
+            # Code and clause lookups skip the embedding call; the lexical index answers them.
+            version = stamp[0]
+            if route == "small_talk":
+                cached = None
+            else:
+                cached, query_vector = lookup_cached_answer(input, embeddings, version, answer_cache, not is_identifier_query(input))
+
+            with st.chat_message("assistant"):
+                if route == "small_talk":
+                    answer, source, page = reply, None, None
+                    count("llm_avoided")
+                    timer.finish()
+                    st.write(answer)
+                elif cached is not None:
+                    answer, source, page = cached["answer"], cached["source"], cached["page"]
+                    timer.finish()
+                    st.write(answer)
+                else:
+                    # Tokens are rendered as they arrive; the sources come with the first chunk
+                    def stream_answer():
+                        retrieval_chain = get_retrieval_chain(index_save_path, stamp, api_key_input)
+                        result = {}
+                        callbacks = [TracingCallbackHandler(trace)]
+                        answer = st.write_stream(stream_retrieval_answer(retrieval_chain, {"input": input}, timer, result, callbacks))
+                        source, page = source_and_page(result['context'])
+                        answer_cache.put(input, version, answer, source, page, query_vector)
+                        return answer, source, page
+
+                    # A session asking what another is already asking waits for that answer
+                    (answer, source, page), shared = in_flight.do(answer_key(input, version), stream_answer)
+                    if shared:
+                        timer.finish()
+                        st.write(answer)
+                if source is not None:
+                    st.write(f"<i>Source: {source}, Page No: {page}</i>", unsafe_allow_html=True)
+        st.session_state.last_trace = trace.as_dict()
+
+        st.session_state.setdefault("turn_latencies", []).append(timer.as_dict())
+        st.session_state.messages.append({"role": "assistant", "content": [answer, source, page]})
 else:
     st.warning("Please enter your OpenAI API key and upload a PDF document to proceed.")
+
+show_trace_panel(st.session_state.get("last_trace"))
@@ -0,0 +1,157 @@
+import os
+import threading
+
+import streamlit as st
+
+from tracing import start_metrics_server
+
+# Process-wide resources shared by every session of the Streamlit server.
+# Anything read from disk takes a stamp of its files as an argument, so an
+# edited file produces a new cache entry instead of a stale one.
+# Each getter imports what it builds, so a page only pays for langchain,
+# FAISS or pandas once it actually needs them.
+
+
+# Stamp of a file that changes whenever the file is rewritten
+def file_stamp(path):
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+# Stamp of a saved FAISS index and its registry
+def index_stamp(index_save_path="faiss_index.bin"):
+    from index_registry import load_registry
+
+    registry = load_registry(index_save_path)
+    version = registry["version"] if registry else 0
+    return version, file_stamp(os.path.join(index_save_path, "index.faiss"))
+
+
+@st.cache_resource(show_spinner=False)
+def get_embedding_store():
+    from embedding_cache import EmbeddingStore
+
+    return EmbeddingStore()
+
+
+@st.cache_resource(show_spinner=False)
+def get_embeddings(api_key):
+    from langchain_openai import OpenAIEmbeddings
+
+    from embedding_cache import CachedEmbeddings
+    from openai_pool import http_client
+
+    # langchain_openai takes the sync client on its own; the async one keeps its default
+    return CachedEmbeddings(OpenAIEmbeddings(api_key=api_key, http_client=http_client()), get_embedding_store())
+
+
+@st.cache_resource(show_spinner=False)
+def get_llm(model, api_key, temperature=0.2, streaming=False):
+    from langchain_openai import ChatOpenAI
+
+    from openai_pool import http_client
+
+    # stream_usage keeps token counts on streamed responses for the traces.
+    # Every client shares the pooled, rate-limited HTTP client.
+    return ChatOpenAI(
+        model=model, temperature=temperature, api_key=api_key, streaming=streaming, stream_usage=True, http_client=http_client()
+    )
+
+
+# Stamp of the index each path was last loaded at
+_index_stamps = {}
+_index_stamps_lock = threading.Lock()
+
+
+# Function to drop the stores, lexical indexes and chains of an index once it
+# has been saved again, so their mmaps and docstore connections are released
+# instead of living as long as the process
+def _release_stale_index(index_save_path, stamp):
+    with _index_stamps_lock:
+        previous = _index_stamps.get(index_save_path)
+        _index_stamps[index_save_path] = stamp
+    if previous is not None and previous != stamp:
+        get_retrieval_chain.clear()
+        get_lexical_index.clear()
+        get_vector_store.clear()
+
+
+# max_entries bounds what sessions still on an older stamp can load back
+@st.cache_resource(show_spinner="Loading index...", max_entries=8)
+def get_vector_store(index_save_path, stamp, api_key):
+    from index_registry import load_faiss_index
+
+    _release_stale_index(index_save_path, stamp)
+    return load_faiss_index(index_save_path, get_embeddings(api_key), mmap=True)
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def get_lexical_index(index_save_path, stamp, api_key):
+    from lexical_index import load_lexical_index
+
+    return load_lexical_index(index_save_path, get_vector_store(index_save_path, stamp, api_key), stamp[0])
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def get_retrieval_chain(index_save_path, stamp, api_key):
+    from document_qa import build_retrieval_chain
+
+    vector_store = get_vector_store(index_save_path, stamp, api_key)
+    lexical_index = get_lexical_index(index_save_path, stamp, api_key)
+    return build_retrieval_chain(vector_store, get_llm('gpt-4o', api_key), lexical_index)
+
+
+@st.cache_resource(show_spinner=False)
+def get_excel(path, stamp):
+    import pandas as pd
+
+    return pd.read_excel(path)
+
+
+@st.cache_resource(show_spinner=False)
+def get_failure_matrix(path, stamp):
+    from failure_matrix import load_failure_matrix
+
+    return load_failure_matrix(path)
+
+
+@st.cache_resource(show_spinner=False)
+def get_failure_query_engine(path, stamp):
+    from failure_query import FailureQueryEngine
+
+    return FailureQueryEngine(get_failure_matrix(path, stamp))
+
+
+# Whether an uploaded PDF has the ISO 14224 table layout, keyed by its hash
+@st.cache_resource(show_spinner=False)
+def get_has_iso_tables(_pdf_bytes, pdf_digest):
+    from table_extraction import has_iso_tables
+
+    return has_iso_tables(_pdf_bytes)
+
+
+# Tables of an uploaded ISO 14224 PDF, keyed by its hash rather than its bytes
+@st.cache_resource(show_spinner="Extracting tables from the PDF...")
+def get_pdf_tables(_pdf_bytes, pdf_digest):
+    from table_extraction import extract_iso_tables
+
+    return extract_iso_tables(_pdf_bytes)
+
+
+# Background ingestion workers, one pool per Streamlit process. Jobs left over
+# from a previous process resume with OPENAI_API_KEY when it is set, otherwise
+# when their document is uploaded again.
+@st.cache_resource(show_spinner=False)
+def get_ingestion_service():
+    from ingestion_jobs import IngestionService
+
+    api_key = os.environ.get("OPENAI_API_KEY")
+    return IngestionService(default_embeddings=get_embeddings(api_key) if api_key else None)
+
+
+# One Prometheus endpoint per Streamlit process, shared by all sessions
+@st.cache_resource(show_spinner=False)
+def get_metrics_server():
+    return start_metrics_server()
@@ -0,0 +1,219 @@
+import json
+import os
+import pickle
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+docstore_name = "docstore.sqlite"
+legacy_docstore_name = "index.pkl"
+
+# Chunk text and metadata of the document index, one SQLite row per chunk.
+# Rows are read only for the ids a search returns, so opening the store costs
+# the same for one standard or a whole library. The row's position column is
+# the chunk's position in index.faiss.
+
+_schema = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id TEXT PRIMARY KEY,
+    position INTEGER UNIQUE,
+    doc_key TEXT,
+    source TEXT,
+    page INTEGER,
+    page_content TEXT NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chunks_doc_key ON chunks (doc_key);
+CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source);
+"""
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Writes stay in an open transaction until commit(), so readers in other
+        # processes and sessions never see chunks the saved index does not have
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_schema)
+        self._lock = threading.Lock()
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def add(self, texts):
+        rows = [
+            (doc_id, document.metadata.get("doc_key"), document.metadata.get("source"), document.metadata.get("page"),
+             document.page_content, json.dumps(document.metadata, default=str))
+            for doc_id, document in texts.items()
+        ]
+        with self._lock:
+            try:
+                self._conn.executemany(
+                    "INSERT INTO chunks (id, doc_key, source, page, page_content, metadata) VALUES (?, ?, ?, ?, ?, ?)", rows
+                )
+            except sqlite3.IntegrityError as error:
+                raise ValueError(f"Tried to add ids that already exist: {error}") from error
+
+    def delete(self, ids):
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(doc_id,) for doc_id in ids])
+
+    def _document(self, doc_id, page_content, metadata):
+        return Document(id=doc_id, page_content=page_content, metadata=json.loads(metadata))
+
+    def search(self, search):
+        rows = self._query("SELECT id, page_content, metadata FROM chunks WHERE id = ?", (search,))
+        if not rows:
+            return f"ID {search} not found."
+        return self._document(*rows[0])
+
+    # Documents for several ids in one query, in the order asked for
+    def mget(self, ids):
+        ids = list(ids)
+        found = {}
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            for row in self._query(f"SELECT id, page_content, metadata FROM chunks WHERE id IN ({placeholders})", batch):
+                found[row[0]] = self._document(*row)
+        return [found.get(doc_id, f"ID {doc_id} not found.") for doc_id in ids]
+
+    # (id, text) of every indexed chunk in index order, read in pages
+    def iter_texts(self, page_size=10_000):
+        last = -1
+        while True:
+            rows = self._query(
+                "SELECT position, id, page_content FROM chunks WHERE position > ? ORDER BY position LIMIT ?", (last, page_size)
+            )
+            if not rows:
+                return
+            for _, doc_id, text in rows:
+                yield doc_id, text
+            last = rows[-1][0]
+
+    def positions(self, ids):
+        ids = list(ids)
+        positions = []
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            positions.extend(
+                row[0] for row in self._query(f"SELECT position FROM chunks WHERE id IN ({placeholders}) AND position IS NOT NULL", batch)
+            )
+        return sorted(positions)
+
+    # Function to delete chunks and close the gaps they leave in the positions,
+    # the same way faiss compacts an index after remove_ids
+    def remove(self, ids):
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(doc_id,) for doc_id in ids])
+            self._conn.execute("DROP TABLE IF EXISTS temp.renumbered")
+            self._conn.execute(
+                "CREATE TEMP TABLE renumbered AS "
+                "SELECT id, ROW_NUMBER() OVER (ORDER BY position) - 1 AS new_position FROM chunks WHERE position IS NOT NULL"
+            )
+            self._conn.execute("UPDATE chunks SET position = NULL WHERE position IS NOT NULL")
+            self._conn.execute(
+                "UPDATE chunks SET position = (SELECT new_position FROM temp.renumbered WHERE renumbered.id = chunks.id) "
+                "WHERE id IN (SELECT id FROM temp.renumbered)"
+            )
+            self._conn.execute("DROP TABLE temp.renumbered")
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks")
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def rollback(self):
+        with self._lock:
+            self._conn.rollback()
+
+    # Safe to call more than once; a closed store cannot be read again
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# The index_to_docstore_id mapping the FAISS wrapper expects (position -> id),
+# read from and written to the docstore's position column
+class PositionMap(MutableMapping):
+    def __init__(self, docstore):
+        self.docstore = docstore
+
+    def __getitem__(self, position):
+        rows = self.docstore._query("SELECT id FROM chunks WHERE position = ?", (int(position),))
+        if not rows:
+            raise KeyError(position)
+        return rows[0][0]
+
+    def __setitem__(self, position, doc_id):
+        self.update({position: doc_id})
+
+    def __delitem__(self, position):
+        with self.docstore._lock:
+            self.docstore._conn.execute("UPDATE chunks SET position = NULL WHERE position = ?", (int(position),))
+
+    def update(self, other=(), **kwargs):
+        items = dict(other, **kwargs)
+        with self.docstore._lock:
+            self.docstore._conn.executemany(
+                "UPDATE chunks SET position = ? WHERE id = ?", [(int(position), doc_id) for position, doc_id in items.items()]
+            )
+
+    def __len__(self):
+        return self.docstore._query("SELECT COUNT(*) FROM chunks WHERE position IS NOT NULL")[0][0]
+
+    def __iter__(self):
+        return (row[0] for row in self.docstore._query("SELECT position FROM chunks WHERE position IS NOT NULL ORDER BY position"))
+
+    def items(self):
+        return self.docstore._query("SELECT position, id FROM chunks WHERE position IS NOT NULL ORDER BY position")
+
+    def values(self):
+        return [doc_id for _, doc_id in self.items()]
+
+
+def docstore_path(index_save_path):
+    return os.path.join(index_save_path, docstore_name)
+
+
+# Function to copy an in-memory docstore and its position mapping into SQLite.
+# Any rows already in the SQLite store are replaced.
+def copy_docstore(docstore, index_to_docstore_id, sqlite_docstore):
+    sqlite_docstore.clear()
+    items = sorted(index_to_docstore_id.items())
+    for start in range(0, len(items), 10_000):
+        batch = items[start:start + 10_000]
+        sqlite_docstore.add({doc_id: docstore.search(doc_id) for _, doc_id in batch})
+        PositionMap(sqlite_docstore).update(dict(batch))
+    sqlite_docstore.commit()
+
+
+# Function to move an index saved with a pickled docstore (index.pkl) over to
+# SQLite. The pickle is our own file (the bundled index ships one, so the
+# tracked files never change at runtime); it is read once here and never again.
+def migrate_legacy_docstore(index_save_path):
+    legacy_path = os.path.join(index_save_path, legacy_docstore_name)
+    with open(legacy_path, "rb") as legacy_file:
+        docstore, index_to_docstore_id = pickle.load(legacy_file)
+    sqlite_docstore = SQLiteDocstore(docstore_path(index_save_path))
+    copy_docstore(docstore, index_to_docstore_id, sqlite_docstore)
+    print(f"Docstore of {index_save_path} moved from {legacy_docstore_name} to {docstore_name} ({len(index_to_docstore_id)} chunks)")
+    return sqlite_docstore
+
+
+# Function to open the docstore of an index, migrating a pickled one first
+def open_docstore(index_save_path):
+    path = docstore_path(index_save_path)
+    if not os.path.exists(path) and os.path.exists(os.path.join(index_save_path, legacy_docstore_name)):
+        return migrate_legacy_docstore(index_save_path)
+    return SQLiteDocstore(path)
@@ -0,0 +1,98 @@
+import argparse
+import json
+import subprocess
+import sys
+
+default_scripts = ["Home.py", "pages/ISO_Document_Intelligence.py", "pages/ISO_Failure_Code_Intelligence.py"]
+
+# Startup profiling: renders each app script once in a fresh interpreter
+# started with -X importtime, and reports the wall time of the first render
+# and what each imported package cost. Run it from the app directory.
+
+_render_snippet = """
+import sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+ready = time.perf_counter()
+AppTest.from_file(sys.argv[1], default_timeout=120).run()
+done = time.perf_counter()
+print(f"TIMING {ready - start:.6f} {done - ready:.6f}", file=sys.stderr)
+"""
+
+
+# Function to parse -X importtime output into {module: (self_us, cumulative_us)}
+def parse_importtime(stderr):
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def _timings(stderr):
+    for line in stderr.splitlines():
+        if line.startswith("TIMING "):
+            streamlit_s, render_s = line.split()[1:]
+            return float(streamlit_s), float(render_s)
+    return None, None
+
+
+# Import cost summed per top-level package, from each module's own time
+def package_costs(modules):
+    packages = {}
+    for name, (self_us, _) in modules.items():
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+    return dict(sorted(packages.items(), key=lambda item: item[1], reverse=True))
+
+
+def profile_script(script):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _render_snippet, script],
+        capture_output=True, text=True,
+    )
+    modules = parse_importtime(result.stderr)
+    streamlit_s, render_s = _timings(result.stderr)
+    return {
+        "script": script,
+        "ok": result.returncode == 0,
+        "streamlit_import_s": streamlit_s,
+        "first_render_s": render_s,
+        "modules_imported": len(modules),
+        "import_s": round(sum(self_us for self_us, _ in modules.values()) / 1e6, 4),
+        "packages_ms": {package: round(us / 1000, 1) for package, us in package_costs(modules).items()},
+        "slowest_modules_ms": {
+            name: round(cumulative / 1000, 1)
+            for name, (_, cumulative) in sorted(modules.items(), key=lambda item: item[1][1], reverse=True)[:25]
+        },
+        **({} if result.returncode == 0 else {"error": result.stderr[-2000:]}),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report cold-start render time and import cost per module for the app pages")
+    parser.add_argument("scripts", nargs="*", default=default_scripts)
+    parser.add_argument("--top", type=int, default=15, help="packages to list per script")
+    parser.add_argument("--output", default=None, help="also write the full report to this JSON file")
+    args = parser.parse_args(argv)
+
+    report = [profile_script(script) for script in args.scripts]
+    for entry in report:
+        if not entry["ok"]:
+            print(f"{entry['script']}: failed\n{entry['error']}")
+            continue
+        print(f"{entry['script']}: first render {entry['first_render_s']:.2f} s, "
+              f"{entry['modules_imported']} modules, {entry['import_s']:.2f} s importing "
+              f"(streamlit itself {entry['streamlit_import_s']:.2f} s)")
+        for package, ms in list(entry["packages_ms"].items())[:args.top]:
+            print(f"    {package:32} {ms:9.1f} ms")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, indent=2)
+    return 0 if all(entry["ok"] for entry in report) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,50 @@
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+# Wall-clock timings of one chat turn: time to first token and total latency
+class TurnTimer:
+    def __init__(self, page):
+        self.page = page
+        self.start = time.perf_counter()
+        self.first_token = None
+        self.end = None
+
+    def mark_token(self):
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+
+    def finish(self):
+        if self.end is None:
+            self.end = time.perf_counter()
+        self.mark_token()
+
+    def as_dict(self):
+        return {
+            "page": self.page,
+            "ttft_s": round(self.first_token - self.start, 4) if self.first_token else None,
+            "total_s": round(self.end - self.start, 4) if self.end else None,
+        }
+
+
+# Callback handler that marks the first token any LLM call of a run streams
+class TimingCallbackHandler(BaseCallbackHandler):
+    def __init__(self, timer):
+        self.timer = timer
+
+    def on_llm_new_token(self, token, **kwargs):
+        if token:
+            self.timer.mark_token()
+
+
+# Generator over the answer tokens of a retrieval chain. The retrieved
+# documents are stored in result["context"] as soon as they arrive.
+def stream_retrieval_answer(retrieval_chain, inputs, timer, result, callbacks=None):
+    for chunk in retrieval_chain.stream(inputs, {"callbacks": callbacks}):
+        if "context" in chunk:
+            result["context"] = chunk["context"]
+        if chunk.get("answer"):
+            timer.mark_token()
+            yield chunk["answer"]
+    timer.finish()
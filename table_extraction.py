@@ -0,0 +1,260 @@
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from tracing import count, span
+
+table_cache_path = "table_cache"
+# Bump when the extraction or cleaning changes, so old cached tables are not reused
+extraction_format = 2
+max_workers = min(4, os.cpu_count() or 1)
+# Below this many pages, starting worker processes costs more than it saves
+min_pool_pages = 4
+
+# ISO 14224 tables and the (zero-based) PDF pages they are printed on
+tables = {
+    "Table A.4 and EquipSubD": {
+        "pages": [57, 58, 59, 60, 61, 62, 63, 64, 65],
+        "description": "Equipment Subdivision and related data"
+    },
+    "Table B.6": {
+        "pages": [192],
+        "description": "Performance metrics for system B.6"
+    },
+    "Table B.7": {
+        "pages": [193, 194],
+        "description": "Overview of system failure rates for B.7"
+    },
+    "Table B.8": {
+        "pages": [195, 196],
+        "description": "System configuration and performance for B.8"
+    },
+    "Table B.9": {
+        "pages": [197, 198, 199],
+        "description": "Analysis of component reliability for B.9"
+    },
+    "Table B.10": {
+        "pages": [200, 201],
+        "description": "System breakdown and diagnostics for B.10"
+    },
+    "Table B.11": {
+        "pages": [202, 203],
+        "description": "Detailed fault codes and errors for B.11"
+    },
+    "Table B.12": {
+        "pages": [204, 205],
+        "description": "System output and efficiency data for B.12"
+    },
+    "Table B.13": {
+        "pages": [206],
+        "description": "Failure prediction and maintenance for B.13"
+    },
+    "Table B.14": {
+        "pages": [207],
+        "description": "Maintenance records and schedules for B.14"
+    },
+    "Table B.15 Failure Mode_Codes": {
+        "pages": [208, 209],
+        "description": "Failure mode and error codes for Table B.15"
+    }
+}
+
+
+def transform_value(x):
+    if pd.isna(x):
+        return 0
+    elif x == 'X':
+        return 1
+    else:
+        return x
+
+
+# Same result as applymap(transform_value), on the whole frame at once
+def transform_frame(df):
+    values = df.to_numpy(dtype=object)
+    values = np.where(pd.isna(values), 0, np.where(values == 'X', 1, values))
+    return pd.DataFrame(values, index=df.index, columns=df.columns).infer_objects()
+
+
+def clean_df(df):
+    df1 = df.drop(columns=['Examples','Type c'])
+    df1 = df1.replace('', None)
+    df_final = df1.T
+    df_final.columns = df_final.iloc[-1]
+    df_final = df_final.iloc[:-1]
+    df_sorted = df_final[sorted(df_final.columns)]
+    df_sorted.columns.name = None
+    return transform_frame(df_sorted)
+
+
+# Tables split over pages repeat a header row and sometimes carry a footer
+# row; both show up as rows with empty (merged) cells
+def normalize_table(tab):
+    empty_header = any(not element for element in tab.header.names)
+    empty_first_cell = any(not element for element in tab.rows[0].cells)
+    empty_last_cell = any(not element for element in tab.rows[-1].cells)
+    df = tab.to_pandas()
+
+    if empty_header and empty_first_cell:
+        df.columns = df.iloc[1]
+        df = df.iloc[2:-1] if empty_last_cell else df.iloc[2:]
+        df = df.reset_index(drop=True)
+    return df
+
+
+def extract_page(doc, page_num):
+    if page_num >= doc.page_count:
+        raise ValueError(f"PDF has {doc.page_count} pages, expected a table on page {page_num + 1}")
+    page = doc[page_num]
+    page.set_rotation(90)
+    tabs = page.find_tables()
+    if not tabs.tables:
+        raise ValueError(f"No table found on page {page_num + 1}")
+    return normalize_table(tabs[0])
+
+
+# Tables whose first page is probed before a PDF is taken for ISO 14224
+probe_tables = ["Table B.6", "Table B.15 Failure Mode_Codes"]
+
+
+# Function to tell whether a PDF has the ISO 14224 layout `tables` expects:
+# enough pages, and a table where a few of them should start
+def has_iso_tables(pdf_bytes):
+    import fitz
+
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        last_page = max(page_num for info in tables.values() for page_num in info["pages"])
+        if doc.page_count <= last_page:
+            return False
+        for name in probe_tables:
+            page = doc[tables[name]["pages"][0]]
+            page.set_rotation(90)
+            if not page.find_tables().tables:
+                return False
+        return True
+    finally:
+        doc.close()
+
+
+_worker_doc = None
+
+
+def _init_worker(pdf_bytes):
+    import fitz
+
+    global _worker_doc
+    _worker_doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+
+
+def _extract_worker_page(page_num):
+    return extract_page(_worker_doc, page_num)
+
+
+def _read_pdf(file):
+    if isinstance(file, (bytes, bytearray)):
+        return bytes(file)
+    if hasattr(file, "getvalue"):
+        return file.getvalue()
+    with open(file, "rb") as pdf_file:
+        return pdf_file.read()
+
+
+def pdf_hash(pdf_bytes):
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+def _cache_file(digest, page_nums, cache_path):
+    key = hashlib.sha256(json.dumps([digest, list(page_nums), extraction_format]).encode("utf-8")).hexdigest()
+    return os.path.join(cache_path, f"{key}.json")
+
+
+# Cached tables are plain JSON ("split" layout keeps the index and column
+# order), so reading the cache never unpickles a file from disk
+def _write_table(df, cache_file):
+    df.to_json(cache_file + ".tmp", orient="split")
+    os.replace(cache_file + ".tmp", cache_file)
+
+
+def _read_table(cache_file):
+    return pd.read_json(cache_file, orient="split", dtype=False, convert_dates=False)
+
+
+# Function to extract the raw page tables of a PDF. A few pages are read in
+# process; more are spread over a process pool, each worker opening the PDF once.
+def extract_pages(pdf_bytes, page_nums, workers=max_workers):
+    import fitz
+
+    page_nums = list(page_nums)
+    if workers <= 1 or len(page_nums) < min_pool_pages:
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        try:
+            return [extract_page(doc, page_num) for page_num in page_nums]
+        finally:
+            doc.close()
+
+    # Spawned workers, as forking a Streamlit server with its threads is not safe
+    context = multiprocessing.get_context("spawn")
+    workers = min(workers, len(page_nums))
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(pdf_bytes,)) as pool:
+        return list(pool.map(_extract_worker_page, page_nums))
+
+
+# Function to extract several tables of an ISO 14224 PDF, {name: page list} in,
+# {name: cleaned dataframe} out. Each table is cached on disk by PDF hash and
+# page list, and the pages of all uncached tables go through one pool.
+def extract_tables(file, table_pages, cache_path=table_cache_path, workers=max_workers):
+    pdf_bytes = _read_pdf(file)
+    digest = pdf_hash(pdf_bytes)
+    results = {}
+    missing = {}
+    for name, page_nums in table_pages.items():
+        cache_file = _cache_file(digest, page_nums, cache_path)
+        if os.path.exists(cache_file):
+            results[name] = _read_table(cache_file)
+            count("table_cache_hit")
+        else:
+            missing[name] = list(page_nums)
+            count("table_cache_miss")
+
+    if missing:
+        all_pages = sorted({page_num for page_nums in missing.values() for page_num in page_nums})
+        with span("table_extraction", pages=len(all_pages)):
+            page_tables = dict(zip(all_pages, extract_pages(pdf_bytes, all_pages, workers)))
+        os.makedirs(cache_path, exist_ok=True)
+        for name, page_nums in missing.items():
+            df = pd.concat([page_tables[page_num] for page_num in page_nums], ignore_index=True)
+            results[name] = clean_df(df)
+            _write_table(results[name], _cache_file(digest, page_nums, cache_path))
+        print(f"Extracted {len(missing)} tables from {len(all_pages)} PDF pages")
+
+    return {name: results[name] for name in table_pages}
+
+
+def pdf_to_df(file, page_nums):
+    return extract_tables(file, {"table": page_nums})["table"]
+
+
+# Function to extract every table in `tables` from an ISO 14224 PDF
+def extract_iso_tables(file, cache_path=table_cache_path, workers=max_workers):
+    return extract_tables(file, {name: info["pages"] for name, info in tables.items()}, cache_path, workers)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Extract the ISO 14224 tables from the PDF into the table cache")
+    parser.add_argument("pdf")
+    parser.add_argument("--workers", type=int, default=max_workers)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    extracted = extract_iso_tables(args.pdf, workers=args.workers)
+    for name, df in extracted.items():
+        print(f"{name}: {df.shape[0]} rows x {df.shape[1]} columns")
+    print(f"Done in {time.perf_counter() - start:.1f} s")
@@ -0,0 +1,13 @@
+import numpy as np
+
+from answer_cache import AnswerCache
+
+
+def test_similar_question_with_another_code_misses():
+    cache = AnswerCache()
+    vector = np.ones(8)
+    cache.put("failure mode ELP in pumps", 1, "External leakage process medium", "iso.pdf", 12, vector)
+
+    # Even an identical embedding must not hand the ELP answer to an ELF question
+    assert cache.get_similar("failure mode ELF in pumps", vector, 1) is None
+    assert cache.get_similar("what is failure mode ELP in pumps", vector, 1)["answer"] == "External leakage process medium"
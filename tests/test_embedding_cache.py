@@ -0,0 +1,39 @@
+import os
+
+import numpy as np
+
+from embedding_cache import EmbeddingStore
+
+
+def _vector(n):
+    return np.full(4, n, dtype=np.float32)
+
+
+def test_stores_sharing_a_directory_never_share_a_slot(tmp_path):
+    # Two stores stand in for two server processes on the same cache
+    first, second = EmbeddingStore(str(tmp_path)), EmbeddingStore(str(tmp_path))
+    first.put_many([(f"a{n}", _vector(n)) for n in range(5)])
+    second.put_many([(f"b{n}", _vector(100 + n)) for n in range(5)])
+    first.put_many([(f"c{n}", _vector(200 + n)) for n in range(5)])
+
+    keys = [f"{prefix}{n}" for prefix in "abc" for n in range(5)]
+    for store in (first, second):
+        found = store.get_many(keys)
+        assert len(found) == 15
+        for prefix, offset in zip("abc", (0, 100, 200)):
+            for n in range(5):
+                assert found[f"{prefix}{n}"][0] == offset + n
+
+
+def test_full_cache_reuses_least_recently_used_slots(tmp_path):
+    store = EmbeddingStore(str(tmp_path), max_bytes=4 * 4 * 4)
+    store.put_many([(f"k{n}", _vector(n)) for n in range(4)])
+    store.get_many(["k0"])
+    store.put_many([("k4", _vector(4)), ("k5", _vector(5))])
+
+    assert len(store) == 4
+    # The vectors file never grows past max_bytes
+    assert os.path.getsize(os.path.join(str(tmp_path), "vectors.f32")) == 4 * 4 * 4
+    found = store.get_many([f"k{n}" for n in range(6)])
+    assert {"k0", "k4", "k5"} <= set(found)
+    assert found["k4"][0] == 4 and found["k5"][0] == 5
@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+from failure_matrix import load_failure_matrix, workbook_path
+from failure_query import FailureQueryEngine
+
+
+@pytest.fixture(scope="module")
+def engine(tmp_path_factory):
+    workbook = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), workbook_path)
+    return FailureQueryEngine(load_failure_matrix(workbook, str(tmp_path_factory.mktemp("matrix"))))
+
+
+def test_definition_lookup_lists_no_classes(engine):
+    answer = engine.answer("What does FTS mean?", "Table B.6")
+    assert "| FTS | Failure to start on demand |" in answer
+    assert "Equipment classes" not in answer
+
+
+def test_code_is_scoped_to_one_sheet(engine):
+    # Golden #3: FCO is not in B.6; its first table (B.7) has it for turrets and swivels only
+    answer = engine.answer(
+        "if an equipment had a failure to connect as failure mode, what will the Failure code be? "
+        "and what type of equipment it can be?", "Table B.6"
+    )
+    assert "| FCO |" in answer
+    assert answer.endswith("**Equipment classes:** Turrets, Swivels")
+
+
+def test_selected_sheet_scopes_the_classes(engine):
+    # Golden #2
+    answer = engine.answer("which equipment types that can be expected to have ELP Failure mode?", "Table B.6")
+    assert answer.endswith("**Equipment classes:** Compressors, Gas turbines, Pumps, Steam turbines, Turboexpanders")
+
+
+def test_single_failure_mode_question_gets_one_code(engine):
+    # Golden #6: 14 modes apply to every rotating class; the question asks for one
+    answer = engine.answer("What is the Failure mode that happens to all rotating Equipment Classes?", "Table B.6")
+    codes = [line.split("|")[1].strip() for line in answer.splitlines()[2:] if line.startswith("|")]
+    assert codes == ["AIR"]
+    assert "13 other failure modes also apply" in answer
+
+    answer = engine.answer("Which failure modes happen to all rotating equipment classes?", "Table B.6")
+    assert answer.count("\n|") == 15
+
+
+def test_code_lookup_route_skips_the_engine(engine):
+    from failure_code_qa import response_generator
+
+    answer = response_generator(None, "what does ELP mean?", "offline", engine)
+    assert answer == "| Failure Code | Description |\n|--------------|-------------|\n| ELP | External leakage process medium |"
+
+
+def test_table_sheets_keep_their_column_types(tmp_path):
+    workbook = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), workbook_path)
+    matrix = load_failure_matrix(workbook, str(tmp_path / "matrix"))
+    sheet = matrix["Table A.4 and EquipSubD"]
+    assert str(sheet.to_frame()["Parent Code"].dtype) == "int64"
+    assert str(matrix["Table B.15 Failure Mode_Codes"].to_frame()["On-demand type failure"].dtype) == "int64"
+    assert sheet.to_frame() is sheet.to_frame()
@@ -0,0 +1,77 @@
+import os
+
+import faiss
+import pytest
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain_core.documents import Document
+
+from ann_index import load_settings, save_settings
+from index_registry import index_document, load_registry
+
+
+def test_document_without_text_is_not_indexed(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=8)
+    with pytest.raises(ValueError, match="No extractable text in scan.pdf"):
+        index_document("key", "scan.pdf", lambda vector_store: (None, []), embeddings, str(tmp_path / "index"))
+    assert load_registry(str(tmp_path / "index")) is None
+
+
+def _ingest_texts(texts, embeddings):
+    from ingestion import add_batch
+
+    def ingest(vector_store):
+        documents = [Document(page_content=text, metadata={"source": "a.pdf", "page": 0}) for text in texts]
+        ids = [f"{texts[0]}-{n}" for n in range(len(texts))]
+        return add_batch(vector_store, embeddings, documents, embeddings.embed_documents(texts), ids), ids
+    return ingest
+
+
+def test_converted_index_keeps_its_type_on_the_next_upload(tmp_path, monkeypatch):
+    import ann_index
+
+    path = str(tmp_path / "index")
+    embeddings = DeterministicFakeEmbedding(size=8)
+    index_document("a", "a.pdf", _ingest_texts([f"first {n}" for n in range(20)], embeddings), embeddings, path)
+    assert load_settings(path)["target"] == "flat"
+
+    # What `python ann_index.py convert hnsw` does
+    converted = ann_index.convert_index(ann_index.read_index(path), "hnsw")
+    faiss.write_index(converted, os.path.join(path, "index.faiss"))
+    save_settings(converted, path, target="hnsw")
+
+    monkeypatch.setattr(ann_index, "index_type", "flat")
+    store = index_document("b", "b.pdf", _ingest_texts([f"second {n}" for n in range(5)], embeddings), embeddings, path)
+    assert ann_index.index_type_of(store.index) == "hnsw"
+    settings = load_settings(path)
+    assert (settings["type"], settings["target"], settings["vectors"]) == ("hnsw", "hnsw", 25)
+
+
+def _pdf(lines):
+    import fitz
+
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), "\n".join(lines))
+    return doc.tobytes()
+
+
+def test_legacy_entry_is_only_adopted_by_the_same_pdf(tmp_path):
+    from langchain_community.vectorstores import FAISS
+
+    from index_registry import _legacy_chunk_texts, adopt_legacy_document, is_indexed
+
+    path = str(tmp_path / "index")
+    embeddings = DeterministicFakeEmbedding(size=8)
+    original = _pdf([f"Clause {n} of the first edition." for n in range(10)])
+    revised = _pdf([f"Clause {n} of the second edition." for n in range(10)])
+    # An index saved before the registry existed
+    texts = _legacy_chunk_texts(original, "iso.pdf")
+    FAISS.from_texts(texts, embeddings, metadatas=[{"source": "iso.pdf"} for _ in texts]).save_local(path)
+
+    assert not adopt_legacy_document("revised", "iso.pdf", revised, embeddings, path)
+    assert "legacy:iso.pdf" in load_registry(path)["documents"]
+
+    assert adopt_legacy_document("original", "iso.pdf", original, embeddings, path)
+    documents = load_registry(path)["documents"]
+    assert "legacy:iso.pdf" not in documents
+    assert documents["original"]["chunks"] == len(texts)
+    assert is_indexed("original", path) and not is_indexed("revised", path)
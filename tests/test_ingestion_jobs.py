@@ -0,0 +1,71 @@
+import time
+
+import fitz
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+import ingestion
+from index_registry import close_faiss_index, load_faiss_index, load_registry
+from ingestion_jobs import IngestionQueue, IngestionService
+
+splitter = {"type": "RecursiveCharacterTextSplitter", "chunk_size": 60, "chunk_overlap": 0}
+
+
+# Fake embeddings that count their batches and fail on the `fail_on`-th one
+class FlakyEmbedding(DeterministicFakeEmbedding):
+    batches: list = []
+    fail_on: int = 0
+
+    def embed_documents(self, texts):
+        self.batches.append(texts)
+        if len(self.batches) == self.fail_on:
+            raise RuntimeError("connection reset")
+        return super().embed_documents(texts)
+
+
+def _pdf():
+    doc = fitz.open()
+    for page in range(3):
+        doc.new_page().insert_text((72, 72), "\n".join(f"Page {page} line {n} of the maintenance record." for n in range(6)))
+    return doc.tobytes()
+
+
+def _wait(service, job_id, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = service.job(job_id)
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.05)
+    raise TimeoutError(job_id)
+
+
+def test_retried_job_resumes_from_its_checkpoints(tmp_path, monkeypatch):
+    # One batch in flight at a time, so the failing batch is always the third
+    monkeypatch.setattr(ingestion, "batch_size", 4)
+    monkeypatch.setattr(ingestion, "max_workers", 1)
+    path = str(tmp_path / "index")
+    service = IngestionService(IngestionQueue(str(tmp_path / "jobs")), workers=1, index_save_path=path)
+    try:
+        embeddings = FlakyEmbedding(size=8, batches=[], fail_on=3)
+        job = _wait(service, service.submit(_pdf(), "record.pdf", "key", splitter, embeddings)["id"])
+        assert job["status"] == "failed" and "connection reset" in job["error"]
+        assert job["batches_done"] == 2
+        assert load_registry(path) is None
+        first_run = [text for batch in embeddings.batches[:2] for text in batch]
+
+        embeddings = FlakyEmbedding(size=8, batches=[])
+        job = _wait(service, service.retry(job["id"], embeddings)["id"])
+        assert job["status"] == "done"
+    finally:
+        service.stop()
+
+    # Only the batches that never finished were embedded again
+    embedded_again = [text for batch in embeddings.batches for text in batch]
+    assert not set(first_run) & set(embedded_again)
+    vector_store = load_faiss_index(path, embeddings)
+    try:
+        stored = [text for _, text in vector_store.docstore.iter_texts()]
+    finally:
+        close_faiss_index(vector_store)
+    assert stored == first_run + embedded_again
+    assert load_registry(path)["documents"]["key"]["chunks"] == len(stored)
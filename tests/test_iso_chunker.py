@@ -0,0 +1,83 @@
+import fitz
+from langchain_core.documents import Document
+
+from iso_chunker import ISOTextSplitter, is_iso_standard
+
+
+# Running text; every page gets its own, so none of it is taken for a page header
+def prose(page):
+    return " ".join(
+        f"Event {page}.{number} is recorded at the level of equipment unit {number * 7 + page} and the failure mechanism "
+        f"describes the physical process number {number * 13 + page} that led to it."
+        for number in range(4)
+    )
+
+
+def _page(number, lines):
+    return Document(page_content="\n".join(lines), metadata={"source": "iso.pdf", "page": number})
+
+
+def _wrap(text, width=90):
+    lines, line = [], ""
+    for word in text.split():
+        if line and len(line) + len(word) + 1 > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}".strip()
+    return lines + [line]
+
+
+def _chunks(pages):
+    return ISOTextSplitter(chunk_size=400, chunk_overlap=0).split_documents(pages)
+
+
+def test_prose_after_a_table_is_text():
+    rows = ["Code", "Description", "ELP", "External leakage", "ELF", "External leakage fuel", "VIB", "Vibration"]
+    pages = [
+        _page(0, ["1 Scope"] + _wrap(prose(0))),
+        _page(1, ["Table 1 — Failure modes"] + rows + _wrap(prose(1))),
+        _page(2, _wrap(prose(2))),
+    ]
+    chunks = _chunks(pages)
+    tables = [chunk for chunk in chunks if chunk.metadata["chunk_type"] == "table"]
+    assert len(tables) == 1
+    assert tables[0].page_content.splitlines() == ["Table 1 — Failure modes"] + rows
+    assert all("failure mechanism" not in chunk.page_content for chunk in tables)
+    assert any(chunk.metadata["page"] == 2 and chunk.metadata["chunk_type"] != "table" for chunk in chunks)
+
+
+def test_table_continues_across_pages():
+    rows = [f"R{number:02d}" for number in range(20)]
+    pages = [_page(0, ["Table 2 — Codes"] + rows[:10]), _page(1, rows[10:]), _page(2, ["1 Scope"] + _wrap(prose(2)))]
+    chunks = _chunks(pages)
+    assert chunks[0].metadata["chunk_type"] == "table"
+    assert chunks[0].page_content.splitlines() == ["Table 2 — Codes"] + rows
+    assert chunks[0].metadata["end_page"] == 1
+    assert chunks[1].metadata["clause"] == "1"
+
+
+def test_only_iso_standards_use_the_iso_chunker():
+    def pdf(text):
+        doc = fitz.open()
+        doc.new_page().insert_text((72, 72), text)
+        return doc.tobytes()
+
+    assert is_iso_standard(pdf("ISO 14224:2016(E)"))
+    assert not is_iso_standard(pdf("Quarterly maintenance report"))
+
+
+def test_chunks_break_at_top_level_clauses():
+    pages = [
+        _page(0, ["1 Scope"] + _wrap(prose(0)) + ["2 Normative references"] + _wrap(prose(1))),
+        # A date at the start of a line is not clause 26
+        _page(1, ["3 Terms and definitions"] + _wrap(prose(2)) + ["26 Feb 2016 is the date of this edition."]),
+    ]
+    chunks = _chunks(pages)
+    by_clause = {}
+    for chunk in chunks:
+        by_clause.setdefault(chunk.metadata["clause"], []).append(chunk.page_content)
+    assert sorted(by_clause) == ["1", "2", "3"]
+    assert by_clause["2"][0].startswith("2 Normative references")
+    assert not any("Normative references" in text for text in by_clause["1"])
+    assert "26 Feb 2016" in by_clause["3"][-1]
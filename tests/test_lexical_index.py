@@ -0,0 +1,51 @@
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain_community.vectorstores import FAISS
+
+from lexical_index import HybridRetriever, LexicalIndex, is_identifier_query, reciprocal_rank_fusion
+
+texts = [
+    "ELP External leakage process medium: oil, gas, condensate or water leaking to the outside.",
+    "ELU External leakage utility medium: lubricant or cooling water leaking to the outside.",
+    "Table B.15 lists the failure modes of pumps and compressors.",
+    "Vibration above the alarm limit is recorded as abnormal vibration.",
+]
+
+
+class CountingEmbedding(DeterministicFakeEmbedding):
+    queries: list = []
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return super().embed_query(text)
+
+
+def _retriever():
+    embeddings = CountingEmbedding(size=8, queries=[])
+    vector_store = FAISS.from_texts(texts, embeddings)
+    return HybridRetriever(vector_store=vector_store, lexical_index=LexicalIndex.from_vector_store(vector_store)), embeddings
+
+
+def test_identifier_queries():
+    assert is_identifier_query("ELP")
+    assert is_identifier_query("What does ELU mean?")
+    assert is_identifier_query("Table B.15")
+    assert not is_identifier_query("Why does the pump vibrate so much?")
+    assert not is_identifier_query("What is a failure mode?")
+
+
+def test_identifier_query_skips_the_embedding():
+    retriever, embeddings = _retriever()
+    documents = retriever.invoke("What does ELU mean?")
+    assert documents[0].page_content.startswith("ELU")
+    assert embeddings.queries == []
+
+
+def test_prose_query_fuses_both_rankings():
+    retriever, embeddings = _retriever()
+    documents = retriever.invoke("abnormal vibration of the pump")
+    assert embeddings.queries == ["abnormal vibration of the pump"]
+    assert len(documents) == 1
+
+
+def test_reciprocal_rank_fusion_favours_agreement():
+    assert reciprocal_rank_fusion([["a", "b", "c"], ["b", "c", "a"]])[0] == "b"
@@ -0,0 +1,94 @@
+import json
+import threading
+import time
+
+import httpx
+
+import openai_pool
+import resources
+from openai_pool import SingleFlight
+
+
+def test_get_embeddings_shares_the_pooled_client(tmp_path, monkeypatch):
+    requests = []
+
+    def handler(request):
+        requests.append(json.loads(request.content))
+        body = {
+            "object": "list", "model": "text-embedding-ada-002",
+            "data": [{"object": "embedding", "index": 0, "embedding": [0.5] * 8}],
+            "usage": {"prompt_tokens": 1, "total_tokens": 1},
+        }
+        # Unread, like a response off the network
+        return httpx.Response(200, headers={"content-type": "application/json"}, stream=httpx.ByteStream(json.dumps(body).encode()))
+
+    # A fresh shared client whose pooled transport ends in the mock
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(openai_pool, "_http_client", None)
+    monkeypatch.setattr(openai_pool, "_transport", None)
+    monkeypatch.setattr(openai_pool.httpx, "HTTPTransport", lambda limits: httpx.MockTransport(handler))
+    resources.get_embeddings.clear()
+    try:
+        embeddings = resources.get_embeddings("sk-test")
+        # Token counting needs tiktoken's encodings from the network
+        embeddings.embeddings.check_embedding_ctx_length = False
+        assert embeddings.embed_query("What does ELP mean?") == [0.5] * 8
+    finally:
+        resources.get_embeddings.clear()
+    assert [request["model"] for request in requests] == ["text-embedding-ada-002"]
+
+
+def test_single_flight_does_not_share_an_interrupted_call():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    results = []
+
+    def interrupted():
+        started.set()
+        release.wait()
+        raise KeyboardInterrupt
+
+    def leader():
+        try:
+            flight.do("question", interrupted)
+        except KeyboardInterrupt:
+            results.append("leader interrupted")
+
+    thread = threading.Thread(target=leader)
+    thread.start()
+    started.wait()
+    waiter = threading.Thread(target=lambda: results.append(flight.do("question", lambda: "answer")))
+    waiter.start()
+    time.sleep(0.1)
+    release.set()
+    thread.join()
+    waiter.join()
+    assert results == ["leader interrupted", ("answer", False)]
+
+
+def test_single_flight_shares_errors():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    errors = []
+
+    def failing():
+        started.set()
+        release.wait()
+        raise ValueError("upstream failed")
+
+    def ask(fn):
+        try:
+            flight.do("question", fn)
+        except ValueError as error:
+            errors.append(str(error))
+
+    thread = threading.Thread(target=ask, args=(failing,))
+    thread.start()
+    started.wait()
+    waiter = threading.Thread(target=ask, args=(lambda: "never called",))
+    waiter.start()
+    time.sleep(0.1)
+    release.set()
+    thread.join()
+    waiter.join()
+    assert errors == ["upstream failed", "upstream failed"]
@@ -0,0 +1,35 @@
+import os
+
+from langchain_community.embeddings import DeterministicFakeEmbedding
+from langchain_community.vectorstores import FAISS
+
+from sqlite_docstore import PositionMap, docstore_name, legacy_docstore_name, open_docstore
+
+
+def test_pickled_docstore_is_moved_to_sqlite_once(tmp_path):
+    path = str(tmp_path)
+    texts = [f"chunk {n}" for n in range(30)]
+    metadatas = [{"source": "a.pdf", "page": n // 10} for n in range(30)]
+    vector_store = FAISS.from_texts(texts, DeterministicFakeEmbedding(size=8), metadatas=metadatas)
+    vector_store.save_local(path)
+
+    docstore = open_docstore(path)
+    try:
+        positions = PositionMap(docstore)
+        assert dict(positions.items()) == vector_store.index_to_docstore_id
+        for position, doc_id in vector_store.index_to_docstore_id.items():
+            document = docstore.search(doc_id)
+            assert document.page_content == texts[position]
+            assert document.metadata == metadatas[position]
+        assert [text for _, text in docstore.iter_texts()] == texts
+    finally:
+        docstore.close()
+
+    # Later opens read SQLite only
+    os.remove(os.path.join(path, legacy_docstore_name))
+    docstore = open_docstore(path)
+    try:
+        assert os.path.exists(os.path.join(path, docstore_name))
+        assert len(PositionMap(docstore)) == 30
+    finally:
+        docstore.close()
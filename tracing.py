@@ -0,0 +1,363 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging.handlers import RotatingFileHandler
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+trace_path = os.path.join("traces", "turns.jsonl")
+trace_max_bytes = 10 * 1024 * 1024
+trace_backup_count = 5
+max_spans_per_trace = 500
+metrics_port = int(os.environ.get("ISO_METRICS_PORT", 9464))
+duration_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Per-turn tracing. A trace covers one chat turn (or one ingestion run); the
+# stages inside it are timed spans, and every span, token and cache counter
+# also feeds process-wide metrics served in Prometheus text format.
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Metrics:
+    def __init__(self, buckets=duration_buckets):
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.setdefault(key, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def render(self):
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs]
+            return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, dict(value, buckets=list(value["buckets"]))) for key, value in self.histograms.items())
+
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{label_text(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            for bound, count in zip(self.buckets, histogram["buckets"]):
+                lines.append(f"{name}_bucket{label_text(labels, [('le', bound)])} {count}")
+            lines.append(f"{name}_bucket{label_text(labels, [('le', '+Inf')])} {histogram['count']}")
+            lines.append(f"{name}_sum{label_text(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{label_text(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class Trace:
+    def __init__(self, page, kind="turn"):
+        self.trace_id = uuid.uuid4().hex
+        self.page = page
+        self.kind = kind
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.total_s = None
+        self.spans = []
+        self.counters = {}
+        self.tokens = {"prompt": 0, "completion": 0}
+        self.cost_usd = 0.0
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start, duration, attributes=None):
+        with self._lock:
+            self.spans.append({
+                "name": name,
+                "offset_s": round(start - self.start, 6),
+                "duration_s": round(duration, 6),
+                **({"attributes": attributes} if attributes else {}),
+            })
+        metrics.observe("iso_stage_seconds", {"page": self.page, "stage": name}, duration)
+
+    def count(self, event, value=1):
+        with self._lock:
+            self.counters[event] = self.counters.get(event, 0) + value
+        metrics.inc("iso_events_total", {"page": self.page, "event": event}, value)
+
+    def add_tokens(self, model, prompt_tokens, completion_tokens, cost_usd):
+        with self._lock:
+            self.tokens["prompt"] += prompt_tokens
+            self.tokens["completion"] += completion_tokens
+            self.cost_usd += cost_usd
+        metrics.inc("iso_llm_tokens_total", {"page": self.page, "model": model, "kind": "prompt"}, prompt_tokens)
+        metrics.inc("iso_llm_tokens_total", {"page": self.page, "model": model, "kind": "completion"}, completion_tokens)
+        metrics.inc("iso_llm_cost_usd_total", {"page": self.page, "model": model}, cost_usd)
+
+    # Spans with the same name summed up, in order of first appearance
+    def stages(self):
+        stages = {}
+        with self._lock:
+            for span in self.spans:
+                stage = stages.setdefault(span["name"], {"count": 0, "total_s": 0.0})
+                stage["count"] += 1
+                stage["total_s"] += span["duration_s"]
+        return {name: {"count": s["count"], "total_s": round(s["total_s"], 6)} for name, s in stages.items()}
+
+    def finish(self):
+        if self.total_s is None:
+            self.total_s = time.perf_counter() - self.start
+            metrics.observe("iso_turn_seconds", {"page": self.page, "kind": self.kind}, self.total_s)
+            metrics.inc("iso_turns_total", {"page": self.page, "kind": self.kind})
+
+    def as_dict(self):
+        with self._lock:
+            spans = list(self.spans[:max_spans_per_trace])
+            counters = dict(self.counters)
+        return {
+            "trace_id": self.trace_id,
+            "page": self.page,
+            "kind": self.kind,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.started_at)),
+            "total_s": round(self.total_s, 6) if self.total_s is not None else None,
+            "stages": self.stages(),
+            "counters": counters,
+            "tokens": dict(self.tokens),
+            "cost_usd": round(self.cost_usd, 6),
+            "spans": spans,
+            "spans_dropped": max(0, len(self.spans) - max_spans_per_trace),
+        }
+
+
+_trace_logger = None
+_trace_logger_lock = threading.Lock()
+
+
+def _get_trace_logger(path=trace_path):
+    global _trace_logger
+    with _trace_logger_lock:
+        if _trace_logger is None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            handler = RotatingFileHandler(path, maxBytes=trace_max_bytes, backupCount=trace_backup_count, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger = logging.getLogger("iso_traces")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+            _trace_logger = logger
+    return _trace_logger
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+# Context manager for one traced turn; the finished trace is appended to the
+# rotating JSONL trace file
+@contextmanager
+def trace_turn(page, kind="turn"):
+    trace = Trace(page, kind)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        trace.finish()
+        try:
+            _get_trace_logger().info(json.dumps(trace.as_dict(), default=str))
+        except OSError as error:
+            print(f"Could not write trace: {error}")
+
+
+# Context manager timing one stage of the current trace. Outside a trace the
+# duration still goes to the metrics, under page "none". It yields the span's
+# attributes, so values known only at the end of the stage can be added.
+@contextmanager
+def span(name, **attributes):
+    trace = _current_trace.get()
+    start = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        duration = time.perf_counter() - start
+        if trace is not None:
+            trace.add_span(name, start, duration, attributes)
+        else:
+            metrics.observe("iso_stage_seconds", {"page": "none", "stage": name}, duration)
+
+
+def count(event, value=1):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.count(event, value)
+    else:
+        metrics.inc("iso_events_total", {"page": "none", "event": event}, value)
+
+
+def _token_usage(response):
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage:
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    # Streamed chat models report usage on the message instead
+    for generations in response.generations:
+        for generation in generations:
+            usage_metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage_metadata:
+                return usage_metadata.get("input_tokens", 0), usage_metadata.get("output_tokens", 0)
+    return 0, 0
+
+
+def _model_name(response, serialized_model):
+    model = (response.llm_output or {}).get("model_name")
+    if model:
+        return model
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "response_metadata", None) or {}
+            if metadata.get("model_name"):
+                return metadata["model_name"]
+    return serialized_model or "unknown"
+
+
+def _cost(model, prompt_tokens, completion_tokens):
+    from langchain_community.callbacks.openai_info import get_openai_token_cost_for_model
+
+    try:
+        return (get_openai_token_cost_for_model(model, prompt_tokens)
+                + get_openai_token_cost_for_model(model, completion_tokens, is_completion=True))
+    except ValueError:
+        return 0.0
+
+
+# Callback handler turning LLM calls, retriever calls and agent tool runs into
+# spans of a trace, with token and cost counters for the LLM calls
+class TracingCallbackHandler(BaseCallbackHandler):
+    def __init__(self, trace):
+        self.trace = trace
+        self._started = {}
+
+    def _start(self, run_id, name, attributes=None):
+        self._started[run_id] = (name, time.perf_counter(), attributes)
+
+    def _end(self, run_id):
+        name, start, attributes = self._started.pop(run_id, (None, None, None))
+        if name is not None:
+            self.trace.add_span(name, start, time.perf_counter() - start, attributes)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        model = ((kwargs.get("invocation_params") or {}).get("model_name")
+                 or (kwargs.get("invocation_params") or {}).get("model"))
+        self._start(run_id, "llm", {"model": model} if model else None)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.on_llm_start(serialized, [], run_id=run_id, **kwargs)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        attributes = (self._started.get(run_id) or (None, None, None))[2] or {}
+        prompt_tokens, completion_tokens = _token_usage(response)
+        model = _model_name(response, attributes.get("model"))
+        self.trace.add_tokens(model, prompt_tokens, completion_tokens, _cost(model, prompt_tokens, completion_tokens))
+        self.trace.count("llm_calls")
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self.trace.count("llm_errors")
+        self._end(run_id)
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._start(run_id, "retrieval")
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id, "agent_tool", {"tool": (serialized or {}).get("name")})
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self.trace.count("agent_iterations")
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self.trace.count("agent_tool_errors")
+        self._end(run_id)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# Function to serve /metrics on a background thread. Returns None if the port
+# is taken, e.g. by another Streamlit process on the same machine.
+def start_metrics_server(port=metrics_port, host="127.0.0.1"):
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as error:
+        print(f"Metrics endpoint not started on port {port}: {error}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Metrics served on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+# Function to show the stage breakdown of the last turn in the sidebar
+def show_trace_panel(trace_record):
+    import pandas as pd
+    import streamlit as st
+
+    if not st.sidebar.toggle("Show turn timings", value=False):
+        return
+    if trace_record is None:
+        st.sidebar.caption("No turn traced yet.")
+        return
+    st.sidebar.markdown(f"**Last turn:** {trace_record['total_s']:.2f} s")
+    stages = pd.DataFrame(
+        [{"stage": name, "calls": s["count"], "ms": round(s["total_s"] * 1000, 1)} for name, s in trace_record["stages"].items()]
+    )
+    if not stages.empty:
+        st.sidebar.dataframe(stages, hide_index=True)
+    tokens = trace_record["tokens"]
+    st.sidebar.caption(f"Tokens: {tokens['prompt']} prompt / {tokens['completion']} completion, cost ${trace_record['cost_usd']:.4f}")
+    if trace_record["counters"]:
+        st.sidebar.caption(", ".join(f"{name}: {value}" for name, value in sorted(trace_record["counters"].items())))